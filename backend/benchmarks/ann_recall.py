@@ -0,0 +1,96 @@
+"""Recall / latency of the IVF index against the exact gallery search.
+
+The synthetic gallery mimics dlib encodings: identity centres about 0.9 apart
+and samples of one identity about 0.3 from each other. The exact
+``FaceGallery.search`` matches ``face_recognition.face_distance`` (see
+tests/test_face_gallery.py). Each query is a fresh sample of a registered
+identity.
+
+    python benchmarks/ann_recall.py --faces 100000 --nprobe 1 4 8 16 32
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_ann import IVFIndex  # noqa: E402
+from face_gallery import FaceGallery  # noqa: E402
+
+
+def synthetic_gallery(faces: int, per_identity: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    identities = max(1, faces // per_identity)
+    centers = rng.normal(0.0, 0.056, size=(identities, 128)).astype(np.float32)
+    labels = np.repeat(np.arange(identities), per_identity)[:faces]
+    samples = centers[labels] + rng.normal(0.0, 0.015, size=(labels.size, 128)).astype(np.float32)
+    return samples, centers
+
+
+def timed_search(gallery: FaceGallery, queries: np.ndarray, repeats: int, **options) -> tuple[np.ndarray, float]:
+    """Rows of the per-query search and the median milliseconds per query."""
+    rows = []
+    timings = []
+    for query in queries:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = gallery.search(query, k=2, **options)
+            timings.append(time.perf_counter() - start)
+        rows.append(result.rows[0])
+    return np.asarray(rows), float(np.median(timings) * 1000.0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--faces', type=int, default=50000)
+    parser.add_argument('--per-identity', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--nlist', type=int, default=0, help='0 = about 4*sqrt(faces)')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    encodings, centers = synthetic_gallery(args.faces, args.per_identity, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    picked = rng.integers(0, centers.shape[0], size=args.queries)
+    queries = centers[picked] + rng.normal(0.0, 0.015, size=(args.queries, 128)).astype(np.float32)
+
+    index = IVFIndex(nlist=args.nlist, min_train_size=1)
+    gallery = FaceGallery(initial_capacity=len(encodings), ann=index)
+    for row, encoding in enumerate(encodings):
+        gallery.upsert(f'm{row}', '', encoding)
+    start = time.perf_counter()
+    gallery.install_index(index.fit(gallery.export()[0]))
+    train_sec = time.perf_counter() - start
+
+    exact_rows, exact_ms = timed_search(gallery, queries, args.repeats)
+    stats = gallery.ann_stats()
+    print(
+        f'faces={len(gallery)} cells={stats["cells"]} largest_cell={stats["largest_cell"]} '
+        f'train={train_sec:.2f}s queries={args.queries}'
+    )
+    print(f'{"mode":<12}{"recall@1":>10}{"recall@2":>10}{"ms/query":>10}{"speedup":>9}')
+    print(f'{"exact":<12}{1.0:>10.3f}{1.0:>10.3f}{exact_ms:>10.2f}{1.0:>8.1f}x')
+    for nprobe in args.nprobe:
+        rows, approx_ms = timed_search(gallery, queries, args.repeats, approximate=True, nprobe=nprobe)
+        recall1 = float(np.mean(rows[:, 0] == exact_rows[:, 0]))
+        recall2 = float(np.mean([
+            len(set(found.tolist()) & set(expected.tolist())) / 2.0
+            for found, expected in zip(rows, exact_rows)
+        ]))
+        print(
+            f'{"nprobe=" + str(nprobe):<12}{recall1:>10.3f}{recall2:>10.3f}'
+            f'{approx_ms:>10.2f}{exact_ms / approx_ms:>8.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
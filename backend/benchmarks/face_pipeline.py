@@ -0,0 +1,441 @@
+"""Face pipeline micro-benchmarks with machine-readable (JSON) results.
+
+Sections (``--only`` picks some of them):
+
+- ``decode`` -- base64 upload -> bytes -> RGB array (``decode_base64_bytes``
+  + ``decode_image_bytes``) of synthetic JPEGs of several sizes;
+- ``detect`` -- ``detect_faces_optimized`` for every ``--max-image-size`` x
+  ``--upsample`` combination: the whole call and each cascade stage it ran.
+  A synthetic frame has no face, so every fallback stage runs on it; real
+  photos (``--image``) show the usual primary-pass cost;
+- ``encode`` -- ``face_encodings`` of one face at each of ``--jitters``;
+- ``search`` -- ``FaceGallery.search`` over N synthetic encodings (1k..1M):
+  the whole gallery, one device partition and, with ``--ann``, the IVF
+  shortlist, for each of ``--precisions``.
+
+Detection and encoding need face_recognition; without it they are reported
+as skipped. Caches are disabled and cascade statistics go to a temporary
+file, so repeated runs measure the same work and leave the server's state
+alone. Other settings come from .env / the environment as for the server.
+
+The JSON document holds the environment, the settings and one record per
+measurement (``name`` + ``params`` identify it). ``--compare`` matches the
+records of an earlier run and exits with 1 when a median got slower than
+``--tolerance`` allows:
+
+    python benchmarks/face_pipeline.py --output bench-before.json
+    python benchmarks/face_pipeline.py --only search --sizes 1000 10000 --compare bench-before.json
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+from PIL import Image
+
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_ann import IVFIndex  # noqa: E402
+from face_gallery import FaceGallery  # noqa: E402
+
+SUITE_VERSION = 1
+SECTIONS = ('decode', 'detect', 'encode', 'search')
+
+
+def log(message: str) -> None:
+    print(message, file=sys.stderr, flush=True)
+
+
+def measure(fn: Callable[[], Any], repeats: int, warmup: int = 1) -> dict[str, Any]:
+    """Timing statistics (ms) of ``repeats`` calls after ``warmup`` untimed ones."""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return summarize(timings)
+
+
+def summarize(timings: list[float]) -> dict[str, Any]:
+    values = np.asarray(timings, dtype=np.float64)
+    return {
+        'repeats': int(values.size),
+        'median_ms': round(float(np.median(values)), 4),
+        'p90_ms': round(float(np.percentile(values, 90)), 4),
+        'min_ms': round(float(values.min()), 4),
+        'mean_ms': round(float(values.mean()), 4),
+    }
+
+
+def record(results: list[dict[str, Any]], name: str, params: dict[str, Any], stats: dict[str, Any]) -> None:
+    results.append({'name': name, 'params': params, **stats})
+    log(f'  {name:<18} {json.dumps(params, ensure_ascii=False):<70} {stats["median_ms"]:>10.3f} ms')
+
+
+def synthetic_photo(width: int, height: int, seed: int) -> np.ndarray:
+    """Smooth gradients plus sensor-like noise: realistic JPEG size, no faces."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        128 + 90 * np.sin(x / (37 + 11 * channel) + y / (53 + 7 * channel) + channel) for channel in range(3)
+    ], axis=-1)
+    noise = rng.normal(0.0, 12.0, size=base.shape).astype(np.float32)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def jpeg_bytes(image: np.ndarray, quality: int = 90) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def synthetic_encodings(count: int, per_identity: int, seed: int) -> np.ndarray:
+    """dlib-like float32 encodings as in ann_recall.py, generated without float64 temporaries."""
+    rng = np.random.default_rng(seed)
+    identities = max(1, count // per_identity)
+    centers = rng.standard_normal((identities, 128), dtype=np.float32)
+    centers *= 0.056
+    samples = centers[np.repeat(np.arange(identities), per_identity)[:count]]
+    if samples.shape[0] < count:
+        samples = np.vstack([samples, centers[:count - samples.shape[0]]])
+    for start in range(0, count, 65536):
+        block = samples[start:start + 65536]
+        block += 0.015 * rng.standard_normal(block.shape, dtype=np.float32)
+    return samples
+
+
+# ----------------------------------------------------------------------
+# Service-backed sections
+# ----------------------------------------------------------------------
+def import_service(workers: int):
+    """Import telegram_service with caches off and cascade statistics in a temp file."""
+    os.environ['FACE_WORKER_PROCESSES'] = str(workers)
+    os.environ['FACE_CACHE_MAX_MB'] = '0'
+    os.environ['FACE_DISK_CACHE_MAX_MB'] = '0'
+    os.environ['FACE_CASCADE_ADAPTIVE'] = '0'
+    os.environ['FACE_CASCADE_STATS_FILE'] = str(Path(tempfile.mkdtemp(prefix='face-bench-')) / 'cascade.json')
+    import logging
+
+    import telegram_service as ts
+
+    logging.getLogger('telegram_service').setLevel(logging.WARNING)
+    return ts
+
+
+def service_settings(ts) -> dict[str, Any]:
+    return {
+        'max_image_size': ts.MAX_IMAGE_SIZE,
+        'decode_max_image_size': ts.DECODE_MAX_IMAGE_SIZE,
+        'decode_draft': ts.FACE_DECODE_DRAFT,
+        'face_model': ts.FACE_MODEL,
+        'upsample': ts.NUMBER_OF_TIMES_TO_UPSAMPLE,
+        'fallback_upsample': ts.FALLBACK_UPSAMPLE,
+        'recognize_jitters': ts.NUM_JITTERS,
+        'register_jitters': ts.REGISTER_JITTERS,
+        'encoding_model': ts.ENCODING_MODEL,
+        'worker_processes': ts.FACE_WORKER_PROCESSES,
+        'cuda': ts.CUDA_ENABLED,
+    }
+
+
+def bench_decode(ts, photos: dict[str, bytes], repeats: int, results: list[dict[str, Any]]) -> None:
+    log('decode')
+    for label, data in photos.items():
+        payload = 'data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii')
+        params = {'image': label, 'jpeg_kb': round(len(data) / 1024), 'max_image_size': ts.MAX_IMAGE_SIZE}
+        record(results, 'decode.base64', params, measure(lambda: ts.decode_base64_bytes(payload), repeats))
+        record(results, 'decode.image', params, measure(lambda: ts.decode_image_bytes(data), repeats))
+
+
+def bench_detect(
+    ts,
+    photos: dict[str, bytes],
+    max_sizes: list[int],
+    upsamples: list[int],
+    repeats: int,
+    results: list[dict[str, Any]],
+) -> None:
+    log('detect')
+    saved = (ts.MAX_IMAGE_SIZE, ts.NUMBER_OF_TIMES_TO_UPSAMPLE, ts.FALLBACK_UPSAMPLE)
+    try:
+        for max_size in max_sizes:
+            for upsample in upsamples:
+                # Module settings are read on every call, so a sweep needs no restart.
+                ts.MAX_IMAGE_SIZE = max_size
+                ts.NUMBER_OF_TIMES_TO_UPSAMPLE = upsample
+                ts.FALLBACK_UPSAMPLE = max(upsample, saved[2])
+                for label, data in photos.items():
+                    image = ts.decode_image_bytes(data)
+                    params = {'image': label, 'max_image_size': max_size, 'upsample': upsample}
+                    totals: list[float] = []
+                    stages: dict[str, list[float]] = {}
+                    found = 0
+                    for _ in range(max(1, repeats)):
+                        report: dict[str, Any] = {}
+                        start = time.perf_counter()
+                        found = len(ts.detect_faces_optimized(image, report=report))
+                        totals.append((time.perf_counter() - start) * 1000.0)
+                        for stage in report['stages']:
+                            stages.setdefault(stage['stage'], []).append(float(stage['ms']))
+                    record(results, 'detect.total', params, {**summarize(totals), 'faces': found})
+                    for stage_name, timings in stages.items():
+                        record(results, 'detect.stage', {**params, 'stage': stage_name}, summarize(timings))
+    finally:
+        ts.MAX_IMAGE_SIZE, ts.NUMBER_OF_TIMES_TO_UPSAMPLE, ts.FALLBACK_UPSAMPLE = saved
+
+
+def bench_encode(
+    ts,
+    photos: dict[str, bytes],
+    jitters: list[int],
+    repeats: int,
+    results: list[dict[str, Any]],
+) -> None:
+    log('encode')
+    targets = []
+    for label, data in photos.items():
+        image = ts.decode_image_bytes(data)
+        locations = ts.detect_faces_optimized(image) if not label.startswith('synthetic') else []
+        if locations:
+            targets.append((label, image, locations[0]))
+    if not targets:
+        # No real face: the landmark model and the network still run on a face-sized box.
+        image = ts.decode_image_bytes(next(iter(photos.values())))
+        height, width = image.shape[:2]
+        side = min(height, width) // 3
+        top, left = (height - side) // 2, (width - side) // 2
+        targets.append(('synthetic-box', image, (top, left + side, top + side, left)))
+
+    for label, image, location in targets:
+        for num_jitters in jitters:
+            params = {'image': label, 'jitters': num_jitters, 'model': ts.ENCODING_MODEL}
+            stats = measure(
+                lambda: ts.face_worker_pool.face_encodings(image, [location], num_jitters, ts.ENCODING_MODEL),
+                repeats,
+            )
+            record(results, 'encode', params, stats)
+
+
+# ----------------------------------------------------------------------
+# Gallery search
+# ----------------------------------------------------------------------
+def bench_search(
+    sizes: list[int],
+    precisions: list[str],
+    partition_size: int,
+    ann: bool,
+    nprobe: int,
+    batch_faces: list[int],
+    repeats: int,
+    seed: int,
+    results: list[dict[str, Any]],
+) -> None:
+    log('search')
+    rng = np.random.default_rng(seed + 1)
+    for size in sizes:
+        matrix = synthetic_encodings(size, 3, seed)
+        ids = [f'fo1_{row // partition_size + 1}_{row:016x}' for row in range(size)]
+        blanks = [''] * size
+        probe_rows = rng.integers(0, size, size=max(batch_faces) * 8)
+        probes = matrix[probe_rows] + 0.015 * rng.standard_normal((probe_rows.size, 128), dtype=np.float32)
+        for precision in precisions:
+            gallery = FaceGallery(
+                partition_key=lambda member_id: member_id.split('_')[1],
+                precision=precision,
+                ann=IVFIndex(nprobe=nprobe, min_train_size=1) if ann else None,
+            )
+            start = time.perf_counter()
+            gallery.adopt(matrix, ids, blanks, blanks)
+            load_ms = (time.perf_counter() - start) * 1000.0
+            snapshot = gallery.snapshot()
+            storage = snapshot.storage_stats()
+            base = {'faces': size, 'precision': precision}
+            record(results, 'search.load', base, {**summarize([load_ms]), 'bytes': storage['bytes']})
+
+            for faces in batch_faces:
+                batches = [probes[index:index + faces] for index in range(0, faces * 8, faces)]
+                cursor = iter(range(1 << 30))
+
+                def exact(batches=batches, cursor=cursor):
+                    snapshot.search(batches[next(cursor) % len(batches)], k=2)
+
+                record(results, 'search.exact', {**base, 'batch': faces}, measure(exact, repeats))
+
+            device = str(int(probe_rows[0]) // partition_size + 1)
+
+            def scoped():
+                snapshot.search(probes[:1], k=2, rows=snapshot.partition_rows(device))
+
+            record(results, 'search.partition', {**base, 'partition': partition_size}, measure(scoped, repeats))
+
+            if ann:
+                start = time.perf_counter()
+                gallery.install_index(gallery.ann.fit(snapshot.export()[0]))
+                train_ms = (time.perf_counter() - start) * 1000.0
+                snapshot = gallery.snapshot()
+                record(results, 'search.ann_train', base, summarize([train_ms]))
+
+                def approximate():
+                    snapshot.search(probes[:1], k=2, approximate=True, nprobe=nprobe)
+
+                record(results, 'search.ann', {**base, 'nprobe': nprobe}, measure(approximate, repeats))
+            del gallery, snapshot
+        del matrix, ids, probes
+
+
+# ----------------------------------------------------------------------
+# Report
+# ----------------------------------------------------------------------
+def environment() -> dict[str, Any]:
+    info: dict[str, Any] = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+    try:
+        info['git_commit'] = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=_BACKEND, capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        info['git_commit'] = None
+    return info
+
+
+def result_key(result: dict[str, Any]) -> str:
+    return result['name'] + ' ' + json.dumps(result['params'], sort_keys=True, ensure_ascii=False)
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> int:
+    """Print median changes against ``baseline``; returns the number of regressions."""
+    previous = {result_key(result): result for result in baseline.get('results', [])}
+    regressions = 0
+    log(f'compare with {baseline.get("environment", {}).get("git_commit") or "baseline"} (tolerance {tolerance:.0%})')
+    for result in current['results']:
+        old = previous.get(result_key(result))
+        if old is None or not old.get('median_ms'):
+            continue
+        ratio = result['median_ms'] / old['median_ms']
+        slower = ratio > 1.0 + tolerance
+        regressions += slower
+        log(
+            f'  {"REGRESSION" if slower else "ok":<10} {result_key(result):<90} '
+            f'{old["median_ms"]:>10.3f} -> {result["median_ms"]:>10.3f} ms ({ratio:.2f}x)'
+        )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument('--image', type=Path, nargs='*', default=[], help='real photos for decode/detect/encode')
+    parser.add_argument('--photo-sizes', type=int, nargs='+', default=[1280, 1920, 4032],
+                        help='long side of the synthetic photos')
+    parser.add_argument('--max-image-size', type=int, nargs='+', default=None,
+                        help='MAX_IMAGE_SIZE values for detect (default: current setting)')
+    parser.add_argument('--upsample', type=int, nargs='+', default=None,
+                        help='FACE_UPSAMPLE values for detect (default: current setting)')
+    parser.add_argument('--jitters', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--workers', type=int, default=0, help='face worker processes (0 = in-process)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--precisions', nargs='+', default=['float32', 'int8'], choices=['float32', 'float16', 'int8'])
+    parser.add_argument('--partition-size', type=int, default=50, help='faces per synthetic device')
+    parser.add_argument('--batch-faces', type=int, nargs='+', default=[1, 8], help='query faces per search')
+    parser.add_argument('--ann', action='store_true', help='also train and time the IVF index')
+    parser.add_argument('--nprobe', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--detect-repeats', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, help='write JSON here instead of stdout')
+    parser.add_argument('--compare', type=Path, help='JSON of an earlier run to compare medians with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown for --compare')
+    args = parser.parse_args(argv)
+
+    document: dict[str, Any] = {
+        'suite': 'face_pipeline',
+        'version': SUITE_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': environment(),
+        'settings': {},
+        'skipped': {},
+        'results': [],
+    }
+    results = document['results']
+
+    service_sections = [section for section in args.only if section != 'search']
+    if service_sections:
+        ts = import_service(args.workers)
+        document['settings'] = service_settings(ts)
+        document['environment']['face_recognition'] = ts.FACE_RECOGNITION_AVAILABLE
+        photos = {
+            f'synthetic-{size}': jpeg_bytes(synthetic_photo(size, size * 3 // 4, args.seed + size))
+            for size in args.photo_sizes
+        }
+        photos.update({path.name: path.read_bytes() for path in args.image})
+        try:
+            if 'decode' in args.only:
+                bench_decode(ts, photos, args.repeats, results)
+            for section in ('detect', 'encode'):
+                if section in args.only and not ts.FACE_RECOGNITION_AVAILABLE:
+                    document['skipped'][section] = f'face_recognition is unavailable: {ts.FACE_RECOGNITION_IMPORT_ERROR}'
+                    log(f'{section}: skipped ({document["skipped"][section]})')
+            if 'detect' in args.only and ts.FACE_RECOGNITION_AVAILABLE:
+                bench_detect(
+                    ts,
+                    photos,
+                    args.max_image_size or [ts.MAX_IMAGE_SIZE],
+                    args.upsample or [ts.NUMBER_OF_TIMES_TO_UPSAMPLE],
+                    args.detect_repeats,
+                    results,
+                )
+            if 'encode' in args.only and ts.FACE_RECOGNITION_AVAILABLE:
+                bench_encode(ts, photos, args.jitters, max(1, args.repeats // 4), results)
+        finally:
+            ts.face_worker_pool.shutdown()
+
+    if 'search' in args.only:
+        bench_search(
+            args.sizes,
+            args.precisions,
+            max(1, args.partition_size),
+            args.ann,
+            args.nprobe,
+            args.batch_faces,
+            args.repeats,
+            args.seed,
+            results,
+        )
+
+    payload = json.dumps(document, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(payload + '\n', encoding='utf-8')
+        log(f'results written to {args.output}')
+    else:
+        print(payload)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding='utf-8'))
+        if compare(document, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,92 @@
+"""Accuracy / memory / latency of float16 and int8 gallery storage against float32.
+
+Uses the same synthetic dlib-like gallery as ann_recall.py, or the float32
+snapshot of a real gallery store (``--gallery-dir``). Accuracy numbers come
+from ``face_quant.evaluate_precision``: distance error, nearest-row changes
+and recognition outcome changes under ``--threshold`` / ``--margin``.
+
+    python benchmarks/quant_eval.py --faces 100000
+    python benchmarks/quant_eval.py --gallery-dir face_gallery --threshold 0.5 --margin 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_gallery import FaceGallery, FaceGalleryStore  # noqa: E402
+from face_quant import PRECISIONS, evaluate_precision  # noqa: E402
+
+from ann_recall import synthetic_gallery  # noqa: E402
+
+
+def search_ms(gallery: FaceGallery, queries: np.ndarray, repeats: int) -> float:
+    """Median milliseconds of one whole-gallery search per query."""
+    timings = []
+    for query in queries:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            gallery.search(query, k=2)
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000.0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--faces', type=int, default=50000)
+    parser.add_argument('--per-identity', type=int, default=3)
+    parser.add_argument('--gallery-dir', type=Path, help='evaluate the snapshot of this gallery store instead')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--timed-queries', type=int, default=50)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--margin', type=float, default=0.05)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.gallery_dir:
+        reference = FaceGalleryStore(args.gallery_dir).read_matrix()
+        if reference is None:
+            raise SystemExit(f'No gallery snapshot in {args.gallery_dir}')
+        reference = np.asarray(reference, dtype=np.float32)
+    else:
+        reference, _ = synthetic_gallery(args.faces, args.per_identity, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    timed = reference[rng.integers(0, reference.shape[0], size=args.timed_queries)]
+    timed = timed + rng.normal(0.0, 0.015, size=timed.shape).astype(np.float32)
+
+    print(f'faces={reference.shape[0]} queries={args.queries} threshold={args.threshold} margin={args.margin}')
+    print(
+        f'{"precision":<10}{"B/face":>8}{"x":>6}{"err mean":>10}{"err max":>10}'
+        f'{"top1 diff":>11}{"decision":>10}{"ms/query":>10}'
+    )
+    for precision in PRECISIONS:
+        report = evaluate_precision(
+            reference,
+            precision,
+            query_count=args.queries,
+            threshold=args.threshold,
+            margin=args.margin,
+            max_rows=reference.shape[0],
+            seed=args.seed,
+        )
+        gallery = FaceGallery(precision=precision)
+        blanks = [''] * reference.shape[0]
+        gallery.adopt(reference, [f'm{row}' for row in range(reference.shape[0])], blanks, blanks)
+        print(
+            f'{precision:<10}{report["bytes_per_face"]:>8}{report["compression"]:>6.2f}'
+            f'{report["distance_error_mean"]:>10.2e}{report["distance_error_max"]:>10.2e}'
+            f'{report["top1_disagreement"]:>11.4f}{report["decision_disagreement"]:>10.4f}'
+            f'{search_ms(gallery, timed, args.repeats):>10.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import functools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+
+class AdmissionRejected(Exception):
+    """No slot for the request: the wait queue is full or the wait timed out.
+
+    ``retry_after`` is a whole number of seconds suggested to the client.
+    """
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """Concurrency limit with a bounded FIFO wait queue for heavy requests.
+
+    At most ``limit`` callers hold a slot at once. Up to ``max_queue`` more
+    wait for one, in arrival order, for at most ``max_wait_sec``; anyone
+    beyond that is rejected at once with ``AdmissionRejected('queue_full')``
+    and a waiter that runs out of time with ``AdmissionRejected('timeout')``.
+    Waiting requests still hold a server thread, so ``limit + max_queue``
+    should stay below the server's thread count to keep the other endpoints
+    responsive.
+
+    ``retry_after`` estimates when a slot frees up from the moving average of
+    how long slots are held and how many requests are ahead.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        *,
+        max_queue: int = 0,
+        max_wait_sec: float = 10.0,
+        max_retry_after_sec: int = 60,
+    ) -> None:
+        self.limit = max(1, int(limit))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait_sec = max(0.0, float(max_wait_sec))
+        self.max_retry_after_sec = max(1, int(max_retry_after_sec))
+        self._lock = threading.Lock()
+        self._waiters: deque[threading.Event] = deque()
+        self._active = 0
+        self._admitted = 0
+        self._queued = 0
+        self._admitted_after_wait = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+        self._peak_waiting = 0
+        self._wait_total_sec = 0.0
+        self._wait_max_sec = 0.0
+        self._hold_avg_sec = 0.0
+
+    def retry_after(self) -> int:
+        with self._lock:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self) -> int:
+        ahead = len(self._waiters) + 1
+        estimate = self._hold_avg_sec * ahead / self.limit
+        return max(1, min(self.max_retry_after_sec, math.ceil(estimate)))
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        if reason == 'queue_full':
+            self._rejected_queue_full += 1
+        else:
+            self._rejected_timeout += 1
+        return AdmissionRejected(reason, self._retry_after_locked())
+
+    def acquire(self) -> float:
+        """Take a slot, waiting in the queue if needed. Returns the wait in seconds."""
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                self._admitted += 1
+                return 0.0
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject('queue_full')
+            ticket = threading.Event()
+            self._waiters.append(ticket)
+            self._queued += 1
+            self._peak_waiting = max(self._peak_waiting, len(self._waiters))
+
+        started = time.monotonic()
+        ticket.wait(self.max_wait_sec)
+        waited = time.monotonic() - started
+        with self._lock:
+            # A release may hand the slot over right after the wait timed out.
+            if not ticket.is_set():
+                self._waiters.remove(ticket)
+                raise self._reject('timeout')
+            self._admitted += 1
+            self._admitted_after_wait += 1
+            self._wait_total_sec += waited
+            self._wait_max_sec = max(self._wait_max_sec, waited)
+        return waited
+
+    def release(self, held_sec: float | None = None) -> None:
+        with self._lock:
+            if held_sec is not None:
+                self._hold_avg_sec = held_sec if not self._hold_avg_sec else 0.8 * self._hold_avg_sec + 0.2 * held_sec
+            if self._waiters:
+                # The slot goes straight to the oldest waiter; ``_active`` is unchanged.
+                self._waiters.popleft().set()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def slot(self) -> Iterator[float]:
+        waited = self.acquire()
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - started)
+
+    def guard(self, on_reject: Callable[[AdmissionRejected], Any]) -> Callable:
+        """Decorator running a view inside ``slot()``; ``on_reject`` builds the refusal."""
+        def decorator(view: Callable) -> Callable:
+            @functools.wraps(view)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                try:
+                    self.acquire()
+                except AdmissionRejected as rejected:
+                    return on_reject(rejected)
+                started = time.monotonic()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release(time.monotonic() - started)
+            return wrapper
+        return decorator
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            waited = self._admitted_after_wait
+            return {
+                'limit': self.limit,
+                'max_queue': self.max_queue,
+                'max_wait_sec': self.max_wait_sec,
+                'active': self._active,
+                'waiting': len(self._waiters),
+                'peak_waiting': self._peak_waiting,
+                'admitted': self._admitted,
+                'queued': self._queued,
+                'rejected_queue_full': self._rejected_queue_full,
+                'rejected_timeout': self._rejected_timeout,
+                'wait_avg_ms': round(1000 * self._wait_total_sec / waited, 1) if waited else 0.0,
+                'wait_max_ms': round(1000 * self._wait_max_sec, 1),
+                'hold_avg_ms': round(1000 * self._hold_avg_sec, 1),
+                'retry_after_sec': self._retry_after_locked(),
+            }
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import math
+from typing import Any
+
+import numpy as np
+
+
+def _squared_distances(points: np.ndarray, centroids: np.ndarray, centroid_norms: np.ndarray) -> np.ndarray:
+    """(points x centroids) squared Euclidean distances via one matrix product."""
+    squared = points @ centroids.T
+    squared *= -2.0
+    squared += np.einsum('ij,ij->i', points, points)[:, None]
+    squared += centroid_norms[None, :]
+    return squared
+
+
+def _nearest_centroids(
+    points: np.ndarray,
+    centroids: np.ndarray,
+    centroid_norms: np.ndarray,
+    chunk_rows: int = 4096,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Nearest centroid and its squared distance per point, in bounded-memory chunks."""
+    labels = np.empty(points.shape[0], dtype=np.intp)
+    nearest = np.empty(points.shape[0], dtype=np.float32)
+    for start in range(0, points.shape[0], chunk_rows):
+        squared = _squared_distances(points[start:start + chunk_rows], centroids, centroid_norms)
+        chunk_labels = np.argmin(squared, axis=1)
+        labels[start:start + chunk_rows] = chunk_labels
+        nearest[start:start + chunk_rows] = squared[np.arange(squared.shape[0]), chunk_labels]
+    return labels, nearest
+
+
+def kmeans(data: np.ndarray, clusters: int, *, iterations: int = 12, seed: int = 0) -> np.ndarray:
+    """Lloyd k-means over the rows of ``data``; returns float32 (clusters, dim) centroids.
+
+    Centroids start from distinct random rows. A cluster that ends up empty
+    is re-seeded with the point farthest from its current centroid, so every
+    inverted list stays in use.
+    """
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    count = data.shape[0]
+    clusters = max(1, min(int(clusters), count))
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(count, size=clusters, replace=False)].copy()
+
+    for _ in range(max(1, int(iterations))):
+        norms = np.einsum('ij,ij->i', centroids, centroids)
+        labels, nearest = _nearest_centroids(data, centroids, norms)
+        sizes = np.bincount(labels, minlength=clusters)
+        filled = sizes > 0
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))[filled]
+        centroids[filled] = np.add.reduceat(data[order], starts, axis=0) / sizes[filled, None]
+        empty = np.flatnonzero(~filled)
+        if empty.size:
+            for cluster, row in zip(empty, np.argsort(nearest)[::-1]):
+                centroids[cluster] = data[row]
+    return centroids
+
+
+class IVFState:
+    """Centroids and inverted lists of a trained ``IVFIndex``.
+
+    Each cell keeps its gallery rows in a numpy array. ``set_row`` and
+    ``remove_row`` replace the touched cell arrays instead of editing them,
+    so a ``copy()`` (new list of the same arrays) published with a gallery
+    snapshot is never modified by later writes.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        cells: list[np.ndarray],
+        assign: np.ndarray,
+        count: int,
+        trained_size: int,
+    ) -> None:
+        self.centroids = centroids
+        self.centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+        self.cells = cells
+        self.assign = assign
+        self.count = count
+        self.trained_size = trained_size
+
+    @classmethod
+    def build(cls, centroids: np.ndarray, matrix: np.ndarray) -> IVFState:
+        """Assign every row of ``matrix`` to its nearest centroid."""
+        centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        count = matrix.shape[0]
+        norms = np.einsum('ij,ij->i', centroids, centroids)
+        labels, _ = _nearest_centroids(np.asarray(matrix, dtype=np.float32), centroids, norms)
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(centroids.shape[0] + 1))
+        cells = [order[bounds[cell]:bounds[cell + 1]].astype(np.intp) for cell in range(centroids.shape[0])]
+        assign = np.zeros(max(1, count), dtype=np.int32)
+        assign[:count] = labels
+        return cls(centroids, cells, assign, count, count)
+
+    def copy(self) -> IVFState:
+        state = IVFState.__new__(IVFState)
+        state.centroids = self.centroids
+        state.centroid_norms = self.centroid_norms
+        state.cells = list(self.cells)
+        state.assign = self.assign.copy()
+        state.count = self.count
+        state.trained_size = self.trained_size
+        return state
+
+    def nearest_cells(self, vectors: Any, probes: int) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        squared = _squared_distances(vectors, self.centroids, self.centroid_norms)
+        probes = min(probes, squared.shape[1])
+        if probes >= squared.shape[1]:
+            return np.broadcast_to(np.arange(squared.shape[1]), (vectors.shape[0], squared.shape[1]))
+        return np.argpartition(squared, probes - 1, axis=1)[:, :probes]
+
+    # ------------------------------------------------------------------
+    # Incremental maintenance (on a private copy, under the gallery writer lock)
+    # ------------------------------------------------------------------
+    def _link(self, row: int, cell: int) -> None:
+        self.assign[row] = cell
+        self.cells[cell] = np.append(self.cells[cell], row)
+
+    def _unlink(self, row: int) -> None:
+        cell = int(self.assign[row])
+        members = self.cells[cell]
+        self.cells[cell] = members[members != row]
+
+    def set_row(self, row: int, vector: Any) -> None:
+        """Row ``row`` was appended or its encoding replaced."""
+        if row >= self.count:
+            if row >= self.assign.shape[0]:
+                assign = np.zeros(max(2 * self.assign.shape[0], row + 1), dtype=np.int32)
+                assign[:self.count] = self.assign[:self.count]
+                self.assign = assign
+            self.count = row + 1
+        else:
+            self._unlink(row)
+        self._link(row, int(self.nearest_cells(vector, 1)[0, 0]))
+
+    def remove_row(self, row: int) -> None:
+        """Row ``row`` was deleted and the gallery moved its last row into it."""
+        last = self.count - 1
+        self._unlink(row)
+        if row != last:
+            cell = int(self.assign[last])
+            self._unlink(last)
+            self._link(row, cell)
+        self.count = last
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def candidates(self, queries: Any, nprobe: int) -> np.ndarray:
+        """Sorted gallery rows in the ``nprobe`` nearest cells of any query."""
+        cells = np.unique(self.nearest_cells(queries, nprobe))
+        if not cells.size:
+            return np.zeros(0, dtype=np.intp)
+        rows = np.concatenate([self.cells[int(cell)] for cell in cells])
+        rows.sort()
+        return rows
+
+
+class IVFIndex:
+    """Inverted-file (IVF) approximate index settings and training.
+
+    k-means splits the encodings into ``nlist`` cells; every gallery row is
+    kept in the inverted list of its nearest centroid (``IVFState``, carried
+    by each gallery snapshot). A query only scans the rows of its ``nprobe``
+    nearest cells, and the caller re-ranks that shortlist with exact
+    distances, so ``nprobe`` trades recall for latency (``nprobe == nlist``
+    is an exact search).
+
+    The gallery updates the lists on every row change, which keeps them
+    current as faces are added and removed. The centroids themselves come
+    from ``fit``: ``needs_training`` says when the gallery has reached
+    ``min_train_size`` or grown by ``retrain_growth`` since the last
+    training. ``fit`` is pure and may run outside the gallery lock.
+    """
+
+    def __init__(
+        self,
+        *,
+        nlist: int = 0,
+        nprobe: int = 8,
+        min_train_size: int = 5000,
+        retrain_growth: float = 2.0,
+        train_sample: int = 65536,
+        iterations: int = 12,
+        seed: int = 0,
+    ) -> None:
+        self.nlist = max(0, int(nlist))
+        self.nprobe = max(1, int(nprobe))
+        self.min_train_size = max(1, int(min_train_size))
+        self.retrain_growth = max(1.0, float(retrain_growth))
+        self.train_sample = max(1, int(train_sample))
+        self.iterations = max(1, int(iterations))
+        self.seed = seed
+
+    def cell_count(self, size: int) -> int:
+        """Number of cells for ``size`` rows: ``nlist`` or about 4 * sqrt(size)."""
+        if self.nlist:
+            return max(1, min(self.nlist, size))
+        return max(1, min(size, int(4 * math.sqrt(size))))
+
+    def needs_training(self, size: int, state: IVFState | None) -> bool:
+        if size < self.min_train_size:
+            return False
+        if state is None:
+            return True
+        return size >= state.trained_size * self.retrain_growth
+
+    def training_sample(self, matrix: np.ndarray) -> np.ndarray:
+        """Copy of at most ``train_sample`` random rows of ``matrix``."""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.shape[0] <= self.train_sample:
+            return np.array(matrix, dtype=np.float32, copy=True)
+        rng = np.random.default_rng(self.seed)
+        return matrix[np.sort(rng.choice(matrix.shape[0], size=self.train_sample, replace=False))]
+
+    def fit(self, matrix: np.ndarray) -> np.ndarray:
+        """k-means centroids for ``matrix`` (sampled down to ``train_sample`` rows)."""
+        sample = self.training_sample(matrix)
+        return kmeans(sample, self.cell_count(sample.shape[0]), iterations=self.iterations, seed=self.seed)
+
+    def stats(self, state: IVFState | None) -> dict[str, Any]:
+        sizes = [cell.shape[0] for cell in state.cells] if state is not None else []
+        return {
+            'trained': state is not None,
+            'cells': len(sizes),
+            'nprobe': self.nprobe,
+            'rows': state.count if state is not None else 0,
+            'trained_size': state.trained_size if state is not None else 0,
+            'largest_cell': max(sizes) if sizes else 0,
+            'min_train_size': self.min_train_size,
+        }
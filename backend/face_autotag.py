@@ -0,0 +1,518 @@
+from __future__ import annotations
+
+import base64
+import json
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import numpy as np
+
+from face_gallery import FaceGallery
+from sql_repository import resolve_storage_path, utcnow_sql
+
+AUTOTAG_SOURCE = 'face_auto'
+
+_ASSET_NAME = re.compile(r'^assets/([0-9a-f]{64})\.(?:jpe?g|png)$', re.IGNORECASE)
+
+
+class AutoTagBusy(Exception):
+    """An auto-tagging run is already in progress."""
+
+
+class BackupAutoTagger:
+    """Offline auto-tagging of the photos inside stored backup archives.
+
+    For every stored snapshot whose tree owner has a device id, the
+    ``assets/<sha256>.jpg`` members of the zip are streamed one by one and
+    those without a ``photo_face_scans`` row for the current ``fingerprint``
+    go through ``detect_encode(bytes) -> (locations, encodings)`` on
+    ``workers`` threads (the heavy work itself runs in the face worker
+    processes). Before each asset is handed out the run waits while
+    ``busy()`` says interactive face requests are in progress.
+
+    Faces are matched against the owner's partition of the gallery with the
+    same threshold / margin rules as recognition. A matched gallery member
+    is tagged only when it is already mapped to a ``persons`` row of the
+    tree through ``face_encodings.external_member_id``; the run never creates
+    people, other matches are counted as ``unmapped``. Every asset
+    is committed in one transaction -- its ``photos`` row, the suggested
+    ``photo_person_tags`` (source ``face_auto``; tags set by people are never
+    changed) and its scan row -- so a restart resumes after the last asset
+    and never processes an unchanged photo twice. Assets whose scan failed
+    are recorded as ``failed`` and tried again by the next run.
+    """
+
+    def __init__(
+        self,
+        db_path: str | Path,
+        base_dir: str | Path,
+        gallery: FaceGallery,
+        detect_encode: Callable[[bytes], tuple[list, list]],
+        fingerprint: str,
+        *,
+        threshold: float = 0.6,
+        margin: float = 0.0,
+        workers: int = 1,
+        busy: Callable[[], bool] | None = None,
+        busy_poll_sec: float = 0.5,
+        logger=None,
+    ) -> None:
+        self.db_path = Path(db_path)
+        self.base_dir = Path(base_dir)
+        self.gallery = gallery
+        self.detect_encode = detect_encode
+        self.fingerprint = fingerprint
+        self.threshold = float(threshold)
+        self.margin = float(margin)
+        self.workers = max(1, int(workers))
+        self.busy = busy
+        self.busy_poll_sec = max(0.01, float(busy_poll_sec))
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._cancel = threading.Event()
+        self._progress: dict[str, Any] = {'status': 'idle'}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    # ------------------------------------------------------------------
+    # Control
+    # ------------------------------------------------------------------
+    def start(self, rematch: bool = False) -> dict[str, Any]:
+        """Run in a background thread; raises ``AutoTagBusy`` if one is running."""
+        with self._lock:
+            if self.running:
+                raise AutoTagBusy('Backup auto-tagging is already running')
+            self._cancel.clear()
+            self._progress = {'status': 'starting'}
+            self._thread = threading.Thread(
+                target=self._run_logged, args=(rematch,), name='face-autotag', daemon=True
+            )
+            self._thread.start()
+        return self.status()
+
+    def cancel(self) -> bool:
+        """Stop after the assets in flight; committed assets stay done."""
+        if not self.running:
+            return False
+        self._cancel.set()
+        return True
+
+    def wait(self, timeout: float | None = None) -> dict[str, Any]:
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.status()
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            progress = dict(self._progress)
+        started = progress.pop('started_monotonic', None)
+        finished = progress.pop('finished_monotonic', None)
+        if started is not None:
+            elapsed = (finished or time.monotonic()) - started
+            progress['elapsed_sec'] = round(elapsed, 1)
+            progress['photos_per_sec'] = round(progress.get('scanned', 0) / elapsed, 2) if elapsed > 0 else None
+        return progress
+
+    def _update(self, **changes: Any) -> None:
+        with self._lock:
+            self._progress.update(changes)
+
+    def _bump(self, **increments: int) -> None:
+        with self._lock:
+            for key, value in increments.items():
+                self._progress[key] = self._progress.get(key, 0) + value
+
+    # ------------------------------------------------------------------
+    # Run
+    # ------------------------------------------------------------------
+    def _run_logged(self, rematch: bool) -> None:
+        try:
+            self.run(rematch=rematch)
+        except Exception as exc:
+            self._update(status='failed', error=str(exc), finished_monotonic=time.monotonic())
+            if self.logger:
+                self.logger.exception('Backup auto-tagging failed')
+
+    def run(self, rematch: bool = False) -> dict[str, Any]:
+        """Tag every stored backup in the calling thread (CLI); returns the final status.
+
+        ``rematch`` also matches the stored encodings of already scanned
+        photos again (no detection), e.g. after new members were registered.
+        """
+        self._update(
+            status='running',
+            snapshots=0,
+            snapshots_skipped=0,
+            assets=0,
+            already_scanned=0,
+            rematched=0,
+            scanned=0,
+            failed=0,
+            faces=0,
+            tags=0,
+            unmapped=0,
+            waited_busy_sec=0.0,
+            started_monotonic=time.monotonic(),
+            finished_monotonic=None,
+            error=None,
+        )
+        connection = sqlite3.connect(str(self.db_path), timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            for snapshot in self._snapshots(connection):
+                if self._cancel.is_set():
+                    break
+                if not snapshot['device_id']:
+                    self._bump(snapshots_skipped=1)
+                    continue
+                self._tag_snapshot(connection, snapshot, rematch)
+                self._bump(snapshots=1)
+        finally:
+            connection.close()
+
+        status = 'cancelled' if self._cancel.is_set() else 'completed'
+        self._update(status=status, finished_monotonic=time.monotonic())
+        result = self.status()
+        if self.logger:
+            self.logger.info(
+                'Backup auto-tagging %s: %s photos scanned (%s already done), %s faces, %s tags',
+                status, result['scanned'], result['already_scanned'], result['faces'], result['tags'],
+            )
+        return result
+
+    def _snapshots(self, connection: sqlite3.Connection) -> list[sqlite3.Row]:
+        return connection.execute(
+            """
+            SELECT bs.id, bs.tree_id, bs.storage_path, us.device_id
+            FROM backup_snapshots bs
+            JOIN family_trees ft ON ft.id = bs.tree_id
+            LEFT JOIN user_settings us ON us.user_id = ft.owner_user_id
+            ORDER BY bs.id
+            """
+        ).fetchall()
+
+    def _wait_while_busy(self) -> None:
+        if self.busy is None:
+            return
+        started = time.monotonic()
+        while self.busy() and not self._cancel.is_set():
+            time.sleep(self.busy_poll_sec)
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            with self._lock:
+                self._progress['waited_busy_sec'] = round(self._progress.get('waited_busy_sec', 0.0) + waited, 1)
+
+    def _tag_snapshot(self, connection: sqlite3.Connection, snapshot: sqlite3.Row, rematch: bool) -> None:
+        archive_path = resolve_storage_path(self.base_dir, str(snapshot['storage_path']))
+        if not archive_path.is_file():
+            self._bump(snapshots_skipped=1)
+            return
+        # Failed scans (worker timeout, pool restart, unreadable photo) are retried on every run.
+        scanned = {
+            row['asset_sha256']: row['faces_json']
+            for row in connection.execute(
+                "SELECT asset_sha256, faces_json FROM photo_face_scans "
+                "WHERE tree_id = ? AND fingerprint = ? AND status = 'done'",
+                (int(snapshot['tree_id']), self.fingerprint),
+            )
+        }
+
+        with zipfile.ZipFile(archive_path) as archive:
+            context = _ArchiveContext.read(archive, snapshot, str(snapshot['storage_path']))
+            pending: dict[Future, tuple[str, str]] = {}
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='face-autotag') as executor:
+                for name, digest in context.assets:
+                    self._bump(assets=1)
+                    if digest in scanned:
+                        self._bump(already_scanned=1)
+                        if rematch and scanned[digest]:
+                            self._rematch_asset(connection, context, name, digest, scanned[digest])
+                        continue
+                    while len(pending) >= self.workers:
+                        self._collect(connection, context, pending)
+                    if self._cancel.is_set():
+                        break
+                    self._wait_while_busy()
+                    if self._cancel.is_set():
+                        break
+                    # Zip members are read here, one at a time: at most ``workers`` photos in memory.
+                    pending[executor.submit(self.detect_encode, archive.read(name))] = (name, digest)
+                while pending:
+                    self._collect(connection, context, pending)
+
+    def _collect(
+        self,
+        connection: sqlite3.Connection,
+        context: _ArchiveContext,
+        pending: dict[Future, tuple[str, str]],
+    ) -> None:
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in done:
+            name, digest = pending.pop(future)
+            try:
+                locations, encodings = future.result()
+            except Exception as exc:
+                self._commit_asset(connection, context, name, digest, None, None, error=str(exc) or exc.__class__.__name__)
+                self._bump(failed=1)
+                continue
+            self._commit_asset(connection, context, name, digest, list(locations)[:len(encodings)], list(encodings))
+            self._bump(scanned=1, faces=len(encodings))
+
+    def _rematch_asset(
+        self,
+        connection: sqlite3.Connection,
+        context: _ArchiveContext,
+        name: str,
+        digest: str,
+        faces_json: str,
+    ) -> None:
+        faces = json.loads(faces_json)
+        if not faces:
+            return
+        locations = [face['box'] for face in faces]
+        encodings = [np.frombuffer(base64.b64decode(face['encoding']), dtype=np.float32) for face in faces]
+        self._commit_asset(connection, context, name, digest, locations, encodings)
+        self._bump(rematched=1)
+
+    # ------------------------------------------------------------------
+    # Matching and persistence
+    # ------------------------------------------------------------------
+    def match(self, encodings: list, device_id: str) -> list[tuple[int, str, float]]:
+        """(face index, member id, distance) of confident matches in the device partition."""
+        if not encodings:
+            return []
+        gallery = self.gallery.snapshot()
+        rows = gallery.partition_rows(str(device_id))
+        if rows.size == 0:
+            return []
+        result = gallery.search(np.asarray(encodings, dtype=np.float32).reshape(-1, 128), k=2, rows=rows)
+        matches = []
+        for face_index in range(result.rows.shape[0]):
+            row = int(result.rows[face_index, 0])
+            distance = float(result.distances[face_index, 0])
+            second = float(result.distances[face_index, 1])
+            if row < 0 or distance > self.threshold:
+                continue
+            if np.isfinite(second) and second - distance < self.margin:
+                continue  # ambiguous: two members almost equally close
+            matches.append((face_index, gallery.member_at(row)[0], distance))
+        return matches
+
+    def _commit_asset(
+        self,
+        connection: sqlite3.Connection,
+        context: _ArchiveContext,
+        name: str,
+        digest: str,
+        locations: list | None,
+        encodings: list | None,
+        *,
+        error: str | None = None,
+    ) -> None:
+        now = utcnow_sql()
+        tree_id = context.tree_id
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            photo_id = None
+            tags = unmapped = 0
+            if error is None:
+                photo_id = self._ensure_photo(connection, context, name, digest, now)
+                for face_index, member_id, distance in self.match(encodings, context.device_id):
+                    person_id = self._mapped_person(connection, context.tree_id, member_id)
+                    if person_id is None:
+                        unmapped += 1
+                        continue
+                    top, right, bottom, left = (int(value) for value in locations[face_index])
+                    tags += self._suggest_tag(
+                        connection, photo_id, person_id, 1.0 - distance,
+                        {'top': top, 'right': right, 'bottom': bottom, 'left': left}, now,
+                    )
+            faces_json = None
+            if encodings is not None:
+                faces_json = json.dumps([
+                    {
+                        'box': [int(value) for value in location],
+                        'encoding': base64.b64encode(np.asarray(encoding, dtype=np.float32).tobytes()).decode('ascii'),
+                    }
+                    for location, encoding in zip(locations, encodings)
+                ], separators=(',', ':'))
+            connection.execute(
+                """
+                INSERT INTO photo_face_scans (
+                    tree_id, asset_sha256, photo_id, fingerprint, status, faces_count, faces_json, error, scanned_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (tree_id, asset_sha256) DO UPDATE SET
+                    photo_id = excluded.photo_id, fingerprint = excluded.fingerprint,
+                    status = excluded.status, faces_count = excluded.faces_count,
+                    faces_json = excluded.faces_json, error = excluded.error,
+                    scanned_at = excluded.scanned_at
+                """,
+                (
+                    tree_id, digest, photo_id, self.fingerprint, 'failed' if error else 'done',
+                    len(encodings or ()), faces_json, error, now,
+                ),
+            )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        self._bump(tags=tags, unmapped=unmapped)
+
+    def _ensure_photo(self, connection: sqlite3.Connection, context: _ArchiveContext, name: str, digest: str, now: str) -> int:
+        row = connection.execute(
+            'SELECT id FROM photos WHERE tree_id = ? AND sha256 = ? ORDER BY id LIMIT 1',
+            (context.tree_id, digest),
+        ).fetchone()
+        if row is not None:
+            return int(row['id'])
+        info = context.photo_info.get(digest, {})
+        cursor = connection.execute(
+            """
+            INSERT INTO photos (
+                tree_id, owner_person_id, uploaded_by_user_id, storage_path, sha256, image_hash,
+                description, taken_at, date_added_ms, is_profile_photo, source, created_at, updated_at
+            )
+            VALUES (?, NULL, NULL, ?, ?, NULL, ?, NULL, ?, ?, 'backup', ?, ?)
+            """,
+            (
+                context.tree_id,
+                f'{context.storage_path}!/{name}',
+                digest,
+                info.get('description') or None,
+                int(info.get('dateAdded') or 0),
+                bool(info.get('isProfilePhoto')),
+                now,
+                now,
+            ),
+        )
+        return int(cursor.lastrowid)
+
+    @staticmethod
+    def _mapped_person(connection: sqlite3.Connection, tree_id: int, member_id: str) -> int | None:
+        """The tree's person linked to a gallery member id, or None (not mapped)."""
+        row = connection.execute(
+            """
+            SELECT fe.person_id
+            FROM face_encodings fe
+            JOIN persons p ON p.id = fe.person_id
+            WHERE fe.external_member_id = ? AND p.tree_id = ?
+            ORDER BY fe.id
+            LIMIT 1
+            """,
+            (member_id, tree_id),
+        ).fetchone()
+        return int(row['person_id']) if row is not None else None
+
+    @staticmethod
+    def _suggest_tag(
+        connection: sqlite3.Connection,
+        photo_id: int,
+        person_id: int,
+        confidence: float,
+        bbox: dict[str, int],
+        now: str,
+    ) -> int:
+        cursor = connection.execute(
+            """
+            INSERT INTO photo_person_tags (photo_id, person_id, tagged_by_user_id, source, confidence, bbox_json, created_at)
+            VALUES (?, ?, NULL, ?, ?, ?, ?)
+            ON CONFLICT (photo_id, person_id) DO UPDATE SET
+                confidence = excluded.confidence, bbox_json = excluded.bbox_json
+            WHERE photo_person_tags.source = excluded.source
+                AND excluded.confidence > COALESCE(photo_person_tags.confidence, 0)
+            """,
+            (photo_id, person_id, AUTOTAG_SOURCE, float(confidence), json.dumps(bbox), now),
+        )
+        return cursor.rowcount
+
+
+class _ArchiveContext:
+    """What one snapshot needs besides its asset bytes: owner and photo records."""
+
+    def __init__(
+        self,
+        tree_id: int,
+        device_id: str,
+        storage_path: str,
+        assets: list[tuple[str, str]],
+        photo_info: dict[str, dict[str, Any]],
+    ) -> None:
+        self.tree_id = tree_id
+        self.device_id = device_id
+        self.storage_path = storage_path
+        self.assets = assets
+        self.photo_info = photo_info
+
+    @classmethod
+    def read(cls, archive: zipfile.ZipFile, snapshot: sqlite3.Row, storage_path: str) -> _ArchiveContext:
+        photo_info: dict[str, dict[str, Any]] = {}
+        for record in _read_json_list(archive, 'member_photos.json'):
+            photo_info.setdefault(str(record.get('photoAssetId') or '').lower(), record)
+        return cls(
+            int(snapshot['tree_id']),
+            str(snapshot['device_id']),
+            storage_path,
+            list(_asset_names(archive)),
+            photo_info,
+        )
+
+
+def _asset_names(archive: zipfile.ZipFile) -> Iterator[tuple[str, str]]:
+    """(member name, sha256) of the photo assets; the client names them by digest."""
+    for info in archive.infolist():
+        matched = _ASSET_NAME.match(info.filename)
+        if matched and not info.is_dir():
+            yield info.filename, matched.group(1).lower()
+
+
+def _read_json_list(archive: zipfile.ZipFile, name: str) -> list[dict[str, Any]]:
+    try:
+        payload = json.loads(archive.read(name).decode('utf-8'))
+    except (KeyError, ValueError):
+        return []
+    return [record for record in payload if isinstance(record, dict)] if isinstance(payload, list) else []
+
+
+def main(argv: list[str] | None = None) -> int:
+    """CLI: auto-tag the stored backups of this backend with the settings from .env.
+
+    Safe to run next to the server; with it running prefer
+    POST /api/v2/admin/face-autotag, which also yields to live face requests.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Suggest person tags for photos in stored backups')
+    parser.add_argument('--workers', type=int, default=0, help='parallel photos (default: FACE_AUTOTAG_WORKERS)')
+    parser.add_argument('--rematch', action='store_true', help='match stored faces of scanned photos again')
+    args = parser.parse_args(argv)
+
+    import telegram_service as ts
+
+    if not ts.FACE_RECOGNITION_AVAILABLE:
+        print(f'face_recognition is unavailable: {ts.FACE_RECOGNITION_IMPORT_ERROR}')
+        return 2
+    ts.load_encodings()
+    tagger = ts.face_backup_autotagger
+    if args.workers > 0:
+        tagger.workers = args.workers
+    try:
+        result = tagger.run(rematch=args.rematch)
+    finally:
+        ts.face_worker_pool.shutdown()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result.get('status') == 'completed' else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
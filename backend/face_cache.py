@@ -0,0 +1,495 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Sequence
+
+import numpy as np
+
+# Bookkeeping cost of one entry (dict, key, list headers) on top of payload.
+_ENTRY_OVERHEAD_BYTES = 512
+_LOCATION_BYTES = 4 * 28 + 56
+
+
+def content_digest(data: bytes) -> str:
+    """Digest of the uploaded (compressed) image bytes, stable across processes."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def settings_fingerprint(settings: dict[str, Any]) -> str:
+    """Short stable digest of the detector / encoder settings a result depends on."""
+    payload = json.dumps(settings, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=8).hexdigest()
+
+
+class FaceDiskCache:
+    """SQLite-backed second level of ``FaceResultCache`` that survives restarts.
+
+    Rows are keyed by ``content_digest`` like the memory cache; encodings are
+    stored per ``(model, num_jitters)`` as float64 blobs. The database
+    remembers the settings ``fingerprint`` it was filled with and drops every
+    row when opened with a different one. Least recently read rows are
+    evicted once the accounted payload exceeds ``max_bytes``.
+    """
+
+    def __init__(self, path: str | Path, max_bytes: int, fingerprint: str, *, logger=None) -> None:
+        self.path = Path(path)
+        self.max_bytes = max(0, int(max_bytes))
+        self.fingerprint = fingerprint
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._ready = False
+        self._total_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(str(self.path), timeout=10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _ensure_schema(self) -> None:
+        """Create tables on first use and clear them if the settings changed."""
+        if self._ready:
+            return
+        os.makedirs(self.path.parent, exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS face_cache_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS face_cache_locations (
+                    digest TEXT PRIMARY KEY,
+                    locations_json TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_face_cache_locations_accessed
+                    ON face_cache_locations(accessed_at);
+                CREATE TABLE IF NOT EXISTS face_cache_encodings (
+                    digest TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    jitters INTEGER NOT NULL,
+                    encodings BLOB NOT NULL,
+                    PRIMARY KEY (digest, model, jitters)
+                );
+                """
+            )
+            row = connection.execute(
+                "SELECT value FROM face_cache_meta WHERE key = 'fingerprint'"
+            ).fetchone()
+            if row is None or row['value'] != self.fingerprint:
+                connection.execute('DELETE FROM face_cache_encodings')
+                connection.execute('DELETE FROM face_cache_locations')
+                connection.execute(
+                    "INSERT OR REPLACE INTO face_cache_meta (key, value) VALUES ('fingerprint', ?)",
+                    (self.fingerprint,),
+                )
+                if row is not None and self.logger:
+                    self.logger.info('Face disk cache cleared: settings changed (%s -> %s)', row['value'], self.fingerprint)
+            connection.commit()
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) AS total FROM face_cache_locations').fetchone()
+            self._total_bytes = int(total['total'])
+        finally:
+            connection.close()
+        self._ready = True
+
+    def _run(self, operation, default=None):
+        """Run ``operation(connection)`` under the lock; disk errors only disable the lookup."""
+        if not self.enabled:
+            return default
+        with self._lock:
+            try:
+                self._ensure_schema()
+                connection = self._connect()
+                try:
+                    result = operation(connection)
+                    connection.commit()
+                    return result
+                finally:
+                    connection.close()
+            except sqlite3.Error as exc:
+                if self.logger:
+                    self.logger.warning('Face disk cache %s failed: %s', self.path, exc)
+                return default
+
+    def lookup(
+        self,
+        digest: str,
+        model: str,
+        num_jitters: int,
+    ) -> tuple[list[tuple[int, int, int, int]] | None, np.ndarray | None]:
+        def operation(connection: sqlite3.Connection):
+            row = connection.execute(
+                'SELECT locations_json FROM face_cache_locations WHERE digest = ?',
+                (digest,),
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None, None
+            connection.execute(
+                'UPDATE face_cache_locations SET accessed_at = ? WHERE digest = ?',
+                (time.time(), digest),
+            )
+            locations = [tuple(location) for location in json.loads(row['locations_json'])]
+            blob = connection.execute(
+                'SELECT encodings FROM face_cache_encodings WHERE digest = ? AND model = ? AND jitters = ?',
+                (digest, model, int(num_jitters)),
+            ).fetchone()
+            self._hits += 1
+            if blob is None:
+                return locations, None
+            return locations, np.frombuffer(blob['encodings'], dtype=np.float64).reshape(len(locations), -1)
+
+        return self._run(operation, (None, None))
+
+    def _row_size(self, connection: sqlite3.Connection, digest: str) -> int:
+        row = connection.execute('SELECT size FROM face_cache_locations WHERE digest = ?', (digest,)).fetchone()
+        return int(row['size']) if row is not None else 0
+
+    def put_locations(self, digest: str, locations: Sequence[tuple[int, int, int, int]]) -> None:
+        locations_json = json.dumps([[int(value) for value in location] for location in locations])
+
+        def operation(connection: sqlite3.Connection):
+            row = connection.execute(
+                'SELECT locations_json FROM face_cache_locations WHERE digest = ?',
+                (digest,),
+            ).fetchone()
+            if row is not None and row['locations_json'] == locations_json:
+                return
+            self._total_bytes -= self._row_size(connection, digest)
+            connection.execute('DELETE FROM face_cache_encodings WHERE digest = ?', (digest,))
+            size = _ENTRY_OVERHEAD_BYTES + len(locations_json)
+            connection.execute(
+                'INSERT OR REPLACE INTO face_cache_locations (digest, locations_json, size, accessed_at) '
+                'VALUES (?, ?, ?, ?)',
+                (digest, locations_json, size, time.time()),
+            )
+            self._total_bytes += size
+            self._evict(connection)
+
+        self._run(operation)
+
+    def put_encodings(self, digest: str, model: str, num_jitters: int, matrix: np.ndarray) -> None:
+        blob = np.ascontiguousarray(matrix, dtype=np.float64).tobytes()
+
+        def operation(connection: sqlite3.Connection):
+            row = connection.execute(
+                'SELECT locations_json FROM face_cache_locations WHERE digest = ?',
+                (digest,),
+            ).fetchone()
+            if row is None or len(json.loads(row['locations_json'])) != len(matrix):
+                return
+            previous = connection.execute(
+                'SELECT LENGTH(encodings) AS size FROM face_cache_encodings '
+                'WHERE digest = ? AND model = ? AND jitters = ?',
+                (digest, model, int(num_jitters)),
+            ).fetchone()
+            delta = len(blob) - (int(previous['size']) if previous is not None else 0)
+            connection.execute(
+                'INSERT OR REPLACE INTO face_cache_encodings (digest, model, jitters, encodings) VALUES (?, ?, ?, ?)',
+                (digest, model, int(num_jitters), blob),
+            )
+            connection.execute(
+                'UPDATE face_cache_locations SET size = size + ?, accessed_at = ? WHERE digest = ?',
+                (delta, time.time(), digest),
+            )
+            self._total_bytes += delta
+            self._evict(connection)
+
+        self._run(operation)
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Trim to 90% so that a full cache does not evict on every insert.
+        target = int(self.max_bytes * 0.9)
+        rows = connection.execute(
+            'SELECT digest, size FROM face_cache_locations ORDER BY accessed_at ASC'
+        ).fetchall()
+        victims = []
+        for row in rows:
+            if self._total_bytes <= target:
+                break
+            victims.append((row['digest'],))
+            self._total_bytes -= int(row['size'])
+        connection.executemany('DELETE FROM face_cache_encodings WHERE digest = ?', victims)
+        connection.executemany('DELETE FROM face_cache_locations WHERE digest = ?', victims)
+        self._evictions += len(victims)
+
+    def clear(self) -> None:
+        def operation(connection: sqlite3.Connection):
+            connection.execute('DELETE FROM face_cache_encodings')
+            connection.execute('DELETE FROM face_cache_locations')
+            self._total_bytes = 0
+
+        self._run(operation)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'path': str(self.path),
+            'enabled': self.enabled,
+            'bytes': self._total_bytes,
+            'max_bytes': self.max_bytes,
+            'fingerprint': self.fingerprint,
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+        }
+
+
+class _Entry:
+    __slots__ = ('locations', 'encodings', 'size', 'expires_at')
+
+    def __init__(self, expires_at: float) -> None:
+        self.locations: list[tuple[int, int, int, int]] | None = None
+        self.encodings: dict[tuple[str, int], np.ndarray] = {}
+        self.size = _ENTRY_OVERHEAD_BYTES
+        self.expires_at = expires_at
+
+
+class FaceResultCache:
+    """LRU cache of detection / encoding results bounded by bytes and TTL.
+
+    Entries are keyed by ``content_digest`` of the uploaded file. Each holds
+    the face locations (source-image coordinates) and the encodings of those
+    locations per ``(model, num_jitters)``. The least recently used entries
+    are evicted once the accounted size exceeds ``max_bytes``; entries older
+    than ``ttl_sec`` are dropped on access. ``max_bytes=0`` disables the
+    memory level. An optional ``backing`` ``FaceDiskCache`` is written through
+    and consulted on memory misses.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl_sec: float | None = None,
+        backing: FaceDiskCache | None = None,
+    ) -> None:
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl_sec = ttl_sec if ttl_sec and ttl_sec > 0 else None
+        self.backing = backing if backing is not None and backing.enabled else None
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _live_entry(self, digest: str) -> _Entry | None:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._drop(digest)
+            return None
+        self._entries.move_to_end(digest)
+        return entry
+
+    def _entry_for_update(self, digest: str) -> _Entry:
+        entry = self._live_entry(digest)
+        if entry is None:
+            expires_at = time.monotonic() + self.ttl_sec if self.ttl_sec else float('inf')
+            entry = self._entries[digest] = _Entry(expires_at)
+            self._bytes += entry.size
+        return entry
+
+    def _resize(self, entry: _Entry, delta: int) -> None:
+        entry.size += delta
+        self._bytes += delta
+
+    def _drop(self, digest: str) -> None:
+        entry = self._entries.pop(digest, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            digest = next(iter(self._entries))
+            self._drop(digest)
+            self._evictions += 1
+
+    def _memory_lookup(self, digest: str, key: tuple[str, int]):
+        entry = self._live_entry(digest)
+        if entry is None or entry.locations is None:
+            return None, None
+        return list(entry.locations), entry.encodings.get(key)
+
+    def lookup(
+        self,
+        digest: str,
+        model: str,
+        num_jitters: int,
+    ) -> tuple[list[tuple[int, int, int, int]] | None, list[np.ndarray] | None]:
+        """Cached ``(locations, encodings)``; either is ``None`` when not cached.
+
+        Misses in memory fall through to the ``backing`` disk cache, whose
+        results are promoted into memory.
+        """
+        if not digest or not (self.enabled or self.backing is not None):
+            return None, None
+        key = (model, int(num_jitters))
+        with self._lock:
+            locations, encodings = self._memory_lookup(digest, key)
+
+        if (locations is None or (encodings is None and locations)) and self.backing is not None:
+            disk_locations, disk_encodings = self.backing.lookup(digest, model, num_jitters)
+            if disk_locations is not None and (locations is None or locations == disk_locations):
+                with self._lock:
+                    self._store_locations(digest, disk_locations)
+                    if disk_encodings is not None:
+                        self._store_encodings(digest, key, disk_encodings)
+                locations = disk_locations
+                encodings = disk_encodings if disk_encodings is not None else encodings
+
+        with self._lock:
+            if locations is not None and (encodings is not None or not locations):
+                self._hits += 1
+            else:
+                self._misses += 1
+        return locations, None if encodings is None else list(encodings)
+
+    def _store_locations(self, digest: str, locations: list[tuple[int, int, int, int]]) -> None:
+        if not self.enabled:
+            return
+        entry = self._entry_for_update(digest)
+        old_size = len(entry.locations or []) * _LOCATION_BYTES
+        if entry.locations != locations:
+            # Encodings belong to the old locations.
+            for encodings in entry.encodings.values():
+                old_size += encodings.nbytes
+            entry.encodings.clear()
+        self._resize(entry, len(locations) * _LOCATION_BYTES - old_size)
+        entry.locations = locations
+        self._evict()
+
+    def _store_encodings(self, digest: str, key: tuple[str, int], matrix: np.ndarray) -> None:
+        if not self.enabled:
+            return
+        entry = self._live_entry(digest)
+        if entry is None or entry.locations is None or len(entry.locations) != len(matrix):
+            return
+        previous = entry.encodings.get(key)
+        entry.encodings[key] = matrix
+        self._resize(entry, matrix.nbytes - (previous.nbytes if previous is not None else 0))
+        self._evict()
+
+    def put_locations(self, digest: str, locations: Sequence[tuple[int, int, int, int]]) -> None:
+        if not digest:
+            return
+        new_locations = [tuple(int(value) for value in location) for location in locations]
+        with self._lock:
+            self._store_locations(digest, new_locations)
+        if self.backing is not None:
+            self.backing.put_locations(digest, new_locations)
+
+    def put_encodings(self, digest: str, model: str, num_jitters: int, encodings: Sequence[Any]) -> None:
+        if not digest:
+            return
+        matrix = np.asarray(encodings, dtype=np.float64).reshape(len(encodings), -1)
+        with self._lock:
+            self._store_encodings(digest, (model, int(num_jitters)), matrix)
+        if self.backing is not None:
+            self.backing.put_encodings(digest, model, num_jitters, matrix)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_sec': self.ttl_sec,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+        stats['disk'] = self.backing.stats() if self.backing is not None else None
+        return stats
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller of ``do(key, fn)`` runs ``fn``; callers arriving with the
+    same key while it runs wait for it and receive the same result (or the
+    same exception) instead of repeating the work. Nothing is remembered once
+    the call finishes -- that is the result cache's job.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: dict[Any, _Flight] = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Returns ``(result, shared)``; ``shared`` is True for waiters."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._executed += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'executed': self._executed,
+                'coalesced': self._coalesced,
+            }
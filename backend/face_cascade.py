@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Sequence
+
+CASCADE_STATS_VERSION = 1
+
+# Priors for stages/attempts without history: one imaginary run that costs
+# _PRIOR_MS and has a 50% hit chance, so unseen entries are neither starved
+# nor preferred over proven ones.
+_PRIOR_MS = 250.0
+
+
+def _empty_counter() -> dict[str, float]:
+    return {'runs': 0, 'hits': 0, 'seconds': 0.0}
+
+
+def _score(counter: dict[str, float] | None) -> float:
+    """Expected faces found per millisecond spent (Laplace-smoothed)."""
+    counter = counter or _empty_counter()
+    runs = counter['runs']
+    hit_rate = (counter['hits'] + 1.0) / (runs + 2.0)
+    mean_ms = (counter['seconds'] * 1000.0 + _PRIOR_MS) / (runs + 1.0)
+    return hit_rate / max(1.0, mean_ms)
+
+
+class CascadeStats:
+    """Per-stage / per-attempt counters of the face detection fallback cascade.
+
+    Every attempt that reaches a verdict records a run, whether it found a
+    face and the seconds it took inside the worker; every stage records its
+    wall-clock time. Counters are kept in memory and written to ``path`` as
+    JSON at most every ``save_interval_sec`` (and on ``save()``).
+
+    With ``adaptive`` enabled ``order_stages`` / ``order_attempts`` sort by
+    expected success per millisecond, and ``order_stages`` drops stages that
+    have at least ``min_samples`` runs and a hit rate below ``min_hit_rate``.
+    Without it both return the cascade order unchanged.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        *,
+        adaptive: bool = False,
+        min_samples: int = 50,
+        min_hit_rate: float = 0.0,
+        save_interval_sec: float = 60.0,
+        logger=None,
+    ) -> None:
+        self.path = path
+        self.adaptive = adaptive
+        self.min_samples = max(1, int(min_samples))
+        self.min_hit_rate = max(0.0, float(min_hit_rate))
+        self.save_interval_sec = save_interval_sec
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._stages: dict[str, dict[str, float]] = {}
+        self._attempts: dict[str, dict[str, Any]] = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+    def record_attempt(self, stage: str, attempt: str, hit: bool, seconds: float) -> None:
+        with self._lock:
+            counter = self._attempts.get(attempt)
+            if counter is None:
+                counter = self._attempts[attempt] = {'stage': stage, **_empty_counter()}
+            counter['runs'] += 1
+            counter['hits'] += int(bool(hit))
+            counter['seconds'] += max(0.0, float(seconds))
+            self._dirty = True
+
+    def record_stage(self, stage: str, hit: bool, seconds: float) -> None:
+        with self._lock:
+            counter = self._stages.setdefault(stage, _empty_counter())
+            counter['runs'] += 1
+            counter['hits'] += int(bool(hit))
+            counter['seconds'] += max(0.0, float(seconds))
+            self._dirty = True
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._attempts.clear()
+            self._dirty = True
+        self.save()
+
+    # ------------------------------------------------------------------
+    # Ordering
+    # ------------------------------------------------------------------
+    def order_stages(self, names: Sequence[str]) -> list[str]:
+        if not self.adaptive:
+            return list(names)
+        with self._lock:
+            kept = []
+            for name in names:
+                counter = self._stages.get(name)
+                if (
+                    counter is not None
+                    and counter['runs'] >= self.min_samples
+                    and counter['hits'] / counter['runs'] < self.min_hit_rate
+                ):
+                    continue
+                kept.append(name)
+            scores = {name: _score(self._stages.get(name)) for name in kept}
+        return sorted(kept, key=lambda name: -scores[name])
+
+    def order_attempts(self, names: Sequence[str]) -> list[int]:
+        """Indices of ``names`` in the order the attempts should be tried."""
+        if not self.adaptive:
+            return list(range(len(names)))
+        with self._lock:
+            scores = [_score(self._attempts.get(name)) for name in names]
+        return sorted(range(len(names)), key=lambda index: -scores[index])
+
+    # ------------------------------------------------------------------
+    # Inspection / persistence
+    # ------------------------------------------------------------------
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            stages = {name: dict(counter) for name, counter in self._stages.items()}
+            attempts = {name: dict(counter) for name, counter in self._attempts.items()}
+        for counter in list(stages.values()) + list(attempts.values()):
+            runs = counter['runs']
+            counter['hit_rate'] = round(counter['hits'] / runs, 4) if runs else None
+            counter['mean_ms'] = round(counter['seconds'] * 1000.0 / runs, 2) if runs else None
+            counter['score'] = _score(counter)
+        return {
+            'version': CASCADE_STATS_VERSION,
+            'adaptive': self.adaptive,
+            'min_samples': self.min_samples,
+            'min_hit_rate': self.min_hit_rate,
+            'stages': stages,
+            'attempts': attempts,
+        }
+
+    def load(self) -> bool:
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as handle:
+                payload = json.load(handle)
+            if payload.get('version') != CASCADE_STATS_VERSION:
+                raise ValueError(f"unsupported version {payload.get('version')!r}")
+            stages = {
+                str(name): {key: counter[key] for key in ('runs', 'hits', 'seconds')}
+                for name, counter in payload.get('stages', {}).items()
+            }
+            attempts = {
+                str(name): {'stage': counter.get('stage', ''), **{key: counter[key] for key in ('runs', 'hits', 'seconds')}}
+                for name, counter in payload.get('attempts', {}).items()
+            }
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as exc:
+            if self.logger:
+                self.logger.warning('Cascade stats %s ignored: %s', self.path, exc)
+            return False
+        with self._lock:
+            self._stages = stages
+            self._attempts = attempts
+            self._dirty = False
+        return True
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            payload = {
+                'version': CASCADE_STATS_VERSION,
+                'updated_at': time.time(),
+                'stages': {name: dict(counter) for name, counter in self._stages.items()},
+                'attempts': {name: dict(counter) for name, counter in self._attempts.items()},
+            }
+            self._dirty = False
+            self._last_save = time.monotonic()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.cascade-', suffix='.json', dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+                json.dump(payload, handle, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as exc:
+            if self.logger:
+                self.logger.warning('Cascade stats save failed: %s', exc)
+
+    def maybe_save(self) -> None:
+        if self._dirty and time.monotonic() - self._last_save >= self.save_interval_sec:
+            self.save()
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+from PIL import Image
+
+CHIP_STORE_VERSION = 2
+# dlib aligns faces to 150 px before encoding; a smaller face in the chip would be
+# upsampled from less detail than the registration photo had.
+ENCODER_FACE_SIZE = 150
+
+Location = tuple[int, int, int, int]
+
+
+def crop_face_chip(image: np.ndarray, location: Location, size: int = 320, margin: float = 0.5) -> tuple[np.ndarray, Location]:
+    """Square crop around a detected face, at most ``size`` x ``size``.
+
+    ``location`` is a ``(top, right, bottom, left)`` box in ``image``. The
+    crop is centred on the box and ``1 + 2 * margin`` times its longer side,
+    so the encoder's landmark model still sees the whole head; parts outside
+    the image are filled black. Larger crops are scaled down to ``size``,
+    smaller ones are kept at their own resolution (never upsampled). Returns
+    the chip and the box in chip coordinates.
+    """
+    top, right, bottom, left = (int(value) for value in location)
+    side = max(1, int(round(max(bottom - top, right - left) * (1.0 + 2.0 * margin))))
+    center_y = (top + bottom) / 2.0
+    center_x = (left + right) / 2.0
+    crop_top = int(round(center_y - side / 2.0))
+    crop_left = int(round(center_x - side / 2.0))
+
+    height, width = image.shape[:2]
+    canvas = np.zeros((side, side) + image.shape[2:], dtype=image.dtype)
+    src_top, src_left = max(0, crop_top), max(0, crop_left)
+    src_bottom, src_right = min(height, crop_top + side), min(width, crop_left + side)
+    if src_bottom > src_top and src_right > src_left:
+        canvas[src_top - crop_top:src_bottom - crop_top, src_left - crop_left:src_right - crop_left] = (
+            image[src_top:src_bottom, src_left:src_right]
+        )
+
+    size = min(int(size), side)
+    scale = size / side
+    chip = canvas if size == side else np.asarray(Image.fromarray(canvas).resize((size, size), Image.BILINEAR))
+    chip_location = (
+        int(round((top - crop_top) * scale)),
+        int(round((right - crop_left) * scale)),
+        int(round((bottom - crop_top) * scale)),
+        int(round((left - crop_left) * scale)),
+    )
+    return chip, chip_location
+
+
+class FaceChipStore:
+    """Per-member face chips saved at registration, so nothing has to re-detect.
+
+    For every member ``<member_id>.png`` holds the chip from ``crop_face_chip``
+    and ``<member_id>.json`` the detected box in the original photo, the box
+    inside the chip and the sizes. The JSON is written last and is what
+    ``load`` requires, so a crash between the two files leaves no chip.
+
+    A chip plus its box is enough input for the encoder (landmarks and the
+    150 px alignment happen inside it), which makes re-encoding, audits and
+    thumbnails skip the detection cascade. To give the encoder the same
+    pixels registration had, chips are lossless PNG and ``size`` is raised
+    until the face in a scaled-down chip is at least ``ENCODER_FACE_SIZE``
+    px. Version 1 chips (JPEG, 256 px) are ignored, and those members are
+    encoded from their photo.
+    """
+
+    def __init__(self, directory: str | Path, *, size: int = 320, margin: float = 0.5) -> None:
+        self.directory = Path(directory)
+        self.margin = max(0.0, float(margin))
+        self.size = max(int(size), int(math.ceil(ENCODER_FACE_SIZE * (1.0 + 2.0 * self.margin))))
+
+    def chip_path(self, member_id: str) -> Path:
+        return self.directory / f'{member_id}.png'
+
+    def meta_path(self, member_id: str) -> Path:
+        return self.directory / f'{member_id}.json'
+
+    def has(self, member_id: str) -> bool:
+        return self.meta_path(member_id).is_file() and self.chip_path(member_id).is_file()
+
+    def save(self, member_id: str, image: np.ndarray, location: Location) -> dict[str, Any]:
+        chip, chip_location = crop_face_chip(image, location, self.size, self.margin)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            # A replaced chip is not loadable until its new box is written.
+            self.meta_path(member_id).unlink()
+        except OSError:
+            pass
+
+        fd, chip_temp = tempfile.mkstemp(prefix='.chip-', suffix='.png', dir=self.directory)
+        with os.fdopen(fd, 'wb') as chip_file:
+            Image.fromarray(chip).save(chip_file, format='PNG', compress_level=1)
+        os.replace(chip_temp, self.chip_path(member_id))
+        self._remove_legacy(member_id)
+
+        meta = {
+            'version': CHIP_STORE_VERSION,
+            'box': [int(value) for value in location],
+            'image_size': [int(image.shape[0]), int(image.shape[1])],
+            'chip_box': list(chip_location),
+            'chip_size': int(chip.shape[0]),
+            'created_at': time.time(),
+        }
+        fd, meta_temp = tempfile.mkstemp(prefix='.chip-', suffix='.json', dir=self.directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file, separators=(',', ':'))
+        os.replace(meta_temp, self.meta_path(member_id))
+        return meta
+
+    def meta(self, member_id: str) -> dict[str, Any] | None:
+        try:
+            with open(self.meta_path(member_id), 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(meta, dict) or meta.get('version') != CHIP_STORE_VERSION:
+            return None
+        return meta
+
+    def load(self, member_id: str) -> tuple[np.ndarray, Location] | None:
+        """The chip as an RGB array and the face box inside it, or None."""
+        meta = self.meta(member_id)
+        if meta is None:
+            return None
+        try:
+            with Image.open(self.chip_path(member_id)) as chip_image:
+                chip = np.asarray(chip_image.convert('RGB'))
+        except OSError:
+            return None
+        top, right, bottom, left = (int(value) for value in meta['chip_box'])
+        return chip, (top, right, bottom, left)
+
+    def delete(self, member_ids: Iterable[str]) -> int:
+        """Remove the chips of ``member_ids``; returns how many chips existed."""
+        removed = 0
+        for member_id in member_ids:
+            try:
+                self.meta_path(member_id).unlink()
+            except OSError:
+                pass
+            self._remove_legacy(member_id)
+            try:
+                self.chip_path(member_id).unlink()
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def _remove_legacy(self, member_id: str) -> None:
+        try:
+            (self.directory / f'{member_id}.jpg').unlink()
+        except OSError:
+            pass
+
+    def clear(self) -> None:
+        if not self.directory.exists():
+            return
+        for path in self.directory.iterdir():
+            if path.is_file() and path.suffix in ('.png', '.jpg', '.json'):
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
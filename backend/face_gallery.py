@@ -0,0 +1,1027 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+import threading
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+
+import numpy as np
+
+from face_ann import IVFIndex, IVFState
+from face_quant import EncodingCodec, dot_products
+
+
+ENCODING_DIM = 128
+_INITIAL_CAPACITY = 256
+_CONVERT_ROWS = 4096
+GALLERY_STORE_VERSION = 1
+
+
+class GallerySearchResult(NamedTuple):
+    """k nearest gallery rows per query face.
+
+    ``rows`` and ``distances`` have shape (faces, k). Missing neighbours
+    (gallery smaller than k) are padded with ``-1`` / ``inf``.
+    """
+
+    rows: np.ndarray
+    distances: np.ndarray
+
+
+def _group_add(groups: dict[str, tuple[str, ...]], key: str, member_id: str) -> None:
+    if key:
+        members = groups.get(key, ())
+        if member_id not in members:
+            groups[key] = members + (member_id,)
+
+
+def _group_discard(groups: dict[str, tuple[str, ...]], key: str, member_id: str) -> None:
+    members = groups.get(key)
+    if members is None or member_id not in members:
+        return
+    remaining = tuple(member for member in members if member != member_id)
+    if remaining:
+        groups[key] = remaining
+    else:
+        del groups[key]
+
+
+class GallerySnapshot(Mapping):
+    """One immutable published state of a ``FaceGallery``.
+
+    Holds the first ``count`` rows of the encoding matrix, the parallel id /
+    name / hash lists, the lookup indexes and the ANN lists as they were when
+    it was published; none of them is modified afterwards. Row numbers are
+    only meaningful within one snapshot, so a request that searches and then
+    resolves rows should pin ``gallery.snapshot()`` once and use it for
+    every step.
+
+    The mapping interface (``snapshot[member_id]`` -> ``{'name', 'encoding',
+    'image_hash'}``) is kept for the routes that used the old dict of dicts.
+    """
+
+    def __init__(self, draft: _GalleryDraft) -> None:
+        self._dim = draft.dim
+        self._codec = draft.codec
+        self._matrix = draft.matrix
+        self._scales = draft.scales
+        self._sq_norms = draft.sq_norms
+        self._count = len(draft.ids)
+        self._ids = draft.ids
+        self._names = draft.names
+        self._hashes = draft.hashes
+        self._row_by_id = draft.row_by_id
+        self._partitions = draft.partitions
+        self._by_hash = draft.by_hash
+        self._by_name = draft.by_name
+        self._name_key = draft.name_key
+        self._ann = draft.ann
+        self.ann_state = draft.ann_state
+
+    # ------------------------------------------------------------------
+    # Mapping interface
+    # ------------------------------------------------------------------
+    def __getitem__(self, member_id: str) -> dict[str, Any]:
+        row = self._row_by_id[str(member_id)]
+        return {
+            'name': self._names[row],
+            'encoding': self._decode(row, row + 1)[0].copy(),
+            'image_hash': self._hashes[row],
+        }
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, member_id: object) -> bool:
+        return str(member_id) in self._row_by_id
+
+    # ------------------------------------------------------------------
+    # Lookup / search
+    # ------------------------------------------------------------------
+    def _decode(self, start: int, stop: int) -> np.ndarray:
+        scales = None if self._scales is None else self._scales[start:stop]
+        return self._codec.decode(self._matrix[start:stop], scales)
+
+    def export(self) -> tuple[np.ndarray, list[str], list[str], list[str]]:
+        """Rows as (float32 matrix, ids, names, hashes); a view unless stored in reduced precision."""
+        return self._decode(0, self._count), list(self._ids), list(self._names), list(self._hashes)
+
+    def storage_stats(self) -> dict[str, Any]:
+        row_bytes = self._codec.row_bytes(self._dim) + self._sq_norms.itemsize
+        return {
+            'precision': self._codec.precision,
+            'bytes_per_face': row_bytes,
+            'bytes': row_bytes * self._count,
+            'capacity': int(self._matrix.shape[0]),
+        }
+
+    def members(self) -> list[tuple[str, str]]:
+        """(member_id, name) pairs without materializing encodings."""
+        return list(zip(self._ids, self._names))
+
+    def member_at(self, row: int) -> tuple[str, str]:
+        return self._ids[row], self._names[row]
+
+    def rows_for(self, member_ids: Iterable[str]) -> np.ndarray:
+        row_by_id = self._row_by_id
+        rows = [row_by_id[str(member_id)] for member_id in member_ids if str(member_id) in row_by_id]
+        return np.asarray(rows, dtype=np.intp)
+
+    def members_with_hash(self, image_hash: str) -> list[str]:
+        return list(self._by_hash.get(str(image_hash or '').strip(), ()))
+
+    def members_named(self, name: str) -> list[str]:
+        """Members whose name has the same ``name_key`` as ``name``."""
+        return list(self._by_name.get(self._name_key(str(name or '').strip()), ()))
+
+    def partition_members(self, key: str) -> list[str]:
+        return list(self._partitions.get(str(key), ()))
+
+    def partition_rows(self, key: str) -> np.ndarray:
+        members = self._partitions.get(str(key), ())
+        row_by_id = self._row_by_id
+        return np.fromiter((row_by_id[member_id] for member_id in members), dtype=np.intp, count=len(members))
+
+    def partition_sizes(self) -> dict[str, int]:
+        return {key: len(members) for key, members in self._partitions.items()}
+
+    def ann_stats(self) -> dict[str, Any] | None:
+        return self._ann.stats(self.ann_state) if self._ann is not None else None
+
+    def search(
+        self,
+        queries: Any,
+        k: int = 2,
+        rows: np.ndarray | None = None,
+        approximate: bool = False,
+        nprobe: int | None = None,
+    ) -> GallerySearchResult:
+        """Euclidean k-nearest search of every query against the gallery.
+
+        All (faces x gallery) distances come from a single matrix product
+        ``|q|^2 + |g|^2 - 2 q.g`` (``dot_products``, which widens reduced
+        precision rows chunk by chunk); the k best per face are picked with
+        ``argpartition`` instead of a full sort. ``rows`` restricts the search
+        to a subset of gallery rows; returned rows are always gallery rows.
+
+        ``approximate`` (whole-gallery searches only, with a trained ``ann``
+        index) narrows the rows to the shortlist of the ``nprobe`` nearest
+        cells first; distances of the shortlist are still exact.
+        """
+        query_matrix = np.asarray(queries, dtype=np.float32).reshape(-1, self._dim)
+        face_count = query_matrix.shape[0]
+        k = max(1, int(k))
+        if approximate and rows is None and face_count and self.ann_state is not None:
+            rows = self.ann_state.candidates(query_matrix, nprobe or self._ann.nprobe)
+
+        result_rows = np.full((face_count, k), -1, dtype=np.intp)
+        result_distances = np.full((face_count, k), np.inf, dtype=np.float64)
+
+        count = self._count
+        scales = None if self._scales is None else self._scales[:count]
+        if rows is None:
+            candidate_norms = self._sq_norms[:count]
+        else:
+            rows = np.asarray(rows, dtype=np.intp)
+            candidate_norms = self._sq_norms[rows]
+
+        candidate_count = candidate_norms.shape[0]
+        if face_count == 0 or candidate_count == 0:
+            return GallerySearchResult(result_rows, result_distances)
+
+        query_norms = np.einsum('ij,ij->i', query_matrix, query_matrix)
+        squared = dot_products(query_matrix, self._matrix[:count], scales, rows)
+        squared *= -2.0
+        squared += query_norms[:, None]
+        squared += candidate_norms[None, :]
+        np.maximum(squared, 0.0, out=squared)
+
+        take = min(k, candidate_count)
+        if take < candidate_count:
+            nearest = np.argpartition(squared, take - 1, axis=1)[:, :take]
+        else:
+            nearest = np.broadcast_to(np.arange(candidate_count), (face_count, candidate_count))
+        nearest_squared = np.take_along_axis(squared, nearest, axis=1)
+        order = np.argsort(nearest_squared, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_squared = np.take_along_axis(nearest_squared, order, axis=1)
+
+        result_rows[:, :take] = nearest if rows is None else rows[nearest]
+        result_distances[:, :take] = np.sqrt(nearest_squared.astype(np.float64))
+        return GallerySearchResult(result_rows, result_distances)
+
+
+class _GalleryDraft:
+    """Private working copy of a snapshot that one writer edits before publishing.
+
+    Metadata containers are copied up front. The matrix buffer is shared
+    with the base snapshot as long as only rows past its ``count`` are
+    written (appends); changing or moving a visible row, or growing past
+    the capacity, first moves the draft to a buffer of its own.
+    """
+
+    def __init__(self, base: GallerySnapshot | None, gallery: FaceGallery, capacity: int = _INITIAL_CAPACITY) -> None:
+        self.dim = gallery._dim
+        self.codec = gallery._codec
+        self.partition_key = gallery._partition_key
+        self.name_key = gallery._name_key
+        self.ann = gallery.ann
+        if base is None:
+            self.matrix = np.zeros((max(1, capacity), self.dim), dtype=self.codec.dtype)
+            self.scales = np.ones(max(1, capacity), dtype=np.float32) if self.codec.scaled else None
+            self.sq_norms = np.zeros(max(1, capacity), dtype=np.float32)
+            self.shared_rows = 0
+            self.owned = True
+            self.ids: list[str] = []
+            self.names: list[str] = []
+            self.hashes: list[str] = []
+            self.row_by_id: dict[str, int] = {}
+            # partition / image hash / name key -> member ids in insertion order
+            self.partitions: dict[str, tuple[str, ...]] = {}
+            self.by_hash: dict[str, tuple[str, ...]] = {}
+            self.by_name: dict[str, tuple[str, ...]] = {}
+            self.ann_state: IVFState | None = None
+            return
+        self.matrix = base._matrix
+        self.scales = base._scales
+        self.sq_norms = base._sq_norms
+        self.shared_rows = base._count
+        self.owned = False
+        self.ids = list(base._ids)
+        self.names = list(base._names)
+        self.hashes = list(base._hashes)
+        self.row_by_id = dict(base._row_by_id)
+        self.partitions = dict(base._partitions)
+        self.by_hash = dict(base._by_hash)
+        self.by_name = dict(base._by_name)
+        self.ann_state = base.ann_state.copy() if base.ann_state is not None else None
+
+    def _reallocate(self, capacity: int) -> None:
+        matrix = np.zeros((capacity, self.dim), dtype=self.codec.dtype)
+        sq_norms = np.zeros(capacity, dtype=np.float32)
+        count = len(self.ids)
+        matrix[:count] = self.matrix[:count]
+        sq_norms[:count] = self.sq_norms[:count]
+        if self.scales is not None:
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:count] = self.scales[:count]
+            self.scales = scales
+        self.matrix = matrix
+        self.sq_norms = sq_norms
+        self.owned = True
+
+    def set_vector(self, row: int, vector: np.ndarray) -> np.ndarray:
+        """Store ``vector`` in the (writable) ``row``; returns it as decoded from storage."""
+        stored, scales = self.codec.encode(vector[None, :])
+        self.matrix[row] = stored[0]
+        if self.scales is not None:
+            self.scales[row] = scales[0]
+        decoded = self.codec.decode(stored, scales)[0]
+        self.sq_norms[row] = float(np.dot(decoded, decoded))
+        return decoded
+
+    def move_row(self, source: int, target: int) -> None:
+        self.matrix[target] = self.matrix[source]
+        self.sq_norms[target] = self.sq_norms[source]
+        if self.scales is not None:
+            self.scales[target] = self.scales[source]
+
+    def decoded(self) -> np.ndarray:
+        count = len(self.ids)
+        return self.codec.decode(self.matrix[:count], None if self.scales is None else self.scales[:count])
+
+    def ensure_capacity(self, required: int) -> None:
+        capacity = max(1, self.matrix.shape[0])
+        if not self.matrix.flags.writeable:
+            self._reallocate(max(_INITIAL_CAPACITY, 2 * len(self.ids), required))
+            return
+        if required <= capacity:
+            return
+        while capacity < required:
+            capacity *= 2
+        self._reallocate(capacity)
+
+    def writable_row(self, row: int) -> None:
+        """Make ``row`` safe to overwrite without readers of the base noticing."""
+        if not self.matrix.flags.writeable or (not self.owned and row < self.shared_rows):
+            self._reallocate(max(_INITIAL_CAPACITY, self.matrix.shape[0], len(self.ids) + 1))
+
+    def member_partition(self, member_id: str) -> str:
+        if self.partition_key is None:
+            return ''
+        return str(self.partition_key(member_id) or '')
+
+    def index_row(self, row: int) -> None:
+        member_id = self.ids[row]
+        _group_add(self.by_hash, self.hashes[row], member_id)
+        _group_add(self.by_name, self.name_key(self.names[row]), member_id)
+
+    def unindex_row(self, row: int) -> None:
+        member_id = self.ids[row]
+        _group_discard(self.by_hash, self.hashes[row], member_id)
+        _group_discard(self.by_name, self.name_key(self.names[row]), member_id)
+
+
+class FaceGallery(MutableMapping):
+    """In-memory index of registered face encodings, published as snapshots.
+
+    Encodings live in one preallocated (capacity, 128) matrix with parallel
+    id / name / hash lists; capacity doubles when full, so appends are
+    amortized O(1). Deletion moves the last row into the freed slot. A
+    matrix adopted from disk (read-only memmap) is copied into a writable
+    buffer on the first mutation.
+
+    ``precision`` selects the in-memory row format (``face_quant``):
+    ``float32`` (default), ``float16`` or ``int8`` with a per-row scale, 2x
+    and ~3.9x smaller. Reads and ``export`` always return float32 values of
+    the stored rows, so the store keeps writing float32 snapshots.
+
+    Readers never lock: every read goes to the current ``GallerySnapshot``,
+    which is immutable. Writers are serialized by an internal lock, edit a
+    private draft and publish it with one reference swap, so a reader sees
+    either the state before or after a write, never a torn one. Appends
+    reuse the shared matrix buffer; updates and deletions copy it, as do the
+    metadata containers on every write (O(N), fine for registrations).
+    ``batch()`` groups many writes into one draft and one publish.
+
+    ``partition_key`` maps a member id to its partition (device id); members
+    with an empty key belong to no partition. Partitions are maintained on
+    every mutation so scoped searches only touch the partition's rows.
+
+    Secondary indexes image hash -> members and ``name_key(name)`` -> members
+    are kept the same way, so duplicate checks on registration look up a
+    handful of candidates instead of walking the gallery.
+
+    An optional ``ann`` index (``IVFIndex``) is told about every row change;
+    once trained it lets ``search(..., approximate=True)`` re-rank only a
+    shortlist of rows instead of the whole gallery.
+    """
+
+    def __init__(
+        self,
+        dim: int = ENCODING_DIM,
+        initial_capacity: int = _INITIAL_CAPACITY,
+        partition_key: Callable[[str], str] | None = None,
+        name_key: Callable[[str], str] | None = None,
+        ann: IVFIndex | None = None,
+        precision: str = 'float32',
+    ) -> None:
+        self._dim = int(dim)
+        self._codec = EncodingCodec(precision)
+        self._partition_key = partition_key
+        self._name_key = name_key or (lambda name: name)
+        self.ann = ann
+        self._write_lock = threading.RLock()
+        self._draft: _GalleryDraft | None = None
+        self._snapshot = GallerySnapshot(_GalleryDraft(None, self, int(initial_capacity)))
+
+    def snapshot(self) -> GallerySnapshot:
+        """The current published state; pin it for multi-step reads."""
+        return self._snapshot
+
+    @property
+    def precision(self) -> str:
+        return self._codec.precision
+
+    def set_precision(self, precision: str) -> None:
+        """Switch the row format, converting existing rows (lowering it is lossy).
+
+        Meant for startup, before the store loads the gallery; the ``ann``
+        lists of a populated gallery are dropped until the next training.
+        """
+        codec = EncodingCodec(precision)
+        with self._write_lock:
+            if codec.precision == self._codec.precision:
+                return
+            matrix, ids, names, hashes = self.export()
+            matrix = np.array(matrix, dtype=np.float32, copy=True)
+            previous, self._codec = self._codec, codec
+            try:
+                self.adopt(matrix, ids, names, hashes)
+            except Exception:
+                self._codec = previous
+                raise
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Apply every write inside the block as one publish (all or nothing)."""
+        with self._write_lock:
+            if self._draft is not None:
+                yield
+                return
+            self._draft = _GalleryDraft(self._snapshot, self)
+            try:
+                yield
+                self._snapshot = GallerySnapshot(self._draft)
+            finally:
+                self._draft = None
+
+    # ------------------------------------------------------------------
+    # Mapping interface (reads go to the current snapshot)
+    # ------------------------------------------------------------------
+    def __getitem__(self, member_id: str) -> dict[str, Any]:
+        return self._snapshot[member_id]
+
+    def __setitem__(self, member_id: str, info: dict[str, Any]) -> None:
+        self.upsert(
+            member_id,
+            info.get('name', ''),
+            info['encoding'],
+            info.get('image_hash', ''),
+        )
+
+    def __delitem__(self, member_id: str) -> None:
+        if not self.remove(member_id):
+            raise KeyError(member_id)
+
+    def __iter__(self) -> Iterator[str]:
+        # Snapshot lists are never modified, so callers may delete while walking.
+        return iter(self._snapshot)
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def __contains__(self, member_id: object) -> bool:
+        return member_id in self._snapshot
+
+    # ------------------------------------------------------------------
+    # Mutation
+    # ------------------------------------------------------------------
+    def adopt(self, matrix: np.ndarray, ids: list[str], names: list[str], hashes: list[str]) -> None:
+        """Replace the whole gallery with the float32 ``matrix``.
+
+        With float32 storage the matrix is used without copying; otherwise it
+        is converted into a buffer of the gallery's precision.
+        """
+        matrix = np.asarray(matrix)
+        if matrix.dtype != np.float32 or matrix.ndim != 2 or matrix.shape[1] != self._dim:
+            raise ValueError(f'Expected float32 (N, {self._dim}) matrix, got {matrix.dtype} {matrix.shape}')
+        if not (matrix.shape[0] == len(ids) == len(names) == len(hashes)):
+            raise ValueError('Gallery matrix and metadata sizes differ')
+
+        draft = _GalleryDraft(None, self)
+        if self._codec.precision == 'float32':
+            draft.matrix = matrix
+            draft.owned = False
+            draft.shared_rows = matrix.shape[0]
+        else:
+            # Converted chunk by chunk: the float32 source is never copied whole.
+            draft.matrix = np.empty((max(1, matrix.shape[0]), self._dim), dtype=self._codec.dtype)
+            draft.scales = np.ones(max(1, matrix.shape[0]), dtype=np.float32) if self._codec.scaled else None
+            for start in range(0, matrix.shape[0], _CONVERT_ROWS):
+                stop = start + _CONVERT_ROWS
+                stored, scales = self._codec.encode(matrix[start:stop])
+                draft.matrix[start:stop] = stored
+                if scales is not None:
+                    draft.scales[start:stop] = scales
+        count = matrix.shape[0]
+        draft.sq_norms = self._codec.squared_norms(
+            draft.matrix[:count], None if draft.scales is None else draft.scales[:count]
+        )
+        draft.ids = [str(member_id) for member_id in ids]
+        draft.names = [str(name) for name in names]
+        draft.hashes = [str(image_hash) for image_hash in hashes]
+        draft.row_by_id = {member_id: row for row, member_id in enumerate(draft.ids)}
+        if len(draft.row_by_id) != len(draft.ids):
+            raise ValueError('Gallery metadata contains duplicate member ids')
+        for row, member_id in enumerate(draft.ids):
+            _group_add(draft.partitions, draft.member_partition(member_id), member_id)
+            draft.index_row(row)
+        with self.batch():
+            self._draft = draft
+
+    def export(self) -> tuple[np.ndarray, list[str], list[str], list[str]]:
+        """Current rows as (matrix view, ids, names, hashes)."""
+        return self._snapshot.export()
+
+    def upsert(self, member_id: str, name: str, encoding: Any, image_hash: str = '') -> int:
+        """Insert or replace a member's encoding. Returns its row."""
+        member_id = str(member_id).strip()
+        vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self._dim:
+            raise ValueError(f'Encoding must have {self._dim} values, got {vector.shape[0]}')
+
+        with self.batch():
+            draft = self._draft
+            row = draft.row_by_id.get(member_id)
+            if row is None:
+                row = len(draft.ids)
+                draft.ensure_capacity(row + 1)
+                draft.writable_row(row)
+                draft.ids.append(member_id)
+                draft.names.append('')
+                draft.hashes.append('')
+                draft.row_by_id[member_id] = row
+                _group_add(draft.partitions, draft.member_partition(member_id), member_id)
+            else:
+                draft.writable_row(row)
+                draft.unindex_row(row)
+
+            stored_vector = draft.set_vector(row, vector)
+            draft.names[row] = str(name or '').strip()
+            draft.hashes[row] = str(image_hash or '').strip()
+            draft.index_row(row)
+            if draft.ann_state is not None:
+                draft.ann_state.set_row(row, stored_vector)
+        return row
+
+    def remove(self, member_id: str) -> bool:
+        member_id = str(member_id).strip()
+        with self.batch():
+            draft = self._draft
+            row = draft.row_by_id.pop(member_id, None)
+            if row is None:
+                return False
+            _group_discard(draft.partitions, draft.member_partition(member_id), member_id)
+            draft.unindex_row(row)
+            draft.writable_row(row)
+            if draft.ann_state is not None:
+                draft.ann_state.remove_row(row)
+
+            last = len(draft.ids) - 1
+            if row != last:
+                moved_id = draft.ids[last]
+                draft.move_row(last, row)
+                draft.ids[row] = moved_id
+                draft.names[row] = draft.names[last]
+                draft.hashes[row] = draft.hashes[last]
+                draft.row_by_id[moved_id] = row
+
+            draft.ids.pop()
+            draft.names.pop()
+            draft.hashes.pop()
+        return True
+
+    def clear(self) -> None:
+        with self.batch():
+            self._draft = _GalleryDraft(None, self)
+
+    def map_image_hashes(self, transform: Callable[[str], str]) -> int:
+        """Rewrite every stored image hash with ``transform``; returns how many changed."""
+        changed = 0
+        with self.batch():
+            draft = self._draft
+            for row, image_hash in enumerate(draft.hashes):
+                new_hash = str(transform(image_hash) or '').strip()
+                if new_hash != image_hash:
+                    member_id = draft.ids[row]
+                    _group_discard(draft.by_hash, image_hash, member_id)
+                    draft.hashes[row] = new_hash
+                    _group_add(draft.by_hash, new_hash, member_id)
+                    changed += 1
+        return changed
+
+    def install_index(self, centroids: np.ndarray) -> None:
+        """Switch the ``ann`` index to ``centroids`` and reassign every row."""
+        if self.ann is None:
+            return
+        with self.batch():
+            draft = self._draft
+            draft.ann_state = IVFState.build(centroids, draft.decoded()) if draft.ids else None
+
+    # ------------------------------------------------------------------
+    # Lookup / search on the current snapshot
+    # ------------------------------------------------------------------
+    def members(self) -> list[tuple[str, str]]:
+        return self._snapshot.members()
+
+    def member_at(self, row: int) -> tuple[str, str]:
+        return self._snapshot.member_at(row)
+
+    def rows_for(self, member_ids: Iterable[str]) -> np.ndarray:
+        return self._snapshot.rows_for(member_ids)
+
+    def members_with_hash(self, image_hash: str) -> list[str]:
+        return self._snapshot.members_with_hash(image_hash)
+
+    def members_named(self, name: str) -> list[str]:
+        return self._snapshot.members_named(name)
+
+    def partition_members(self, key: str) -> list[str]:
+        return self._snapshot.partition_members(key)
+
+    def partition_rows(self, key: str) -> np.ndarray:
+        return self._snapshot.partition_rows(key)
+
+    def partition_sizes(self) -> dict[str, int]:
+        return self._snapshot.partition_sizes()
+
+    def ann_stats(self) -> dict[str, Any] | None:
+        return self._snapshot.ann_stats()
+
+    def storage_stats(self) -> dict[str, Any]:
+        return self._snapshot.storage_stats()
+
+    def search(
+        self,
+        queries: Any,
+        k: int = 2,
+        rows: np.ndarray | None = None,
+        approximate: bool = False,
+        nprobe: int | None = None,
+    ) -> GallerySearchResult:
+        return self._snapshot.search(queries, k=k, rows=rows, approximate=approximate, nprobe=nprobe)
+
+
+class FaceGalleryStore:
+    """Binary on-disk snapshot of a ``FaceGallery`` plus a mutation journal.
+
+    Layout inside ``directory``:
+
+    - ``encodings-<generation>.npy`` -- float32 (N, 128) matrix, loaded with
+      ``mmap_mode='r'`` so startup does not parse or copy the vectors;
+    - ``gallery.json`` -- ids, names, hashes, the name of the matrix file and
+      ``journal_seq``, the last journal record folded into the snapshot;
+    - ``journal.log`` -- one JSON line per mutation (``put`` / ``del``),
+      appended and fsynced by ``put`` / ``delete``.
+
+    A snapshot writes the matrix under a new generation name and then
+    atomically replaces ``gallery.json``, which is the commit point: a crash
+    at any moment leaves the previous generation intact. Loading adopts the
+    snapshot and replays journal records newer than ``journal_seq``; a torn
+    last line from a crash during append is ignored.
+
+    Once the journal grows past ``compact_threshold_bytes`` a background
+    thread folds it into a fresh snapshot, so a registration costs one
+    appended record instead of a rewrite of the whole gallery. In the same
+    way the gallery's ``ann`` index is (re)trained in the background after a
+    load or once enough faces were added.
+    """
+
+    META_FILENAME = 'gallery.json'
+    JOURNAL_FILENAME = 'journal.log'
+
+    def __init__(
+        self,
+        directory: str | Path,
+        *,
+        compact_threshold_bytes: int = 8 * 1024 * 1024,
+        fsync_journal: bool = True,
+        logger=None,
+    ) -> None:
+        self.directory = Path(directory)
+        self.compact_threshold_bytes = max(0, int(compact_threshold_bytes))
+        self.fsync_journal = fsync_journal
+        self.logger = logger
+        # Keeps journal order equal to publish order and pairs a snapshot with its seq.
+        # Taken before the gallery write lock, never inside it.
+        self.lock = threading.RLock()
+        self._snapshot_lock = threading.Lock()
+        self._seq = 0
+        self._journal_file = None
+        self._compaction_thread: threading.Thread | None = None
+        self._index_thread: threading.Thread | None = None
+
+    @property
+    def meta_path(self) -> Path:
+        return self.directory / self.META_FILENAME
+
+    @property
+    def journal_path(self) -> Path:
+        return self.directory / self.JOURNAL_FILENAME
+
+    def exists(self) -> bool:
+        return self.meta_path.exists() or self.journal_path.exists()
+
+    def journal_size(self) -> int:
+        try:
+            return self.journal_path.stat().st_size
+        except OSError:
+            return 0
+
+    def _read_meta(self) -> dict[str, Any]:
+        with open(self.meta_path, 'r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        if not isinstance(meta, dict) or int(meta.get('version', 0)) != GALLERY_STORE_VERSION:
+            raise ValueError(f'Unsupported gallery store format in {self.meta_path}')
+        return meta
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+    def read_matrix(self) -> np.ndarray | None:
+        """float32 matrix of the stored snapshot (memory-mapped, journal not applied)."""
+        if not self.meta_path.exists():
+            return None
+        meta = self._read_meta()
+        if not meta.get('ids'):
+            return None
+        return np.load(self.directory / str(meta['matrix']), mmap_mode='r', allow_pickle=False)
+
+    def load_into(self, gallery: FaceGallery) -> dict[str, Any]:
+        """Adopt the stored snapshot into ``gallery`` and replay the journal.
+
+        Returns the snapshot metadata with ``replayed`` set to the number of
+        journal records applied on top of it.
+        """
+        with self.lock, gallery.batch():
+            # One publish: readers never see the snapshot without its journal.
+            self._close_journal()
+            if self.meta_path.exists():
+                meta = self._read_meta()
+                ids = list(meta.get('ids') or [])
+                if ids:
+                    matrix = np.load(self.directory / str(meta['matrix']), mmap_mode='r', allow_pickle=False)
+                else:
+                    matrix = np.zeros((0, ENCODING_DIM), dtype=np.float32)
+                gallery.adopt(matrix, ids, list(meta.get('names') or []), list(meta.get('hashes') or []))
+            else:
+                meta = {'version': GALLERY_STORE_VERSION, 'generation': 0, 'journal_seq': 0}
+                gallery.clear()
+
+            self._seq = int(meta.get('journal_seq', 0))
+            replayed = 0
+            for record in self._read_journal():
+                seq = int(record['seq'])
+                if seq <= self._seq:
+                    continue
+                self._apply(gallery, record)
+                self._seq = seq
+                replayed += 1
+            meta['replayed'] = replayed
+        self.maybe_train_index(gallery)
+        return meta
+
+    def _read_journal(self) -> Iterator[dict[str, Any]]:
+        if not self.journal_path.exists():
+            return
+        with open(self.journal_path, 'rb') as journal_file:
+            for raw_line in journal_file:
+                try:
+                    record = json.loads(raw_line)
+                    int(record['seq'])
+                except (ValueError, KeyError, TypeError):
+                    # Torn tail of an interrupted append: nothing after it was acknowledged.
+                    if self.logger:
+                        self.logger.warning('Face journal: ignoring damaged record in %s', self.journal_path)
+                    break
+                yield record
+
+    @staticmethod
+    def _apply(gallery: FaceGallery, record: dict[str, Any]) -> None:
+        op = record.get('op')
+        if op == 'put':
+            encoding = np.frombuffer(base64.b64decode(record['enc']), dtype=np.float32)
+            gallery.upsert(record['id'], record.get('name', ''), encoding, record.get('hash', ''))
+        elif op == 'del':
+            for member_id in record.get('ids') or []:
+                gallery.remove(member_id)
+
+    # ------------------------------------------------------------------
+    # Journaled mutations
+    # ------------------------------------------------------------------
+    def _append(self, record: dict[str, Any]) -> None:
+        if self._journal_file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._journal_file = open(self.journal_path, 'ab')
+        self._seq += 1
+        record['seq'] = self._seq
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        self._journal_file.write(line.encode('utf-8'))
+        self._journal_file.flush()
+        if self.fsync_journal:
+            os.fsync(self._journal_file.fileno())
+
+    def _close_journal(self) -> None:
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_journal()
+
+    def put(self, gallery: FaceGallery, member_id: str, name: str, encoding: Any, image_hash: str = '') -> None:
+        vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        with self.lock:
+            gallery.upsert(member_id, name, vector, image_hash)
+            self._append({
+                'op': 'put',
+                'id': str(member_id).strip(),
+                'name': str(name or '').strip(),
+                'hash': str(image_hash or '').strip(),
+                'enc': base64.b64encode(vector.tobytes()).decode('ascii'),
+            })
+        self.maybe_compact(gallery)
+        self.maybe_train_index(gallery)
+
+    def delete(self, gallery: FaceGallery, member_ids: Iterable[str]) -> list[str]:
+        """Remove members and journal the removal. Returns the removed ids."""
+        with self.lock:
+            removed = [str(member_id) for member_id in member_ids if gallery.remove(member_id)]
+            if removed:
+                self._append({'op': 'del', 'ids': removed})
+        if removed:
+            self.maybe_compact(gallery)
+        return removed
+
+    def reset(self, gallery: FaceGallery) -> None:
+        """Empty ``gallery`` and delete every stored file."""
+        with self._snapshot_lock, self.lock:
+            gallery.clear()
+            self._close_journal()
+            self._seq = 0
+            if not self.directory.exists():
+                return
+            paths = list(self.directory.glob('encodings-*.npy*'))
+            paths += [self.meta_path, self.journal_path]
+            for path in paths:
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+
+    def replace(
+        self,
+        gallery: FaceGallery,
+        build: Callable[[FaceGallery], tuple[np.ndarray, list[str], list[str], list[str]]],
+    ) -> dict[str, Any]:
+        """Swap the whole content of ``gallery`` and persist it as a new snapshot.
+
+        ``build(gallery)`` runs under ``lock`` and returns the new (matrix, ids,
+        names, hashes); no mutation can slip in between reading the gallery and
+        adopting the result. The snapshot is written after the lock is released
+        and folds the journal, so a crash before it leaves the previous state.
+        """
+        with self.lock, gallery.batch():
+            matrix, ids, names, hashes = build(gallery)
+            gallery.adopt(np.ascontiguousarray(matrix, dtype=np.float32), ids, names, hashes)
+        meta = self.save(gallery)
+        self.maybe_train_index(gallery)
+        return meta
+
+    # ------------------------------------------------------------------
+    # Snapshots / compaction
+    # ------------------------------------------------------------------
+    def save(self, gallery: FaceGallery) -> dict[str, Any]:
+        """Write ``gallery`` as a new snapshot and drop the folded journal."""
+        with self._snapshot_lock:
+            with self.lock:
+                # Published snapshots are immutable: writers continue while the file is written.
+                matrix, ids, names, hashes = gallery.snapshot().export()
+                seq = self._seq
+
+            meta = self._write_snapshot(matrix, ids, names, hashes, seq)
+
+            with self.lock:
+                self._trim_journal(seq)
+            return meta
+
+    def _write_snapshot(
+        self,
+        matrix: np.ndarray,
+        ids: list[str],
+        names: list[str],
+        hashes: list[str],
+        journal_seq: int,
+    ) -> dict[str, Any]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        generation = 1
+        if self.meta_path.exists():
+            try:
+                generation = int(self._read_meta().get('generation', 0)) + 1
+            except (OSError, ValueError):
+                generation = 1
+
+        matrix_name = f'encodings-{generation}.npy'
+        matrix_temp = self.directory / f'{matrix_name}.tmp'
+        with open(matrix_temp, 'wb') as matrix_file:
+            np.save(matrix_file, np.ascontiguousarray(matrix, dtype=np.float32), allow_pickle=False)
+            matrix_file.flush()
+            os.fsync(matrix_file.fileno())
+        os.replace(matrix_temp, self.directory / matrix_name)
+
+        meta = {
+            'version': GALLERY_STORE_VERSION,
+            'generation': generation,
+            'journal_seq': int(journal_seq),
+            'dim': int(matrix.shape[1]) if matrix.ndim == 2 else ENCODING_DIM,
+            'count': len(ids),
+            'matrix': matrix_name,
+            'ids': ids,
+            'names': names,
+            'hashes': hashes,
+        }
+        meta_temp = self.directory / f'{self.META_FILENAME}.tmp'
+        with open(meta_temp, 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file, ensure_ascii=False, separators=(',', ':'))
+            meta_file.flush()
+            os.fsync(meta_file.fileno())
+        os.replace(meta_temp, self.meta_path)
+
+        self._remove_stale_matrices(keep=matrix_name)
+        return meta
+
+    def _trim_journal(self, folded_seq: int) -> None:
+        """Keep only journal records newer than ``folded_seq``. Caller holds ``lock``."""
+        self._close_journal()
+        if not self.journal_path.exists():
+            return
+        pending = [
+            json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+            for record in self._read_journal()
+            if int(record['seq']) > folded_seq
+        ]
+        if not pending:
+            self.journal_path.unlink()
+            return
+        journal_temp = self.directory / f'{self.JOURNAL_FILENAME}.tmp'
+        with open(journal_temp, 'wb') as journal_file:
+            journal_file.write(''.join(pending).encode('utf-8'))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(journal_temp, self.journal_path)
+
+    def _remove_stale_matrices(self, keep: str) -> None:
+        for path in self.directory.glob('encodings-*.npy*'):
+            if path.name == keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                # Still memory-mapped (Windows); removed by a later save.
+                continue
+
+    def maybe_compact(self, gallery: FaceGallery) -> bool:
+        """Start a background compaction once the journal passes the threshold."""
+        if not self.compact_threshold_bytes or self.journal_size() < self.compact_threshold_bytes:
+            return False
+        with self.lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return False
+            self._compaction_thread = threading.Thread(
+                target=self._compact_worker,
+                args=(gallery,),
+                name='face-gallery-compaction',
+                daemon=True,
+            )
+            self._compaction_thread.start()
+        return True
+
+    def _compact_worker(self, gallery: FaceGallery) -> None:
+        try:
+            meta = self.save(gallery)
+            if self.logger:
+                self.logger.info(
+                    'Face journal compacted into snapshot generation %s (%s faces)',
+                    meta['generation'],
+                    meta['count'],
+                )
+        except Exception:
+            if self.logger:
+                self.logger.exception('Face journal compaction failed')
+
+    def wait_for_compaction(self, timeout: float | None = None) -> None:
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    # ------------------------------------------------------------------
+    # Approximate index
+    # ------------------------------------------------------------------
+    def maybe_train_index(self, gallery: FaceGallery) -> bool:
+        """Start a background (re)training of ``gallery.ann`` when it asks for one."""
+        index = gallery.ann
+        if index is None or not index.needs_training(len(gallery), gallery.snapshot().ann_state):
+            return False
+        with self.lock:
+            if self._index_thread is not None and self._index_thread.is_alive():
+                return False
+            self._index_thread = threading.Thread(
+                target=self._train_index_worker,
+                args=(gallery,),
+                name='face-gallery-index',
+                daemon=True,
+            )
+            self._index_thread.start()
+        return True
+
+    def _train_index_worker(self, gallery: FaceGallery) -> None:
+        try:
+            index = gallery.ann
+            sample = index.training_sample(gallery.snapshot().export()[0])
+            # k-means runs outside the lock; rows added meanwhile are assigned on install.
+            centroids = index.fit(sample)
+            with self.lock:
+                gallery.install_index(centroids)
+            if self.logger:
+                self.logger.info(
+                    'Face ANN index trained: %s cells over %s faces',
+                    centroids.shape[0],
+                    len(gallery),
+                )
+        except Exception:
+            if self.logger:
+                self.logger.exception('Face ANN index training failed')
+
+    def wait_for_index(self, timeout: float | None = None) -> None:
+        thread = self._index_thread
+        if thread is not None:
+            thread.join(timeout)
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from face_admission import AdmissionLimiter, AdmissionRejected
+
+
+class FaceJobQueueFull(Exception):
+    """The job queue already holds ``max_pending`` unfinished jobs."""
+
+
+class FaceJobQueue:
+    """Bounded in-memory queue of background face jobs with pollable status.
+
+    ``submit`` runs ``fn(*args)`` on one of ``workers`` threads and returns a
+    job id right away; at most ``max_pending`` jobs may be queued or running,
+    further submits raise ``FaceJobQueueFull``. A job goes ``queued`` ->
+    ``running`` -> ``done`` (``result`` is what ``fn`` returned) or ``failed``
+    (``error`` is the exception text). Finished jobs stay visible to ``get``
+    for ``keep_sec`` seconds, and at most ``max_kept`` of them are kept.
+
+    With ``admission`` a job holds a slot of that limiter while it runs, the
+    same slots the synchronous face endpoints take, so background work does
+    not add to the face load the limiter allows. A job stays ``queued`` until
+    it gets a slot; a rejection (queue full or wait timed out) is retried
+    after its ``retry_after``.
+
+    The threads only wait on the face worker pool, so they are cheap; jobs
+    are lost on restart. Keep job arguments compact (compressed upload bytes
+    rather than decoded frames): up to ``max_pending`` of them stay in memory.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        *,
+        max_pending: int = 64,
+        keep_sec: float = 3600.0,
+        max_kept: int = 1000,
+        name: str = 'face-job',
+        admission: AdmissionLimiter | None = None,
+        logger=None,
+    ) -> None:
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.keep_sec = max(0.0, float(keep_sec))
+        self.max_kept = max(1, int(max_kept))
+        self.name = name
+        self.admission = admission
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._jobs: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def _prune(self) -> None:
+        """Drop expired / surplus finished jobs. Caller holds ``_lock``."""
+        now = time.time()
+        finished = [
+            job_id for job_id, job in self._jobs.items()
+            if job['status'] in ('done', 'failed')
+        ]
+        surplus = len(finished) - self.max_kept
+        for job_id in finished:
+            job = self._jobs[job_id]
+            if surplus > 0 or now - job['finished_at'] > self.keep_sec:
+                del self._jobs[job_id]
+                surplus -= 1
+
+    def submit(self, fn: Callable[..., dict[str, Any]], *args: Any, meta: dict[str, Any] | None = None) -> dict[str, Any]:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise FaceJobQueueFull(f'{self._pending} face jobs are already pending')
+            self._prune()
+            job_id = uuid.uuid4().hex
+            job = {
+                'job_id': job_id,
+                'status': 'queued',
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                **(meta or {}),
+            }
+            self._jobs[job_id] = job
+            self._pending += 1
+            snapshot = dict(job)
+            executor = self._get_executor()
+        executor.submit(self._run, job_id, fn, args)
+        return snapshot
+
+    def _admit(self) -> None:
+        while True:
+            try:
+                self.admission.acquire()
+                return
+            except AdmissionRejected as rejected:
+                time.sleep(rejected.retry_after)
+
+    def _run(self, job_id: str, fn: Callable[..., dict[str, Any]], args: tuple) -> None:
+        if self.admission is not None:
+            self._admit()
+        with self._lock:
+            job = self._jobs[job_id]
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+        started = time.monotonic()
+        result, error = None, None
+        try:
+            result = fn(*args)
+        except Exception as exc:
+            error = str(exc) or exc.__class__.__name__
+            if self.logger:
+                self.logger.warning('Face job %s failed: %s', job_id, error)
+        finally:
+            if self.admission is not None:
+                self.admission.release(time.monotonic() - started)
+        with self._lock:
+            job['finished_at'] = time.time()
+            job['status'] = 'failed' if error is not None else 'done'
+            job['result'] = result
+            job['error'] = error
+            self._pending -= 1
+            if error is None:
+                self._completed += 1
+            else:
+                self._failed += 1
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(str(job_id))
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id: str, timeout: float | None = None) -> dict[str, Any] | None:
+        """Poll until the job finishes (tests / CLI)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in ('done', 'failed'):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(0.01)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'completed': self._completed,
+                'failed': self._failed,
+                'kept': len(self._jobs),
+            }
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+from typing import Any
+
+import numpy as np
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+_INT8_LEVELS = 127.0
+_CHUNK_ROWS = 4096
+_QUERY_CHUNK = 64
+
+
+class EncodingCodec:
+    """How a gallery keeps its encoding rows in memory.
+
+    - ``float32`` -- as computed, 512 bytes per 128-d face;
+    - ``float16`` -- half precision, 256 bytes (relative error ~5e-4);
+    - ``int8`` -- symmetric scalar quantization with one float32 scale per
+      row (``row ~= scale * q``, ``q`` in -127..127), 128 + 4 bytes.
+
+    Searches multiply float32 queries with blocks of rows widened to float32
+    on the fly (``dot_products``), so only ``_CHUNK_ROWS`` rows are ever held
+    at full precision. Widening int8 is cheap; numpy widens float16 without
+    SIMD, so float16 searches cost several times the float32 ones (see
+    benchmarks/quant_eval.py). Distances are exact for the decoded rows; the only
+    error is the rounding made once by ``encode``, and ``decode`` followed by
+    ``encode`` gives back the same row.
+    """
+
+    def __init__(self, precision: str = 'float32') -> None:
+        precision = str(precision or 'float32').strip().lower()
+        if precision not in PRECISIONS:
+            raise ValueError(f'Unsupported encoding precision {precision!r}, expected one of {PRECISIONS}')
+        self.precision = precision
+        self.dtype = np.dtype(precision)
+        self.scaled = precision == 'int8'
+
+    def row_bytes(self, dim: int) -> int:
+        """Bytes per stored row, scale included (the squared norm is not)."""
+        return int(dim) * self.dtype.itemsize + (4 if self.scaled else 0)
+
+    def encode(self, vectors: Any) -> tuple[np.ndarray, np.ndarray | None]:
+        """(stored rows, per-row scales or None) of a 2-d float array."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.precision == 'float32':
+            return np.array(vectors, copy=True), None
+        if self.precision == 'float16':
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / _INT8_LEVELS
+        scales[scales == 0.0] = 1.0
+        quantized = np.rint(vectors / scales[:, None])
+        np.clip(quantized, -_INT8_LEVELS, _INT8_LEVELS, out=quantized)
+        return quantized.astype(np.int8), scales.astype(np.float32)
+
+    def decode(self, stored: np.ndarray, scales: np.ndarray | None = None) -> np.ndarray:
+        """Rows as float32 (a view for float32 storage, else a new array)."""
+        decoded = np.asarray(stored, dtype=np.float32)
+        if self.scaled:
+            decoded = decoded * np.asarray(scales, dtype=np.float32)[:, None]
+        return decoded
+
+    def squared_norms(self, stored: np.ndarray, scales: np.ndarray | None = None) -> np.ndarray:
+        """|row|^2 of the decoded rows, decoded a chunk at a time."""
+        norms = np.empty(stored.shape[0], dtype=np.float32)
+        for start in range(0, stored.shape[0], _CHUNK_ROWS):
+            stop = start + _CHUNK_ROWS
+            block = self.decode(stored[start:stop], None if scales is None else scales[start:stop])
+            norms[start:stop] = np.einsum('ij,ij->i', block, block)
+        return norms
+
+
+def dot_products(
+    queries: np.ndarray,
+    stored: np.ndarray,
+    scales: np.ndarray | None = None,
+    rows: np.ndarray | None = None,
+) -> np.ndarray:
+    """float32 (queries x rows) dot products of float32 ``queries`` with stored rows.
+
+    ``stored`` holds the rows of any ``EncodingCodec``; ``rows`` selects a
+    subset of them. Reduced precision rows are widened one chunk at a time,
+    and a per-row int8 scale is applied to the products rather than the rows.
+    """
+    if stored.dtype == np.float32:
+        candidates = stored if rows is None else stored[rows]
+        return queries @ candidates.T
+
+    count = stored.shape[0] if rows is None else rows.shape[0]
+    products = np.empty((queries.shape[0], count), dtype=np.float32)
+    for start in range(0, count, _CHUNK_ROWS):
+        stop = min(count, start + _CHUNK_ROWS)
+        block = stored[start:stop] if rows is None else stored[rows[start:stop]]
+        np.matmul(queries, block.astype(np.float32).T, out=products[:, start:stop])
+    if scales is not None:
+        products *= (scales if rows is None else scales[rows])[None, :]
+    return products
+
+
+def _nearest_two(
+    queries: np.ndarray,
+    query_norms: np.ndarray,
+    stored: np.ndarray,
+    scales: np.ndarray | None,
+    norms: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Two nearest rows, their distances and all (query x row) distances (float64)."""
+    squared = dot_products(queries, stored, scales).astype(np.float64)
+    squared *= -2.0
+    squared += query_norms[:, None]
+    squared += norms[None, :]
+    np.maximum(squared, 0.0, out=squared)
+    distances = np.sqrt(squared)
+    take = min(2, distances.shape[1])
+    nearest = np.argpartition(distances, take - 1, axis=1)[:, :take] if take < distances.shape[1] else (
+        np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    )
+    nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+    order = np.argsort(nearest_distances, axis=1)
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+    if take < 2:
+        nearest = np.hstack([nearest, np.full((nearest.shape[0], 1), -1)])
+        nearest_distances = np.hstack([nearest_distances, np.full((nearest.shape[0], 1), np.inf)])
+    return nearest, nearest_distances, distances
+
+
+def _decisions(nearest: np.ndarray, distances: np.ndarray, threshold: float, margin: float) -> np.ndarray:
+    """Accepted row per query (-1 = no match) under the recognition threshold / margin rules."""
+    accepted = (distances[:, 0] <= threshold) & ((distances[:, 1] - distances[:, 0]) >= margin)
+    return np.where(accepted, nearest[:, 0], -1)
+
+
+def evaluate_precision(
+    reference: Any,
+    precision: str,
+    *,
+    queries: Any = None,
+    query_count: int = 500,
+    query_noise: float = 0.02,
+    threshold: float = 0.6,
+    margin: float = 0.0,
+    max_rows: int = 50000,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Compare searches over ``reference`` stored in ``precision`` with float32 storage.
+
+    ``reference`` is a float32 (N, dim) gallery matrix. Without ``queries``
+    the probes are ``query_count`` random gallery rows plus Gaussian noise of
+    ``query_noise`` per component (a new photo of a registered face). Larger
+    galleries are evaluated on ``max_rows`` random rows.
+
+    Reports the memory per face, the absolute error of all query-to-row
+    distances and of the nearest distance, the share of queries whose nearest
+    row changes (``top1_disagreement``) and whose recognition outcome under
+    ``threshold`` / ``margin`` changes (``decision_disagreement``).
+    """
+    codec = EncodingCodec(precision)
+    baseline = EncodingCodec('float32')
+    rng = np.random.default_rng(seed)
+    reference = np.asarray(reference, dtype=np.float32)
+    if reference.ndim != 2 or reference.shape[0] == 0:
+        raise ValueError('Reference gallery is empty')
+    if reference.shape[0] > max_rows:
+        reference = reference[np.sort(rng.choice(reference.shape[0], size=max_rows, replace=False))]
+    count, dim = reference.shape
+
+    if queries is None:
+        picked = rng.integers(0, count, size=max(1, int(query_count)))
+        queries = reference[picked] + rng.normal(0.0, query_noise, size=(picked.size, dim)).astype(np.float32)
+    queries = np.ascontiguousarray(np.asarray(queries, dtype=np.float32).reshape(-1, dim))
+    query_norms = np.einsum('ij,ij->i', queries, queries).astype(np.float64)
+
+    exact_norms = baseline.squared_norms(reference).astype(np.float64)
+    stored, scales = codec.encode(reference)
+    norms = codec.squared_norms(stored, scales).astype(np.float64)
+
+    error_sum = error_max = top1_error_max = 0.0
+    top1_changed = decisions_changed = 0
+    for start in range(0, queries.shape[0], _QUERY_CHUNK):
+        chunk = queries[start:start + _QUERY_CHUNK]
+        chunk_norms = query_norms[start:start + _QUERY_CHUNK]
+        exact_rows, exact_nearest, exact_all = _nearest_two(chunk, chunk_norms, reference, None, exact_norms)
+        rows, nearest, approx_all = _nearest_two(chunk, chunk_norms, stored, scales, norms)
+        errors = np.abs(approx_all - exact_all)
+        error_sum += float(errors.sum())
+        error_max = max(error_max, float(errors.max()))
+        top1_error_max = max(top1_error_max, float(np.abs(nearest[:, 0] - exact_nearest[:, 0]).max()))
+        top1_changed += int(np.count_nonzero(rows[:, 0] != exact_rows[:, 0]))
+        decisions_changed += int(np.count_nonzero(
+            _decisions(rows, nearest, threshold, margin) != _decisions(exact_rows, exact_nearest, threshold, margin)
+        ))
+
+    query_total = queries.shape[0]
+    return {
+        'precision': codec.precision,
+        'faces': count,
+        'queries': query_total,
+        'bytes_per_face': codec.row_bytes(dim) + 4,
+        'float32_bytes_per_face': baseline.row_bytes(dim) + 4,
+        'compression': round(baseline.row_bytes(dim) / codec.row_bytes(dim), 2),
+        'distance_error_mean': error_sum / (query_total * count),
+        'distance_error_max': error_max,
+        'top1_distance_error_max': top1_error_max,
+        'top1_disagreement': top1_changed / query_total,
+        'decision_disagreement': decisions_changed / query_total,
+    }
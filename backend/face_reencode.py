@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+
+from face_chips import FaceChipStore
+from face_gallery import FaceGallery, FaceGalleryStore
+
+REENCODE_STATE_VERSION = 1
+
+
+def encoding_digest(encoding: Any) -> str:
+    """Short digest of a stored encoding, to notice members re-registered meanwhile."""
+    vector = np.ascontiguousarray(encoding, dtype=np.float32)
+    return hashlib.blake2b(vector.tobytes(), digest_size=12).hexdigest()
+
+
+class ReencodeBusy(Exception):
+    """A re-encode run is already in progress."""
+
+
+class GalleryReencoder:
+    """Resumable bulk re-encode of the gallery from its reference photos.
+
+    For every member that has ``<photos_dir>/<member_id>.jpg`` the photo bytes
+    go through ``encode`` (current detection / encoding settings, one
+    encoding or an exception) on ``workers`` threads. Results are journaled
+    to a staging ``FaceGalleryStore`` under ``staging_dir`` as they arrive, so
+    an interrupted run resumes where it stopped as long as ``fingerprint``
+    (the encoding settings) is unchanged; a different fingerprint starts over.
+
+    With ``chips`` and ``encode_chip`` a member whose face chip was saved at
+    registration is encoded from the chip and its stored box instead
+    (``encode_chip(chip, location)``), skipping decode and detection of the
+    full photo; the photo is the fallback for members without a chip.
+
+    The live gallery is untouched until the end. Then, in one
+    ``FaceGalleryStore.replace``, each member still holding the encoding it
+    had when the run started gets the new one; members registered, updated
+    or deleted meanwhile keep their live state, and members without a photo
+    or whose photo failed keep the old encoding (counted as ``stale``).
+    """
+
+    STATE_FILENAME = 'state.json'
+
+    def __init__(
+        self,
+        store: FaceGalleryStore,
+        gallery: FaceGallery,
+        photos_dir: str | Path,
+        staging_dir: str | Path,
+        encode: Callable[[bytes], Any],
+        fingerprint: str,
+        *,
+        workers: int = 2,
+        chips: FaceChipStore | None = None,
+        encode_chip: Callable[[np.ndarray, tuple[int, int, int, int]], Any] | None = None,
+        logger=None,
+    ) -> None:
+        self.store = store
+        self.gallery = gallery
+        self.photos_dir = Path(photos_dir)
+        self.staging_dir = Path(staging_dir)
+        self.encode = encode
+        self.fingerprint = fingerprint
+        self.workers = max(1, int(workers))
+        self.chips = chips if encode_chip is not None else None
+        self.encode_chip = encode_chip
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._cancel = threading.Event()
+        self._progress: dict[str, Any] = {'status': 'idle'}
+
+    @property
+    def state_path(self) -> Path:
+        return self.staging_dir / self.STATE_FILENAME
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    # ------------------------------------------------------------------
+    # Control
+    # ------------------------------------------------------------------
+    def start(self, *, fresh: bool = False) -> dict[str, Any]:
+        """Run in a background thread; raises ``ReencodeBusy`` if one is running."""
+        with self._lock:
+            if self.running:
+                raise ReencodeBusy('Gallery re-encode is already running')
+            self._cancel.clear()
+            self._progress = {'status': 'starting'}
+            self._thread = threading.Thread(
+                target=self._run_logged,
+                args=(fresh,),
+                name='face-gallery-reencode',
+                daemon=True,
+            )
+            self._thread.start()
+        return self.status()
+
+    def cancel(self) -> bool:
+        """Stop after the photos in flight; staged results are kept for a resume."""
+        if not self.running:
+            return False
+        self._cancel.set()
+        return True
+
+    def wait(self, timeout: float | None = None) -> dict[str, Any]:
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.status()
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            progress = dict(self._progress)
+        started = progress.get('started_monotonic')
+        if started is not None:
+            elapsed = (progress.get('finished_monotonic') or time.monotonic()) - started
+            processed = progress.get('processed', 0)
+            remaining = progress.get('total', 0) - progress.get('done', 0) - progress.get('failed', 0)
+            progress['elapsed_sec'] = round(elapsed, 1)
+            progress['photos_per_sec'] = round(processed / elapsed, 2) if elapsed > 0 else None
+            progress['eta_sec'] = (
+                round(remaining * elapsed / processed, 1)
+                if processed and progress['status'] == 'running' else None
+            )
+        progress.pop('started_monotonic', None)
+        progress.pop('finished_monotonic', None)
+        progress['staged'] = self.state_path.exists()
+        return progress
+
+    def _update(self, **changes: Any) -> None:
+        with self._lock:
+            self._progress.update(changes)
+
+    def _bump(self, key: str) -> None:
+        with self._lock:
+            self._progress[key] = self._progress.get(key, 0) + 1
+            self._progress['processed'] = self._progress.get('processed', 0) + 1
+
+    # ------------------------------------------------------------------
+    # Staging state
+    # ------------------------------------------------------------------
+    def _read_state(self) -> dict[str, Any] | None:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as handle:
+                state = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(state, dict) or state.get('version') != REENCODE_STATE_VERSION:
+            return None
+        return state
+
+    def _write_state(self, state: dict[str, Any]) -> None:
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.state-', suffix='.json', dir=self.staging_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+            json.dump(state, handle, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.state_path)
+
+    def _new_state(self) -> dict[str, Any]:
+        with self.store.lock:
+            matrix, ids, _, _ = self.gallery.export()
+            baseline = {member_id: encoding_digest(matrix[row]) for row, member_id in enumerate(ids)}
+        return {
+            'version': REENCODE_STATE_VERSION,
+            'fingerprint': self.fingerprint,
+            'created_at': time.time(),
+            'baseline': baseline,
+        }
+
+    # ------------------------------------------------------------------
+    # Run
+    # ------------------------------------------------------------------
+    def _run_logged(self, fresh: bool) -> None:
+        try:
+            self.run(fresh=fresh)
+        except Exception as exc:
+            self._update(status='failed', error=str(exc), finished_monotonic=time.monotonic())
+            if self.logger:
+                self.logger.exception('Gallery re-encode failed')
+
+    def run(self, *, fresh: bool = False, on_progress: Callable[[dict[str, Any]], None] | None = None) -> dict[str, Any]:
+        """Re-encode in the calling thread (CLI); returns the final status."""
+        state = None if fresh else self._read_state()
+        resumed = state is not None and state.get('fingerprint') == self.fingerprint
+        if not resumed:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            state = self._new_state()
+            self._write_state(state)
+
+        staging_store = FaceGalleryStore(self.staging_dir / 'gallery', compact_threshold_bytes=0)
+        staged = FaceGallery()
+        staging_store.load_into(staged)
+
+        baseline: dict[str, str] = state['baseline']
+        pending, missing, from_chip = [], 0, 0
+        for member_id in baseline:
+            if member_id in staged:
+                continue
+            photo_path = self.photos_dir / f'{member_id}.jpg'
+            if self.chips is not None and self.chips.has(member_id):
+                pending.append((member_id, photo_path))
+                from_chip += 1
+            elif photo_path.is_file():
+                pending.append((member_id, photo_path))
+            else:
+                missing += 1
+
+        self._update(
+            status='running',
+            fingerprint=self.fingerprint,
+            resumed=resumed,
+            total=len(baseline) - missing,
+            done=len(staged),
+            failed=0,
+            missing_photo=missing,
+            from_chip=from_chip,
+            processed=0,
+            errors={},
+            started_monotonic=time.monotonic(),
+            finished_monotonic=None,
+            error=None,
+        )
+        if self.logger:
+            self.logger.info(
+                'Gallery re-encode %s: %s faces to encode (%s from chips), %s already staged, %s members without photo',
+                'resumed' if resumed else 'started', len(pending), from_chip, len(staged), missing,
+            )
+
+        names = dict(self.gallery.members())
+
+        def encode_one(member_id: str, photo_path: Path) -> Any:
+            if self._cancel.is_set():
+                return None
+            chip = self.chips.load(member_id) if self.chips is not None else None
+            if chip is not None:
+                return self.encode_chip(*chip)
+            return self.encode(photo_path.read_bytes())
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='face-reencode') as executor:
+            futures = {
+                executor.submit(encode_one, member_id, photo_path): member_id
+                for member_id, photo_path in pending
+            }
+            for future in as_completed(futures):
+                member_id = futures[future]
+                try:
+                    encoding = future.result()
+                except Exception as exc:
+                    self._bump('failed')
+                    with self._lock:
+                        errors = self._progress['errors']
+                        if len(errors) < 100:
+                            errors[member_id] = str(exc) or exc.__class__.__name__
+                else:
+                    if encoding is None:
+                        continue
+                    staging_store.put(staged, member_id, names.get(member_id, ''), encoding)
+                    self._bump('done')
+                if on_progress is not None:
+                    on_progress(self.status())
+
+        staging_store.close()
+        if self._cancel.is_set():
+            self._update(status='cancelled', finished_monotonic=time.monotonic())
+            return self.status()
+
+        swapped, stale = self._swap(baseline, staged)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        self._update(
+            status='completed',
+            swapped=swapped,
+            stale=stale,
+            finished_monotonic=time.monotonic(),
+        )
+        if self.logger:
+            self.logger.info('Gallery re-encode completed: %s encodings replaced, %s kept', swapped, stale)
+        return self.status()
+
+    def _swap(self, baseline: dict[str, str], staged: FaceGallery) -> tuple[int, int]:
+        counts = {'swapped': 0, 'stale': 0}
+
+        def build(gallery: FaceGallery):
+            matrix, ids, names, hashes = gallery.export()
+            matrix = np.array(matrix, dtype=np.float32, copy=True)
+            counts['swapped'] = counts['stale'] = 0
+            for row, member_id in enumerate(ids):
+                if baseline.get(member_id) != encoding_digest(matrix[row]):
+                    continue  # registered or updated after the run started
+                if member_id in staged:
+                    matrix[row] = staged[member_id]['encoding']
+                    counts['swapped'] += 1
+                else:
+                    counts['stale'] += 1
+            return matrix, ids, names, hashes
+
+        self.store.replace(self.gallery, build)
+        return counts['swapped'], counts['stale']
+
+
+def main(argv: list[str] | None = None) -> int:
+    """CLI: re-encode the gallery of this backend with the settings from .env.
+
+    Run it while the server is stopped (it writes the same gallery files);
+    with the server running use POST /api/v2/admin/face-gallery/reencode.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Re-encode face gallery from reference photos')
+    parser.add_argument('--fresh', action='store_true', help='discard staged results of an interrupted run')
+    parser.add_argument('--workers', type=int, default=0, help='parallel photos (default: FACE_REENCODE_WORKERS)')
+    args = parser.parse_args(argv)
+
+    import telegram_service as ts
+
+    if not ts.FACE_RECOGNITION_AVAILABLE:
+        print(f'face_recognition is unavailable: {ts.FACE_RECOGNITION_IMPORT_ERROR}')
+        return 2
+    ts.load_encodings()
+    reencoder = ts.face_gallery_reencoder
+    if args.workers > 0:
+        reencoder.workers = args.workers
+
+    last_print = [0.0]
+
+    def report(progress: dict[str, Any]) -> None:
+        now = time.monotonic()
+        if now - last_print[0] < 2.0:
+            return
+        last_print[0] = now
+        print(
+            f"{progress.get('done', 0)}/{progress.get('total', 0)} done, "
+            f"{progress.get('failed', 0)} failed, {progress.get('photos_per_sec')} photos/s, "
+            f"eta {progress.get('eta_sec')}s",
+            flush=True,
+        )
+
+    try:
+        result = reencoder.run(fresh=args.fresh, on_progress=report)
+    finally:
+        ts.face_worker_pool.shutdown()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result.get('status') == 'completed' else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import multiprocessing
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable
+
+import numpy as np
+
+
+class FaceWorkerTimeout(Exception):
+    """A face job did not finish within the pool timeout."""
+
+
+# ----------------------------------------------------------------------
+# Worker-side functions. They run inside pool processes, so they must stay
+# importable from this module without pulling in Flask or the HTTP app.
+# ----------------------------------------------------------------------
+_face_recognition = None
+
+
+def _get_face_recognition():
+    global _face_recognition
+    if _face_recognition is None:
+        import face_recognition
+
+        _face_recognition = face_recognition
+    return _face_recognition
+
+
+def init_worker(detector_model: str = 'hog', encoding_model: str = 'large') -> None:
+    """Import dlib and load its models once per process, before the first job."""
+    face_recognition = _get_face_recognition()
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    face_recognition.face_locations(blank, model=detector_model, number_of_times_to_upsample=0)
+    face_recognition.face_encodings(blank, [(8, 56, 56, 8)], num_jitters=1, model=encoding_model)
+
+
+def ready_job() -> int:
+    """No-op used by ``FaceWorkerPool.start`` to bring worker processes up."""
+    return 0
+
+
+def face_locations_job(image: np.ndarray, model: str, upsample: int) -> list[tuple[int, int, int, int]]:
+    return list(_get_face_recognition().face_locations(
+        image,
+        model=model,
+        number_of_times_to_upsample=upsample,
+    ))
+
+
+def timed_face_locations_job(image: np.ndarray, model: str, upsample: int) -> tuple[list[tuple[int, int, int, int]], float]:
+    """``face_locations_job`` plus the seconds spent in the worker (for cascade stats)."""
+    start = time.perf_counter()
+    locations = face_locations_job(image, model, upsample)
+    return locations, time.perf_counter() - start
+
+
+def batch_face_locations_job(images: list[np.ndarray], upsample: int, batch_size: int) -> list[list[tuple]]:
+    return [list(locations) for locations in _get_face_recognition().batch_face_locations(
+        images,
+        number_of_times_to_upsample=upsample,
+        batch_size=batch_size,
+    )]
+
+
+def face_encodings_job(image: np.ndarray, locations: list, num_jitters: int, model: str) -> list[np.ndarray]:
+    return [np.asarray(encoding) for encoding in _get_face_recognition().face_encodings(
+        image,
+        locations,
+        num_jitters=num_jitters,
+        model=model,
+    )]
+
+
+# ----------------------------------------------------------------------
+# Server-side pool
+# ----------------------------------------------------------------------
+class FaceWorkerPool:
+    """Dedicated process pool for dlib detection / encoding.
+
+    Keeps multi-second face work off the HTTP worker threads and out of
+    their GIL: the request thread submits a job and waits for it with
+    ``timeout`` seconds. ``processes=0`` runs every job inline in the
+    calling thread (previous behaviour).
+
+    Workers are started with ``start_method`` (``spawn`` by default, also on
+    Linux): forking the threaded server would copy locks held by the gallery,
+    caches or logging into the child. The server calls ``start`` before its
+    threads start; otherwise the pool starts on the first job. It is
+    recreated if a worker process dies.
+
+    A spawned worker re-imports the parent's main module, so the server is
+    launched through run_server.py, which imports the application only
+    under its ``__main__`` guard.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        *,
+        timeout: float | None = None,
+        detector_model: str = 'hog',
+        encoding_model: str = 'large',
+        start_method: str = 'spawn',
+        logger=None,
+    ) -> None:
+        self.processes = max(0, int(processes))
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self.detector_model = detector_model
+        self.encoding_model = encoding_model
+        self.start_method = start_method
+        self.logger = logger
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.processes > 0
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=init_worker,
+                    initargs=(self.detector_model, self.encoding_model),
+                )
+                if self.logger:
+                    self.logger.info(
+                        'Face worker pool started: processes=%s, start_method=%s',
+                        self.processes,
+                        self.start_method,
+                    )
+            return self._executor
+
+    def start(self) -> None:
+        """Start every worker process now (no-op in inline mode).
+
+        Processes are created by ``submit`` in the calling thread, so one
+        no-op job per worker launches them all from here; the jobs themselves
+        (and the model loading in ``init_worker``) complete in the background.
+        """
+        if not self.enabled:
+            return
+        executor = self._get_executor()
+        for _ in range(self.processes):
+            executor.submit(ready_job)
+
+    def _reset_executor(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """Schedule ``fn(*args)``; inline mode returns an already completed future."""
+        if not self.enabled:
+            future: Future = Future()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as exc:
+                future.set_exception(exc)
+            return future
+
+        executor = self._get_executor()
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            if self.logger:
+                self.logger.warning('Face worker pool is broken, restarting it')
+            self._reset_executor(executor)
+            return self._get_executor().submit(fn, *args)
+
+    def result(self, future: Future, timeout: float | None = None) -> Any:
+        try:
+            return future.result(timeout=timeout if timeout is not None else self.timeout)
+        except FutureTimeoutError as exc:
+            future.cancel()
+            raise FaceWorkerTimeout('Face processing timed out') from exc
+        except BrokenProcessPool:
+            executor = self._executor
+            if executor is not None:
+                self._reset_executor(executor)
+            raise
+
+    def run(self, fn: Callable[..., Any], *args: Any, timeout: float | None = None) -> Any:
+        return self.result(self.submit(fn, *args), timeout=timeout)
+
+    def run_first(
+        self,
+        jobs: Iterable[tuple[Callable[..., Any], tuple]],
+        accept: Callable[[int, Any], Any],
+        timeout: float | None = None,
+        max_in_flight: int | None = None,
+    ) -> tuple[int | None, Any]:
+        """Run independent ``(fn, args)`` jobs and return the first accepted outcome.
+
+        ``accept(index, result)`` turns a job result into the outcome; a falsy
+        value means "keep looking". Jobs are ranked by their position, so an
+        earlier job always wins over a later one regardless of which worker
+        finishes first.
+
+        ``jobs`` is consumed lazily in both modes: the next job is taken only
+        when it is about to run, so a generator can stop the run (for example
+        when a time budget is spent) by returning. In pool mode at most
+        ``max_in_flight`` jobs (default: one per worker process) are
+        submitted at once, which also keeps a long stage from queueing ahead
+        of other requests' jobs. Once a job is accepted no later job is
+        taken, later siblings that have not started yet are cancelled
+        (running ones finish in the background and are ignored), and only the
+        earlier jobs are still awaited. Returns ``(index, outcome)`` or
+        ``(None, None)``.
+        """
+        if not self.enabled:
+            for index, (fn, args) in enumerate(jobs):
+                outcome = accept(index, fn(*args))
+                if outcome:
+                    return index, outcome
+            return None, None
+
+        jobs = iter(jobs)
+        limit = max(1, int(max_in_flight or self.processes))
+        wait_timeout = timeout if timeout is not None else self.timeout
+        deadline = time.monotonic() + wait_timeout if wait_timeout else None
+        positions: dict[Future, int] = {}
+        pending: set[Future] = set()
+        exhausted = False
+
+        def fill() -> None:
+            nonlocal exhausted
+            while not exhausted and len(pending) < limit:
+                try:
+                    fn, args = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    return
+                future = self.submit(fn, *args)
+                positions[future] = len(positions)
+                pending.add(future)
+
+        best_index, best = None, None
+        try:
+            fill()
+            while pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise FutureTimeoutError()
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                if not done:
+                    raise FutureTimeoutError()
+                for future in sorted(done, key=positions.__getitem__):
+                    if future not in pending:
+                        continue
+                    pending.discard(future)
+                    index = positions[future]
+                    outcome = accept(index, self.result(future, timeout=0))
+                    if outcome and (best_index is None or index < best_index):
+                        best_index, best = index, outcome
+                        for later in [item for item in pending if positions[item] > index]:
+                            later.cancel()
+                            pending.discard(later)
+                if best_index is None:
+                    fill()
+        except FutureTimeoutError as exc:
+            if best_index is None:
+                raise FaceWorkerTimeout('Face processing timed out') from exc
+        finally:
+            for future in pending:
+                future.cancel()
+        return best_index, best
+
+    def face_locations(self, image: np.ndarray, model: str, upsample: int) -> list[tuple[int, int, int, int]]:
+        return self.run(face_locations_job, image, model, upsample)
+
+    def batch_face_locations(self, images: list[np.ndarray], upsample: int, batch_size: int) -> list[list[tuple]]:
+        return self.run(batch_face_locations_job, images, upsample, batch_size)
+
+    def face_encodings(self, image: np.ndarray, locations: list, num_jitters: int, model: str) -> list[np.ndarray]:
+        return self.run(face_encodings_job, image, locations, num_jitters, model)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'processes': self.processes,
+            'started': self.started,
+            'start_method': self.start_method,
+            'timeout_sec': self.timeout,
+        }
@@ -1,4 +1,4 @@
 @echo off
 cd /d "%~dp0"
 call .venv\Scripts\activate.bat
-python telegram_service.py
+python run_server.py
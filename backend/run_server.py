@@ -0,0 +1,21 @@
+"""Entry point of the API server.
+
+Face worker processes are spawned, and a spawned process re-imports the
+parent's main module as ``__mp_main__``. telegram_service builds the Flask
+app, the SQL API, caches and the face gallery at import time, so it must not
+be that module: this one imports it only under the ``__main__`` guard and
+gives the workers nothing to run.
+"""
+from __future__ import annotations
+
+import importlib
+
+SERVER_MODULE = 'telegram_service'
+
+
+def main(module_name: str = SERVER_MODULE) -> None:
+    importlib.import_module(module_name).main()
+
+
+if __name__ == '__main__':
+    main()
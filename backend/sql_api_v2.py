@@ -6,6 +6,7 @@ import json
 import os
 import secrets
 import urllib.parse
+from collections.abc import Mapping
 from pathlib import Path
 from typing import Any
 
@@ -440,7 +441,7 @@ def register_sql_api_v2(
     *,
     base_dir: Path,
     logger=None,
-    face_encodings_db: dict | None = None,
+    face_encodings_db: Mapping | None = None,
     save_encodings_fn=None,
     reference_photos_dir: str | None = None,
 ) -> None:
@@ -1092,8 +1093,12 @@ def register_sql_api_v2(
             ts = sys.modules.get('telegram_service') or sys.modules.get('__main__')
             face_db = getattr(ts, 'face_encodings_db', None) if ts else None
             ref_dir = getattr(ts, 'REFERENCE_PHOTOS_DIR', None) if ts else None
+            chip_store = getattr(ts, 'face_chip_store', None) if ts else None
+            if callable(getattr(face_db, 'snapshot', None)):
+                # One consistent view while listing, even with concurrent deletes.
+                face_db = face_db.snapshot()
 
-            if face_db and isinstance(face_db, dict):
+            if face_db and isinstance(face_db, Mapping):
                 encodings = []
                 for idx, (member_id, info) in enumerate(face_db.items()):
                     ref_photo_path = None
@@ -1101,6 +1106,10 @@ def register_sql_api_v2(
                         candidate = os.path.join(ref_dir, f"{member_id}.jpg")
                         if os.path.exists(candidate):
                             ref_photo_path = candidate
+                    # Small face crop saved at registration: cheap thumbnail for the admin list.
+                    ref_chip_path = None
+                    if chip_store is not None and chip_store.has(str(member_id)):
+                        ref_chip_path = str(chip_store.chip_path(str(member_id)))
                     encodings.append({
                         'id': idx + 1,
                         'personId': 0,
@@ -1109,6 +1118,7 @@ def register_sql_api_v2(
                         'modelVersion': 'face-recognition',
                         'isActive': True,
                         'referencePhotoPath': ref_photo_path,
+                        'referenceChipPath': ref_chip_path,
                         'createdAt': None,
                     })
                 return _json_response({
@@ -1135,20 +1145,38 @@ def register_sql_api_v2(
             face_db = getattr(ts, 'face_encodings_db', None) if ts else None
             ref_dir = getattr(ts, 'REFERENCE_PHOTOS_DIR', None) if ts else None
             save_fn = getattr(ts, 'save_encodings', None) if ts else None
+            # Journaled delete (one appended record) when telegram_service provides it.
+            delete_fn = getattr(ts, 'delete_face_encodings', None) if ts else None
             if face_db is None:
                 face_db = face_encodings_db
                 ref_dir = ref_dir or reference_photos_dir
                 save_fn = save_fn or save_encodings_fn
-            if face_db is not None and isinstance(face_db, dict):
-                member_ids = list(face_db.keys())
-                idx = face_id - 1
-                if 0 <= idx < len(member_ids):
-                    member_id = member_ids[idx]
-                    del face_db[member_id]
+            if face_db is not None and isinstance(face_db, Mapping):
+                # List positions are not stable: the gallery fills a removed row with its
+                # last one. Clients send the member id shown in the list and it decides
+                # what is deleted; the position is only a fallback for older clients.
+                member_id = str(request.args.get('member_id') or '').strip() or None
+                if member_id is not None:
+                    if member_id not in face_db:
+                        member_id = None
+                else:
+                    member_ids = list(face_db.keys())
+                    idx = face_id - 1
+                    if 0 <= idx < len(member_ids):
+                        member_id = member_ids[idx]
+                if member_id is not None:
+                    if callable(delete_fn):
+                        delete_fn([member_id])
+                        save_fn = None
+                    else:
+                        del face_db[member_id]
                     if ref_dir:
                         photo_path = os.path.join(ref_dir, f"{member_id}.jpg")
                         if os.path.exists(photo_path):
                             os.remove(photo_path)
+                    chip_store = getattr(ts, 'face_chip_store', None) if ts else None
+                    if chip_store is not None:
+                        chip_store.delete([str(member_id)])
                     if callable(save_fn):
                         try:
                             save_fn()
@@ -1164,3 +1192,120 @@ def register_sql_api_v2(
             if logger:
                 logger.exception('admin face delete failed')
             return _json_response({'success': False, 'error': str(error_obj)}, 500)
+
+    @app.get('/api/v2/admin/face-cascade/stats')
+    @app.get('/v2/admin/face-cascade/stats')
+    def admin_face_cascade_stats():
+        _, error_response = _require_admin()
+        if error_response is not None:
+            return error_response
+        import sys
+        ts = sys.modules.get('telegram_service') or sys.modules.get('__main__')
+        cascade_stats = getattr(ts, 'face_cascade_stats', None) if ts else None
+        if cascade_stats is None:
+            return _json_response({'success': False, 'error': 'Face cascade is not available'}, 503)
+        return _json_response({'success': True, **cascade_stats.snapshot()})
+
+    @app.delete('/api/v2/admin/face-cascade/stats')
+    @app.delete('/v2/admin/face-cascade/stats')
+    def admin_face_cascade_stats_reset():
+        _, error_response = _require_admin()
+        if error_response is not None:
+            return error_response
+        import sys
+        ts = sys.modules.get('telegram_service') or sys.modules.get('__main__')
+        cascade_stats = getattr(ts, 'face_cascade_stats', None) if ts else None
+        if cascade_stats is None:
+            return _json_response({'success': False, 'error': 'Face cascade is not available'}, 503)
+        cascade_stats.reset()
+        return _json_response({'success': True})
+
+    def _face_gallery_reencoder():
+        import sys
+        ts = sys.modules.get('telegram_service') or sys.modules.get('__main__')
+        return getattr(ts, 'face_gallery_reencoder', None) if ts else None
+
+    @app.get('/api/v2/admin/face-gallery/reencode')
+    @app.get('/v2/admin/face-gallery/reencode')
+    def admin_face_gallery_reencode_status():
+        _, error_response = _require_admin()
+        if error_response is not None:
+            return error_response
+        reencoder = _face_gallery_reencoder()
+        if reencoder is None:
+            return _json_response({'success': False, 'error': 'Face gallery re-encode is not available'}, 503)
+        return _json_response({'success': True, **reencoder.status()})
+
+    @app.post('/api/v2/admin/face-gallery/reencode')
+    @app.post('/v2/admin/face-gallery/reencode')
+    def admin_face_gallery_reencode_start():
+        _, error_response = _require_admin()
+        if error_response is not None:
+            return error_response
+        reencoder = _face_gallery_reencoder()
+        if reencoder is None:
+            return _json_response({'success': False, 'error': 'Face gallery re-encode is not available'}, 503)
+        payload = request.get_json(silent=True) or {}
+        from face_reencode import ReencodeBusy
+
+        try:
+            status = reencoder.start(fresh=bool(payload.get('fresh', False)))
+        except ReencodeBusy as error_obj:
+            return _json_response({'success': False, 'error': str(error_obj), **reencoder.status()}, 409)
+        return _json_response({'success': True, **status}, 202)
+
+    @app.delete('/api/v2/admin/face-gallery/reencode')
+    @app.delete('/v2/admin/face-gallery/reencode')
+    def admin_face_gallery_reencode_cancel():
+        _, error_response = _require_admin()
+        if error_response is not None:
+            return error_response
+        reencoder = _face_gallery_reencoder()
+        if reencoder is None:
+            return _json_response({'success': False, 'error': 'Face gallery re-encode is not available'}, 503)
+        return _json_response({'success': reencoder.cancel(), **reencoder.status()})
+
+    def _face_backup_autotagger():
+        import sys
+        ts = sys.modules.get('telegram_service') or sys.modules.get('__main__')
+        return getattr(ts, 'face_backup_autotagger', None) if ts else None
+
+    @app.get('/api/v2/admin/face-autotag')
+    @app.get('/v2/admin/face-autotag')
+    def admin_face_autotag_status():
+        _, error_response = _require_admin()
+        if error_response is not None:
+            return error_response
+        tagger = _face_backup_autotagger()
+        if tagger is None:
+            return _json_response({'success': False, 'error': 'Backup face auto-tagging is not available'}, 503)
+        return _json_response({'success': True, **tagger.status()})
+
+    @app.post('/api/v2/admin/face-autotag')
+    @app.post('/v2/admin/face-autotag')
+    def admin_face_autotag_start():
+        _, error_response = _require_admin()
+        if error_response is not None:
+            return error_response
+        tagger = _face_backup_autotagger()
+        if tagger is None:
+            return _json_response({'success': False, 'error': 'Backup face auto-tagging is not available'}, 503)
+        payload = request.get_json(silent=True) or {}
+        from face_autotag import AutoTagBusy
+
+        try:
+            status = tagger.start(rematch=bool(payload.get('rematch', False)))
+        except AutoTagBusy as error_obj:
+            return _json_response({'success': False, 'error': str(error_obj), **tagger.status()}, 409)
+        return _json_response({'success': True, **status}, 202)
+
+    @app.delete('/api/v2/admin/face-autotag')
+    @app.delete('/v2/admin/face-autotag')
+    def admin_face_autotag_cancel():
+        _, error_response = _require_admin()
+        if error_response is not None:
+            return error_response
+        tagger = _face_backup_autotagger()
+        if tagger is None:
+            return _json_response({'success': False, 'error': 'Backup face auto-tagging is not available'}, 503)
+        return _json_response({'success': tagger.cancel(), **tagger.status()})
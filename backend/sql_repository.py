@@ -105,6 +105,33 @@ def _migration_003_auth_sessions_create(connection: sqlite3.Connection) -> None:
     )
 
 
+def _migration_004_photo_face_scans_create(connection: sqlite3.Connection) -> None:
+    """Create photo_face_scans, the per-asset progress of backup auto-tagging (idempotent).
+
+    One row per (tree, asset digest): the faces found in it (boxes and
+    encodings as JSON) under the detector settings ``fingerprint``, so an
+    unchanged asset is never detected twice and a restart resumes after the
+    last committed asset.
+    """
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS photo_face_scans (
+            id              INTEGER PRIMARY KEY AUTOINCREMENT,
+            tree_id         INTEGER NOT NULL REFERENCES family_trees(id) ON DELETE CASCADE,
+            asset_sha256    TEXT    NOT NULL,
+            photo_id        INTEGER REFERENCES photos(id) ON DELETE SET NULL,
+            fingerprint     TEXT    NOT NULL,
+            status          TEXT    NOT NULL,
+            faces_count     INTEGER NOT NULL DEFAULT 0,
+            faces_json      TEXT,
+            error           TEXT,
+            scanned_at      TEXT    NOT NULL,
+            UNIQUE (tree_id, asset_sha256)
+        )
+        """
+    )
+
+
 def run_migrations(db_path: Path) -> None:
     """Run additive, idempotent schema migrations for multi-device sync safety.
 
@@ -112,6 +139,7 @@ def run_migrations(db_path: Path) -> None:
       001_backup_snapshots_last_change_ids
       002_users_single_session_enabled
       003_auth_sessions_create
+      004_photo_face_scans_create
 
     Safe to invoke repeatedly: every step uses IF NOT EXISTS or PRAGMA-based
     guards so a fresh DB and an existing DB converge to the same target schema.
@@ -122,6 +150,7 @@ def run_migrations(db_path: Path) -> None:
         _migration_001_backup_snapshots_last_change_ids(connection)
         _migration_002_users_single_session_enabled(connection)
         _migration_003_auth_sessions_create(connection)
+        _migration_004_photo_face_scans_create(connection)
         connection.commit()
     except Exception:
         connection.rollback()
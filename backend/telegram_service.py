@@ -4,6 +4,15 @@ Combined Server для приложения Семейное Древо
 БЕЗ ПОТЕРИ ФУНКЦИОНАЛЬНОСТИ
 """
 
+if __name__ == '__main__':
+    # `python telegram_service.py` запускает сервер через run_server.py: процессы
+    # face_workers (spawn) импортируют главный модуль заново, и им должен достаться
+    # пустой run_server, а не этот файл со всей инициализацией приложения
+    import runpy
+
+    runpy.run_module('run_server', run_name='__main__', alter_sys=True)
+    raise SystemExit(0)
+
 from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 import numpy as np
@@ -15,8 +24,10 @@ import json
 import logging
 from datetime import datetime
 import time
+import threading
 import pickle
 import hashlib
+import math
 import re
 import tempfile
 import zipfile
@@ -24,6 +35,7 @@ from pathlib import Path
 import urllib.parse
 import urllib.request
 import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 
 # Google Drive imports
 try:
@@ -53,6 +65,18 @@ from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
+from face_admission import AdmissionLimiter
+from face_ann import IVFIndex
+from face_autotag import BackupAutoTagger
+from face_gallery import FaceGallery, FaceGalleryStore
+from face_quant import PRECISIONS, evaluate_precision
+from face_jobs import FaceJobQueue, FaceJobQueueFull
+from face_reencode import GalleryReencoder
+from face_cache import FaceDiskCache, FaceResultCache, SingleFlight, content_digest, settings_fingerprint
+from face_cascade import CascadeStats
+from face_chips import FaceChipStore
+from face_workers import FaceWorkerPool, FaceWorkerTimeout, timed_face_locations_job
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -205,7 +229,7 @@ CORS_ORIGINS = list(dict.fromkeys(_DEFAULT_CORS_ORIGINS + env_csv('CORS_ORIGINS'
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH_BYTES
-CORS(app, resources={r'/*': {'origins': CORS_ORIGINS}})
+CORS(app, resources={r'/*': {'origins': CORS_ORIGINS}}, expose_headers=['Retry-After', 'Location'])
 
 try:
     from sql_api_v2 import register_sql_api_v2
@@ -233,6 +257,45 @@ def make_response_json(data, status=200):
     )
 
 
+def face_worker_timeout_response():
+    return make_response_json({
+        'success': False,
+        'error': 'Обработка фото заняла слишком много времени, попробуйте позже'
+    }, 504)
+
+
+def resolve_detection_budget_ms(data):
+    """Бюджет детекции запроса: поле budget_ms, заголовок X-Face-Budget-Ms или значение по умолчанию"""
+    raw_budget = data.get('budget_ms') if isinstance(data, dict) else None
+    if raw_budget is None or raw_budget == '':
+        raw_budget = request.headers.get('X-Face-Budget-Ms', '').strip()
+    if raw_budget is None or raw_budget == '':
+        return FACE_DETECTION_BUDGET_MS or None
+    budget_ms = float(raw_budget)
+    if budget_ms != budget_ms or budget_ms < 0:
+        raise ValueError(f'invalid budget_ms: {raw_budget!r}')
+    return budget_ms or None
+
+
+def invalid_budget_response():
+    return make_response_json({
+        'success': False,
+        'error': 'Некорректный budget_ms'
+    }, 400)
+
+
+def face_overloaded_response(rejected):
+    """429 с Retry-After: все слоты обработки лиц заняты и очередь полна (или ожидание истекло)"""
+    response = make_response_json({
+        'success': False,
+        'error': 'Сервер занят обработкой других фото, повторите через несколько секунд',
+        'reason': rejected.reason,
+        'retry_after': rejected.retry_after
+    }, 429)
+    response.headers['Retry-After'] = str(rejected.retry_after)
+    return response
+
+
 def face_recognition_unavailable_response():
     return make_response_json({
         'success': False,
@@ -275,14 +338,49 @@ def after_request(response):
 # FACE RECOGNITION - Конфигурация
 # ========================================
 REFERENCE_PHOTOS_DIR = str(BASE_DIR / 'reference_photos')
+# Лицо эталона, вырезанное при регистрации (PNG без потерь, квадрат до FACE_CHIP_SIZE px
+# вокруг найденной рамки) + рамка в JSON: перекодирование не запускает детекцию по
+# полному фото. Лицо в чипе не меньше 150 px — размера выравнивания dlib.
+REFERENCE_CHIPS_DIR = str(BASE_DIR / 'reference_chips')
+FACE_CHIP_SIZE = max(300, env_int('FACE_CHIP_SIZE', 320))
 UPLOADED_PHOTOS_DIR = str(BASE_DIR / 'uploaded_photos')
+# Устаревший JSON-формат: читается только для однократной миграции в FACE_GALLERY_DIR
 ENCODINGS_FILE = str(BASE_DIR / 'face_encodings.json')
+FACE_GALLERY_DIR = resolve_backend_path(os.environ.get('FACE_GALLERY_DIR', 'face_gallery'))
+# Размер журнала изменений, после которого он сворачивается в новый снимок (в фоне)
+FACE_JOURNAL_COMPACT_MB = max(1, env_int('FACE_JOURNAL_COMPACT_MB', 8))
+# Перекодирование галереи по reference_photos после смены модели/jitters:
+# промежуточные результаты (для продолжения после остановки) лежат в FACE_REENCODE_DIR
+FACE_REENCODE_DIR = resolve_backend_path(env_str('FACE_REENCODE_DIR', 'face_gallery_reencode'))
+# Приближенный поиск (IVF) для распознавания без device_id по большой галерее:
+# лица сравниваются только с FACE_ANN_NPROBE ближайшими кластерами k-means, затем
+# точная пересортировка. Больше nprobe — выше полнота, дольше поиск. Индекс
+# строится в фоне, когда в галерее FACE_ANN_MIN_FACES лиц, и переобучается при росте
+# в FACE_ANN_RETRAIN_GROWTH раз. FACE_ANN_NLIST=0 — около 4*sqrt(N) кластеров.
+FACE_ANN_ENABLED = env_bool('FACE_ANN_ENABLED', False)
+FACE_ANN_NLIST = max(0, env_int('FACE_ANN_NLIST', 0))
+FACE_ANN_NPROBE = max(1, env_int('FACE_ANN_NPROBE', 8))
+FACE_ANN_MIN_FACES = max(1, env_int('FACE_ANN_MIN_FACES', 5000))
+FACE_ANN_RETRAIN_GROWTH = max(1.0, float(env_str('FACE_ANN_RETRAIN_GROWTH', '2')))
+# Формат кодировок галереи в памяти: float32 (512 байт на лицо), float16 (256) или
+# int8 с масштабом на строку (132; рекомендуется — float16 в numpy заметно медленнее
+# при поиске). Снимок на диске остается float32. При загрузке
+# поиск по сохраненному снимку сравнивается с float32; если доля запросов с другим
+# результатом распознавания больше FACE_GALLERY_PRECISION_MAX_DISAGREEMENT, галерея
+# остается в float32. После перехода снимок хранит уже округленные значения —
+# вернуть полную точность можно перекодированием галереи.
+FACE_GALLERY_PRECISION = env_str('FACE_GALLERY_PRECISION', 'float32').strip().lower()
+if FACE_GALLERY_PRECISION not in PRECISIONS:
+    logger.warning("FACE_GALLERY_PRECISION=%s не поддерживается, используется float32", FACE_GALLERY_PRECISION)
+    FACE_GALLERY_PRECISION = 'float32'
+FACE_GALLERY_PRECISION_MAX_DISAGREEMENT = max(
+    0.0, float(env_str('FACE_GALLERY_PRECISION_MAX_DISAGREEMENT', '0.005'))
+)
 
 os.makedirs(REFERENCE_PHOTOS_DIR, exist_ok=True)
+os.makedirs(REFERENCE_CHIPS_DIR, exist_ok=True)
 os.makedirs(UPLOADED_PHOTOS_DIR, exist_ok=True)
 
-face_encodings_db = {}
-
 # ========================================
 # CUDA / GPU Настройки
 # ========================================
@@ -359,15 +457,151 @@ MATCH_MARGIN = float(env_str('FACE_MATCH_MARGIN', '0.05'))
 
 # Дополнительные оптимизации для GPU
 BATCH_SIZE = 128  # Размер батча для обработки (больше = быстрее на GPU)
+# Пакетное распознавание: максимум фото в одном запросе и потоков декодирования
+FACE_BATCH_MAX_IMAGES = max(1, env_int('FACE_BATCH_MAX_IMAGES', 64))
+FACE_BATCH_DECODE_WORKERS = max(1, env_int('FACE_BATCH_DECODE_WORKERS', min(8, os.cpu_count() or 1)))
 MAX_IMAGE_SIZE = max(400, env_int('MAX_IMAGE_SIZE', 1920))
 DECODE_MAX_IMAGE_SIZE = max(MAX_IMAGE_SIZE, env_int('DECODE_MAX_IMAGE_SIZE', 2560))
+# JPEG декодируется сразу в уменьшенном масштабе (draft: DCT-масштаб 1/2..1/8), но не
+# меньше DECODE_MAX_IMAGE_SIZE: этот кадр нужен стадиям fullres каскада и сохраняется
+# как эталонное фото. Если после декодирования сторона не больше
+# MAX_IMAGE_SIZE * DECODE_MERGE_RATIO, кадр сразу приводится к рабочему размеру детекции —
+# один ресайз вместо двух, но для таких фото стадии fullres больше не выполняются
+# (кадр уже не уменьшался). По умолчанию 1.0 — не объединять.
+FACE_DECODE_DRAFT = env_bool('FACE_DECODE_DRAFT', True)
+DECODE_MERGE_RATIO = max(1.0, float(env_str('DECODE_MERGE_RATIO', '1.0')))
+# Уменьшение кадров для детекции: reduce() по целому коэффициенту + bilinear.
+DOWNSCALE_RESAMPLE = Image.BILINEAR
+DOWNSCALE_REDUCING_GAP = 2.0
 DETECTION_UPSCALE_FACTORS = (1.6, 2.0, 2.6)
 CROP_UPSCALE_FACTORS = (1.4, 1.8, 2.2)
 EXTRA_UPSAMPLE_MAX_PIXELS = max(300000, env_int('EXTRA_UPSAMPLE_MAX_PIXELS', 1400000))
 
-# Кэш для ускорения повторных запросов
-face_detection_cache = {}
-CACHE_MAX_SIZE = 100
+# Отдельный пул процессов для dlib (детекция и кодирование лиц), чтобы тяжелые
+# запросы не занимали потоки waitress и не конкурировали за GIL с auth/backup.
+# 0 — выполнять в потоке запроса. На GPU по умолчанию один процесс (одна копия CNN в памяти).
+_DEFAULT_FACE_WORKER_PROCESSES = 1 if CUDA_ENABLED else min(4, max(1, (os.cpu_count() or 2) // 2))
+FACE_WORKER_PROCESSES = max(0, env_int('FACE_WORKER_PROCESSES', _DEFAULT_FACE_WORKER_PROCESSES))
+FACE_WORKER_TIMEOUT_SEC = max(0, env_int('FACE_WORKER_TIMEOUT_SEC', 120))
+
+# Асинхронная регистрация (поле async=1 или заголовок Prefer: respond-async): детекция
+# выполняется в запросе, кодирование с REGISTER_JITTERS — в фоновой очереди, клиент
+# получает 202 и job_id. Задача хранит сжатый файл (не декодированный кадр) и занимает
+# слот face_admission, как и синхронные запросы. Не больше FACE_REGISTER_JOB_MAX_PENDING
+# незавершенных задач; результат хранится FACE_REGISTER_JOB_KEEP_SEC секунд (в памяти,
+# до перезапуска).
+FACE_REGISTER_JOB_WORKERS = max(1, env_int('FACE_REGISTER_JOB_WORKERS', max(1, FACE_WORKER_PROCESSES)))
+FACE_REGISTER_JOB_MAX_PENDING = max(1, env_int('FACE_REGISTER_JOB_MAX_PENDING', 64))
+FACE_REGISTER_JOB_KEEP_SEC = max(60, env_int('FACE_REGISTER_JOB_KEEP_SEC', 3600))
+# Параллельно перекодируемых эталонных фото при перекодировании галереи
+FACE_REENCODE_WORKERS = max(1, env_int('FACE_REENCODE_WORKERS', max(1, FACE_WORKER_PROCESSES)))
+# Автоматические подсказки отметок на фото из сохраненных бэкапов (админ API или
+# python face_autotag.py): параллельно FACE_AUTOTAG_WORKERS фото, работа уступает
+# запросам к лицам. FACE_AUTOTAG_INTERVAL_MIN > 0 — запуск по расписанию (0 — только вручную).
+FACE_AUTOTAG_WORKERS = max(1, env_int('FACE_AUTOTAG_WORKERS', 1))
+FACE_AUTOTAG_INTERVAL_MIN = max(0, env_int('FACE_AUTOTAG_INTERVAL_MIN', 0))
+
+# Потоки waitress и ограничение одновременных тяжелых запросов к лицам (register_face,
+# recognize_face, recognize_faces_batch): не больше FACE_ADMISSION_LIMIT в работе и
+# FACE_ADMISSION_QUEUE в очереди, ожидание до FACE_ADMISSION_WAIT_SEC. Остальные сразу
+# получают 429 с Retry-After. Ожидающий запрос тоже занимает поток waitress, поэтому
+# LIMIT + QUEUE должно быть меньше API_THREADS, чтобы auth/backup не вставали в очередь.
+API_THREADS = max(2, env_int('API_THREADS', 8))
+FACE_ADMISSION_LIMIT = max(1, env_int('FACE_ADMISSION_LIMIT', max(1, FACE_WORKER_PROCESSES)))
+FACE_ADMISSION_QUEUE = max(0, env_int('FACE_ADMISSION_QUEUE', 2))
+FACE_ADMISSION_WAIT_SEC = max(0, env_int('FACE_ADMISSION_WAIT_SEC', 15))
+
+# Бюджет времени на fallback-этапы детекции (мс) для register_face/recognize_face.
+# Переопределяется полем budget_ms или заголовком X-Face-Budget-Ms. 0 — без ограничения.
+FACE_DETECTION_BUDGET_MS = max(0, env_int('FACE_DETECTION_BUDGET_MS', 0))
+
+# Статистика каскада детекции (попытки, находки, время) сохраняется между перезапусками.
+# FACE_CASCADE_ADAPTIVE=1 — порядок fallback-этапов и попыток по ожидаемой находке за мс;
+# этап пропускается, если после FACE_CASCADE_MIN_SAMPLES запусков доля находок ниже
+# FACE_CASCADE_MIN_HIT_RATE (0 — никогда не пропускать).
+FACE_CASCADE_STATS_FILE = resolve_backend_path(env_str('FACE_CASCADE_STATS_FILE', 'face_cascade_stats.json'))
+FACE_CASCADE_ADAPTIVE = env_bool('FACE_CASCADE_ADAPTIVE', False)
+FACE_CASCADE_MIN_SAMPLES = max(1, env_int('FACE_CASCADE_MIN_SAMPLES', 50))
+FACE_CASCADE_MIN_HIT_RATE = max(0.0, float(env_str('FACE_CASCADE_MIN_HIT_RATE', '0')))
+
+# Кэш результатов детекции и кодирования по дайджесту загруженного файла:
+# повторное распознавание того же фото не запускает dlib. 0 МБ — кэш выключен.
+FACE_CACHE_MAX_MB = max(0, env_int('FACE_CACHE_MAX_MB', 64))
+FACE_CACHE_TTL_SEC = max(0, env_int('FACE_CACHE_TTL_SEC', 3600))
+# Второй уровень кэша на диске (SQLite рядом с familyone.db) переживает перезапуск.
+# Сбрасывается автоматически при смене настроек детекции/кодирования. 0 МБ — выключен.
+FACE_DISK_CACHE_DB = resolve_backend_path(env_str('FACE_DISK_CACHE_DB', 'face_cache.db'))
+FACE_DISK_CACHE_MAX_MB = max(0, env_int('FACE_DISK_CACHE_MAX_MB', 256))
+FACE_CACHE_SETTINGS = {
+    'face_model': FACE_MODEL,
+    'upsample': NUMBER_OF_TIMES_TO_UPSAMPLE,
+    'fallback_upsample': FALLBACK_UPSAMPLE,
+    'max_image_size': MAX_IMAGE_SIZE,
+    'decode_max_image_size': DECODE_MAX_IMAGE_SIZE,
+    'decode_draft': FACE_DECODE_DRAFT,
+    'decode_merge_ratio': DECODE_MERGE_RATIO,
+    'detection_upscale': DETECTION_UPSCALE_FACTORS,
+    'crop_upscale': CROP_UPSCALE_FACTORS,
+    'extra_upsample_max_pixels': EXTRA_UPSAMPLE_MAX_PIXELS,
+    'encoding_model': ENCODING_MODEL,
+    'num_jitters': NUM_JITTERS,
+    'register_jitters': REGISTER_JITTERS,
+}
+face_result_cache = FaceResultCache(
+    FACE_CACHE_MAX_MB * 1024 * 1024,
+    ttl_sec=FACE_CACHE_TTL_SEC,
+    backing=FaceDiskCache(
+        FACE_DISK_CACHE_DB,
+        FACE_DISK_CACHE_MAX_MB * 1024 * 1024,
+        settings_fingerprint(FACE_CACHE_SETTINGS),
+        logger=logger,
+    ),
+)
+
+# Одновременные запросы с тем же файлом (повторы клиента через туннель, веб и
+# мобильное приложение) ждут одну детекцию вместо того, чтобы запускать свою.
+face_single_flight = SingleFlight()
+
+face_worker_pool = FaceWorkerPool(
+    FACE_WORKER_PROCESSES if FACE_RECOGNITION_AVAILABLE else 0,
+    timeout=FACE_WORKER_TIMEOUT_SEC,
+    detector_model=FACE_MODEL,
+    encoding_model=ENCODING_MODEL,
+    logger=logger,
+)
+
+face_admission = AdmissionLimiter(
+    FACE_ADMISSION_LIMIT,
+    max_queue=FACE_ADMISSION_QUEUE,
+    max_wait_sec=FACE_ADMISSION_WAIT_SEC,
+)
+if FACE_ADMISSION_LIMIT + FACE_ADMISSION_QUEUE >= API_THREADS:
+    logger.warning(
+        "FACE_ADMISSION_LIMIT + FACE_ADMISSION_QUEUE = %s >= API_THREADS = %s: "
+        "запросы к лицам могут занять все потоки сервера",
+        FACE_ADMISSION_LIMIT + FACE_ADMISSION_QUEUE,
+        API_THREADS,
+    )
+
+face_chip_store = FaceChipStore(REFERENCE_CHIPS_DIR, size=FACE_CHIP_SIZE)
+
+face_register_jobs = FaceJobQueue(
+    FACE_REGISTER_JOB_WORKERS,
+    max_pending=FACE_REGISTER_JOB_MAX_PENDING,
+    keep_sec=FACE_REGISTER_JOB_KEEP_SEC,
+    name='face-register',
+    admission=face_admission,
+    logger=logger,
+)
+
+face_cascade_stats = CascadeStats(
+    FACE_CASCADE_STATS_FILE,
+    adaptive=FACE_CASCADE_ADAPTIVE,
+    min_samples=FACE_CASCADE_MIN_SAMPLES,
+    min_hit_rate=FACE_CASCADE_MIN_HIT_RATE,
+    logger=logger,
+)
+face_cascade_stats.load()
 
 logger.info(f"Face Recognition настроен: model={FACE_MODEL}, CUDA={'включен' if CUDA_ENABLED else 'выключен'}")
 logger.info(
@@ -1043,50 +1277,95 @@ FACE_DUPLICATE_NAME_DISTANCE = 0.42
 LEGACY_MEMBER_ID_MOD = 1_000_000
 STABLE_SERVER_MEMBER_ID_PATTERN = re.compile(r'^fo1_(\d+)_([0-9a-f]{16})$', re.IGNORECASE)
 
+def load_legacy_json_encodings():
+    """Чтение устаревшего face_encodings.json в галерею"""
+    with open(ENCODINGS_FILE, 'r') as f:
+        data = json.load(f)
+    # Одна публикация снимка на весь файл, а не на каждое лицо
+    with face_encodings_db.batch():
+        face_encodings_db.clear()
+        for member_id, info in data.items():
+            if not isinstance(info, dict):
+                continue
+            raw_encoding = info.get('encoding')
+            if raw_encoding is None:
+                continue
+            try:
+                face_encodings_db.upsert(
+                    str(member_id),
+                    str(info.get('name', '')).strip(),
+                    raw_encoding,
+                    str(info.get('image_hash', '')).strip()
+                )
+            except Exception:
+                continue
+
+
+def choose_gallery_precision():
+    """
+    Формат хранения галереи (FACE_GALLERY_PRECISION) с проверкой точности на
+    сохраненном снимке. Возвращает отчет оценки или None, если проверять нечего.
+    """
+    precision = FACE_GALLERY_PRECISION
+    if precision == 'float32':
+        return None
+    reference = face_gallery_store.read_matrix()
+    report = None
+    if reference is not None:
+        report = evaluate_precision(
+            reference,
+            precision,
+            threshold=DEFAULT_MATCH_THRESHOLD,
+            margin=MATCH_MARGIN,
+        )
+        if report['decision_disagreement'] > FACE_GALLERY_PRECISION_MAX_DISAGREEMENT:
+            logger.warning(
+                "Галерея остается в float32: с %s расходится %.2f%% результатов распознавания (допустимо %.2f%%)",
+                precision,
+                100 * report['decision_disagreement'],
+                100 * FACE_GALLERY_PRECISION_MAX_DISAGREEMENT,
+            )
+            precision = 'float32'
+        else:
+            logger.info(
+                "Галерея в %s: %s байт на лицо вместо %s, ошибка дистанции до %.4f",
+                precision,
+                report['bytes_per_face'],
+                report['float32_bytes_per_face'],
+                report['distance_error_max'],
+            )
+    face_encodings_db.set_precision(precision)
+    return report
+
+
 def load_encodings():
     """Загрузка сохраненных кодировок лиц"""
-    global face_encodings_db
-    if os.path.exists(ENCODINGS_FILE):
-        try:
-            with open(ENCODINGS_FILE, 'r') as f:
-                data = json.load(f)
-                parsed = {}
-                for member_id, info in data.items():
-                    if not isinstance(info, dict):
-                        continue
-                    raw_encoding = info.get('encoding')
-                    if raw_encoding is None:
-                        continue
-                    try:
-                        parsed[str(member_id)] = {
-                            'name': str(info.get('name', '')).strip(),
-                            'encoding': np.array(raw_encoding),
-                            'image_hash': str(info.get('image_hash', '')).strip()
-                        }
-                    except Exception:
-                        continue
-                face_encodings_db = parsed
-            logger.info(f"Загружено {len(face_encodings_db)} кодировок лиц")
-        except Exception as e:
-            logger.error(f"Ошибка загрузки кодировок: {e}")
-            face_encodings_db = {}
+    global face_precision_report
+    try:
+        face_precision_report = choose_gallery_precision()
+        if face_gallery_store.exists():
+            # Матрица отображается в память (mmap), без разбора и копирования векторов
+            meta = face_gallery_store.load_into(face_encodings_db)
+            if meta.get('replayed'):
+                logger.info(f"Из журнала применено {meta['replayed']} изменений галереи")
+        elif os.path.exists(ENCODINGS_FILE):
+            load_legacy_json_encodings()
+            face_gallery_store.save(face_encodings_db)
+            os.replace(ENCODINGS_FILE, ENCODINGS_FILE + '.migrated')
+            logger.info(f"face_encodings.json перенесен в бинарное хранилище {FACE_GALLERY_DIR}")
+        else:
+            return
+        migrate_legacy_image_hashes()
+        logger.info(f"Загружено {len(face_encodings_db)} кодировок лиц")
+    except Exception as e:
+        logger.error(f"Ошибка загрузки кодировок: {e}")
+        face_encodings_db.clear()
 
 
 def save_encodings():
-    """Сохранение кодировок лиц"""
+    """Полный снимок кодировок лиц (атомарная запись, журнал сворачивается)"""
     try:
-        data = {}
-        for member_id, info in face_encodings_db.items():
-            encoding = info.get('encoding')
-            if encoding is None:
-                continue
-            data[str(member_id)] = {
-                'name': str(info.get('name', '')).strip(),
-                'encoding': encoding.tolist(),
-                'image_hash': str(info.get('image_hash', '')).strip()
-            }
-        with open(ENCODINGS_FILE, 'w') as f:
-            json.dump(data, f)
+        face_gallery_store.save(face_encodings_db)
         logger.info("Кодировки сохранены")
     except Exception as e:
         logger.error(f"Ошибка сохранения кодировок: {e}")
@@ -1096,11 +1375,31 @@ def normalize_member_name(name):
     return ' '.join(str(name or '').strip().lower().split())
 
 
-def get_face_image_sha256(image_array):
-    try:
-        return hashlib.sha256(image_array.tobytes()).hexdigest()
-    except Exception:
-        return ''
+# image_hash эталона — дайджест загруженного (сжатого) файла, тот же, что ключ кэша
+# детекции. Старые записи хранят sha256 декодированных пикселей: исходных файлов нет,
+# пересчитать их нельзя, поэтому при загрузке они помечаются префиксом и больше
+# не совпадают с дайджестами новых загрузок (дубликат ловится по имени и кодировке).
+UPLOAD_IMAGE_HASH_PREFIX = 'blake2b:'
+LEGACY_IMAGE_HASH_PREFIX = 'px-sha256:'
+
+
+def upload_image_hash(image_digest):
+    return f'{UPLOAD_IMAGE_HASH_PREFIX}{image_digest}' if image_digest else ''
+
+
+def migrate_legacy_image_hashes():
+    """Пометка image_hash старого формата (без префикса схемы) в галерее"""
+    def tag_legacy(image_hash):
+        if not image_hash or ':' in image_hash:
+            return image_hash
+        return f'{LEGACY_IMAGE_HASH_PREFIX}{image_hash}'
+
+    with face_gallery_store.lock:
+        changed = face_encodings_db.map_image_hashes(tag_legacy)
+    if changed:
+        face_gallery_store.save(face_encodings_db)
+        logger.info(f"image_hash старого формата помечен у {changed} записей галереи")
+    return changed
 
 
 def normalize_device_id(raw_device_id):
@@ -1134,66 +1433,163 @@ def get_device_id_from_member_id(raw_member_id):
     return ''
 
 
+# Галерея с разбиением по device_id: разбор member_id выполняется один раз
+# при добавлении лица, а не при каждом распознавании. Индексы по image_hash и
+# нормализованному имени нужны для поиска дубликатов при регистрации.
+face_encodings_db = FaceGallery(
+    partition_key=get_device_id_from_member_id,
+    name_key=normalize_member_name,
+    ann=IVFIndex(
+        nlist=FACE_ANN_NLIST,
+        nprobe=FACE_ANN_NPROBE,
+        min_train_size=FACE_ANN_MIN_FACES,
+        retrain_growth=FACE_ANN_RETRAIN_GROWTH,
+    ) if FACE_ANN_ENABLED else None,
+)
+face_gallery_store = FaceGalleryStore(
+    FACE_GALLERY_DIR,
+    compact_threshold_bytes=FACE_JOURNAL_COMPACT_MB * 1024 * 1024,
+    logger=logger,
+)
+# Отчет проверки точности при загрузке (choose_gallery_precision), для /health
+face_precision_report = None
+
+
+def store_face_encoding(member_id, member_name, encoding, image_hash=''):
+    """Добавление/обновление лица: одна запись в журнал вместо перезаписи всей галереи"""
+    face_gallery_store.put(face_encodings_db, member_id, member_name, encoding, image_hash)
+
+
+def delete_face_encodings(member_ids):
+    """Удаление лиц из галереи с записью в журнал. Возвращает удаленные member_id"""
+    return face_gallery_store.delete(face_encodings_db, member_ids)
+
+
 def get_known_faces_for_device_scope(device_id):
+    """member_id зарегистрированных лиц с учетом scope по устройству."""
     normalized_device_id = normalize_device_id(device_id)
     if not normalized_device_id:
-        return list(face_encodings_db.items())
+        return list(face_encodings_db)
+    return face_encodings_db.partition_members(normalized_device_id)
 
-    scoped_faces = []
-    for known_member_id, info in face_encodings_db.items():
-        member_device_id = get_device_id_from_member_id(known_member_id)
-        if member_device_id and member_device_id == normalized_device_id:
-            scoped_faces.append((known_member_id, info))
-    return scoped_faces
 
+def get_gallery_scope_rows(gallery, device_id):
+    """Строки снимка галереи для поиска: (rows или None для всей галереи, количество лиц)"""
+    if device_id:
+        scope_rows = gallery.partition_rows(device_id)
+        return scope_rows, len(scope_rows)
+    return None, len(gallery)
 
-def find_existing_face_duplicate(member_id, member_name, image_hash, face_encoding):
-    normalized_name = normalize_member_name(member_name)
-    member_id = str(member_id).strip()
 
-    for existing_member_id, info in face_encodings_db.items():
-        existing_member_id = str(existing_member_id).strip()
-        if existing_member_id == member_id:
-            continue
+def search_face_gallery(gallery, face_encodings, scope_rows):
+    """Два ближайших эталона для каждого лица; по всей галерее — через IVF, если он включен"""
+    return gallery.search(face_encodings, k=2, rows=scope_rows, approximate=FACE_ANN_ENABLED)
 
-        existing_hash = str(info.get('image_hash', '')).strip()
-        if image_hash and existing_hash and image_hash == existing_hash:
-            return {
-                'member_id': existing_member_id,
-                'name': str(info.get('name', '')).strip(),
-                'reason': 'image_hash'
-            }
 
-        if not normalized_name:
+def resolve_face_matches(gallery, search_result, face_locations, effective_threshold, offset=0):
+    """
+    Результаты распознавания лиц одного фото по результату поиска в галерее.
+    gallery — тот же снимок галереи, по которому выполнялся поиск (номера строк
+    действительны только в нем). offset — индекс первого лица фото в общем
+    (пакетном) результате поиска.
+    """
+    results = []
+    for face_index, face_location in enumerate(face_locations):
+        result_index = offset + face_index
+        best_row = int(search_result.rows[result_index, 0])
+        if best_row < 0:
             continue
 
-        existing_name = normalize_member_name(info.get('name', ''))
-        if existing_name != normalized_name:
-            continue
+        best_distance = float(search_result.distances[result_index, 0])
 
-        existing_encoding = info.get('encoding')
-        if existing_encoding is None:
-            continue
+        # Второй кандидат для проверки отрыва.
+        second_distance = float(search_result.distances[result_index, 1])
+        if not np.isfinite(second_distance):
+            second_distance = 1.0
 
-        try:
-            distance = float(face_recognition.face_distance([existing_encoding], face_encoding)[0])
-        except Exception:
+        # Основной критерий: дистанция ниже порога.
+        if best_distance > effective_threshold:
             continue
 
-        if distance <= FACE_DUPLICATE_NAME_DISTANCE:
-            return {
-                'member_id': existing_member_id,
-                'name': str(info.get('name', '')).strip(),
-                'reason': 'name_encoding',
-                'distance': distance
+        # Margin-check: если второй кандидат почти так же близок — результат
+        # ненадёжен, пропускаем чтобы не вводить пользователя в заблуждение.
+        margin = second_distance - best_distance
+        ambiguous = margin < MATCH_MARGIN
+
+        member_id, member_name = gallery.member_at(best_row)
+        confidence = 1 - best_distance
+
+        results.append({
+            'member_id': member_id,
+            'member_name': member_name,
+            'confidence': float(confidence),
+            'distance': best_distance,
+            'margin': float(margin),
+            'ambiguous': bool(ambiguous),
+            'location': {
+                'top': face_location[0],
+                'right': face_location[1],
+                'bottom': face_location[2],
+                'left': face_location[3]
             }
+        })
+    return results
 
-    return None
+
+def find_existing_face_duplicate(member_id, member_name, image_hash, face_encoding):
+    """
+    Поиск уже зарегистрированного лица: тот же файл (image_hash) или то же имя
+    и близкая кодировка. Кандидаты берутся из индексов галереи по хэшу и имени,
+    а не перебором всей галереи; кодировки кандидатов сравниваются одним вызовом.
+    """
+    member_id = str(member_id).strip()
+    gallery = face_encodings_db.snapshot()
+
+    if image_hash:
+        for existing_member_id in gallery.members_with_hash(image_hash):
+            if existing_member_id != member_id:
+                return {
+                    'member_id': existing_member_id,
+                    'name': gallery[existing_member_id]['name'],
+                    'reason': 'image_hash'
+                }
+
+    if not normalize_member_name(member_name):
+        return None
+
+    candidates = [
+        existing_member_id for existing_member_id in gallery.members_named(member_name)
+        if existing_member_id != member_id
+    ]
+    if not candidates:
+        return None
+
+    rows = gallery.rows_for(candidates)
+    search_result = gallery.search(face_encoding, k=1, rows=rows)
+    row = int(search_result.rows[0, 0])
+    distance = float(search_result.distances[0, 0])
+    if row < 0 or distance > FACE_DUPLICATE_NAME_DISTANCE:
+        return None
+
+    existing_member_id, existing_name = gallery.member_at(row)
+    return {
+        'member_id': existing_member_id,
+        'name': existing_name,
+        'reason': 'name_encoding',
+        'distance': distance
+    }
 
 
-def get_image_hash(image_array):
-    """Получает хэш изображения для кэширования"""
-    return hash(image_array.tobytes())
+def downscale_pil_image(image, max_side):
+    """Уменьшение PIL изображения до max_side по длинной стороне (без увеличения)"""
+    width, height = image.size
+    if max(width, height) <= max_side:
+        return image
+    ratio = max_side / max(width, height)
+    new_size = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+    # reducing_gap: сначала быстрый reduce() по целому коэффициенту, потом bilinear —
+    # в разы быстрее LANCZOS по полному кадру, для детектора разницы нет
+    return image.resize(new_size, DOWNSCALE_RESAMPLE, reducing_gap=DOWNSCALE_REDUCING_GAP)
 
 
 def optimize_image_for_gpu(image):
@@ -1202,25 +1598,35 @@ def optimize_image_for_gpu(image):
 
     # Уменьшаем изображение если оно слишком большое
     if max(width, height) > MAX_IMAGE_SIZE:
-        ratio = MAX_IMAGE_SIZE / max(width, height)
-        new_width = int(width * ratio)
-        new_height = int(height * ratio)
-
-        # Используем PIL для качественного ресайза
-        pil_image = Image.fromarray(image)
-        pil_image = pil_image.resize((new_width, new_height), Image.LANCZOS)
+        pil_image = downscale_pil_image(Image.fromarray(image), MAX_IMAGE_SIZE)
         image = np.array(pil_image)
-        logger.info(f"Изображение оптимизировано: {width}x{height} → {new_width}x{new_height}")
+        logger.info(f"Изображение оптимизировано: {width}x{height} → {pil_image.width}x{pil_image.height}")
 
     return image
 
 
-def detect_faces_optimized(image):
-    """Оптимизированное обнаружение лиц с кэшированием"""
-    img_hash = get_image_hash(image)
-    if img_hash in face_detection_cache:
-        logger.info("Использован кэш для обнаружения лиц")
-        return face_detection_cache[img_hash]
+def detect_faces_optimized(image, skip_primary=False, budget_ms=None, report=None):
+    """
+    Оптимизированное обнаружение лиц.
+    skip_primary — первичный проход уже выполнен (например, пакетно в detect_faces_batch).
+    budget_ms — бюджет времени на fallback-этапы: после его исчерпания новые попытки не
+    запускаются, а текущий этап не дожидается (первичный проход выполняется всегда).
+    report — словарь, куда записываются выполненные этапы и признак исчерпания бюджета.
+
+    Если первичный проход ничего не нашел, запускается каскад этапов (fallback, upscaled,
+    crops, rotations, fullres, fullres-rotations). Попытки внутри этапа независимы и
+    выполняются параллельно в face_worker_pool; порядок каскада решает, чей результат
+    взять, если лицо нашли несколько попыток. Статистика попыток копится в face_cascade_stats;
+    при FACE_CASCADE_ADAPTIVE порядок fallback-этапов и попыток подстраивается под нее.
+    """
+    start_time = time.monotonic()
+    deadline = start_time + budget_ms / 1000.0 if budget_ms else None
+    if report is None:
+        report = {}
+    report.update({'budget_ms': budget_ms, 'stages': [], 'budget_exhausted': False})
+
+    def budget_left():
+        return deadline is None or time.monotonic() < deadline
 
     optimized_image = optimize_image_for_gpu(image)
 
@@ -1238,20 +1644,6 @@ def detect_faces_optimized(image):
             f"optimized={optimized_width}x{optimized_height}, ratio={optimization_scale:.4f}"
         )
 
-    def run_face_detection(image_array, model_name, upsample_value, attempt_name):
-        start_time = time.time()
-        locations = face_recognition.face_locations(
-            image_array,
-            model=model_name,
-            number_of_times_to_upsample=upsample_value
-        )
-        detection_time = time.time() - start_time
-        logger.info(
-            f"Обнаружение лиц [{attempt_name}]: {detection_time:.3f}s, "
-            f"model={model_name}, upsample={upsample_value}, найдено={len(locations)}"
-        )
-        return locations
-
     def clamp_location(location):
         top, right, bottom, left = location
         top = max(0, min(source_height, int(round(top))))
@@ -1270,11 +1662,20 @@ def detect_faces_optimized(image):
         upscaled = pil_image.resize((target_width, target_height), Image.LANCZOS)
         return np.array(upscaled)
 
-    def detect_and_map(image_array, model_name, upsample_value, attempt_name, scale=1.0, offset_top=0, offset_left=0):
-        detected_locations = run_face_detection(image_array, model_name, upsample_value, attempt_name)
-        if len(detected_locations) == 0:
-            return []
+    def rotate_image(image_array, rotation_k):
+        return np.ascontiguousarray(np.rot90(image_array, k=rotation_k))
+
+    def once(build):
+        """Кадр готовится один раз и переиспользуется попытками с разным upsample/моделью"""
+        prepared = []
+
+        def get():
+            if not prepared:
+                prepared.append(build())
+            return prepared[0]
+        return get
 
+    def map_from_optimized(detected_locations, scale=1.0, offset_top=0, offset_left=0):
         mapped_locations = []
         for top, right, bottom, left in detected_locations:
             mapped = clamp_location((
@@ -1288,19 +1689,10 @@ def detect_faces_optimized(image):
 
         return mapped_locations
 
-    def detect_on_source(image_array, model_name, upsample_value, attempt_name, scale=1.0, offset_top=0, offset_left=0):
-        detected_locations = run_face_detection(image_array, model_name, upsample_value, attempt_name)
-        if len(detected_locations) == 0:
-            return []
-
+    def map_from_source(detected_locations):
         mapped_locations = []
-        for top, right, bottom, left in detected_locations:
-            mapped = clamp_location((
-                top / scale + offset_top,
-                right / scale + offset_left,
-                bottom / scale + offset_top,
-                left / scale + offset_left
-            ))
+        for location in detected_locations:
+            mapped = clamp_location(location)
             if mapped is not None:
                 mapped_locations.append(mapped)
 
@@ -1350,14 +1742,9 @@ def detect_faces_optimized(image):
 
         return mapped_top, mapped_right, mapped_bottom, mapped_left
 
-    def detect_rotated_and_map(image_array, rotation_k, model_name, upsample_value, attempt_name, map_scale):
-        rotated_image = np.ascontiguousarray(np.rot90(image_array, k=rotation_k))
-        detected_locations = run_face_detection(rotated_image, model_name, upsample_value, attempt_name)
-        if len(detected_locations) == 0:
-            return []
-
+    def map_from_rotated(detected_locations, rotation_k, image_shape, map_scale):
         map_scale = max(1e-6, map_scale)
-        image_height, image_width = image_array.shape[:2]
+        image_height, image_width = image_shape[:2]
         mapped_locations = []
         for location in detected_locations:
             unrotated_location = map_location_from_rotated(
@@ -1380,80 +1767,118 @@ def detect_faces_optimized(image):
 
         return mapped_locations
 
-    face_locations = detect_and_map(
-        optimized_image,
-        FACE_MODEL,
-        NUMBER_OF_TIMES_TO_UPSAMPLE,
-        'primary'
-    )
+    def run_stage(stage_name, attempts, budgeted=True):
+        """
+        Один этап каскада: независимые попытки (имя, модель, upsample, кадр, перевод координат).
+        В пуле процессов попытки этапа выполняются параллельно, не больше одной на процесс.
+        Следующая попытка отправляется только при свободном процессе и после проверки бюджета,
+        поэтому исчерпанный бюджет останавливает этап и в пуле. Побеждает первая по порядку
+        каскада попытка, нашедшая лицо; еще не начатые попытки после нее отменяются.
+        """
+        if not attempts:
+            return []
 
-    if len(face_locations) == 0 and FALLBACK_UPSAMPLE > NUMBER_OF_TIMES_TO_UPSAMPLE:
-        face_locations = detect_and_map(
-            optimized_image,
-            FACE_MODEL,
-            FALLBACK_UPSAMPLE,
-            'fallback-upsample'
+        attempts = [attempts[index] for index in face_cascade_stats.order_attempts([item[0] for item in attempts])]
+        start_time = time.time()
+        scheduled = []
+
+        def jobs():
+            for attempt in attempts:
+                # Бюджет исчерпан — следующие попытки не запускаются
+                if budgeted and not budget_left():
+                    return
+                scheduled.append(attempt[0])
+                _, model_name, upsample_value, prepare, _ = attempt
+                yield timed_face_locations_job, (prepare(), model_name, upsample_value)
+
+        def accept(index, job_result):
+            detected_locations, detection_time = job_result
+            attempt_name, model_name, upsample_value, _, map_locations = attempts[index]
+            logger.info(
+                f"Обнаружение лиц [{attempt_name}]: {detection_time:.3f}s, model={model_name}, "
+                f"upsample={upsample_value}, найдено={len(detected_locations)}"
+            )
+            mapped_locations = map_locations(detected_locations) if len(detected_locations) > 0 else []
+            face_cascade_stats.record_attempt(stage_name, attempt_name, len(mapped_locations) > 0, detection_time)
+            return mapped_locations
+
+        timeout = None
+        if budgeted and deadline is not None:
+            timeout = max(0.0, deadline - time.monotonic())
+            if face_worker_pool.timeout:
+                timeout = min(timeout, face_worker_pool.timeout)
+        interrupted = False
+        try:
+            winner, stage_locations = face_worker_pool.run_first(jobs(), accept, timeout=timeout)
+        except FaceWorkerTimeout:
+            if budget_left():
+                raise
+            winner, stage_locations = None, []
+            interrupted = True
+
+        stage_time = time.time() - start_time
+        if winner is None and (interrupted or len(scheduled) < len(attempts)):
+            interrupted = True
+            report['budget_exhausted'] = True
+        else:
+            face_cascade_stats.record_stage(stage_name, winner is not None, stage_time)
+        report['stages'].append({
+            'stage': stage_name,
+            'attempts': len(scheduled),
+            'total_attempts': len(attempts),
+            'ms': round(stage_time * 1000.0, 1),
+            'found': winner is not None,
+            'interrupted': interrupted,
+        })
+        logger.info(
+            f"Этап каскада [{stage_name}]: {stage_time:.3f}s, попыток={len(scheduled)}/{len(attempts)}, "
+            f"результат={attempts[winner][0] if winner is not None else 'нет лиц'}"
+            f"{', бюджет исчерпан' if interrupted else ''}"
         )
+        return stage_locations or []
 
-    if len(face_locations) == 0 and FACE_MODEL == 'cnn':
-        face_locations = detect_and_map(
-            optimized_image,
-            'hog',
-            FALLBACK_UPSAMPLE,
-            'fallback-hog'
-        )
+    def model_variants(name, hog_name):
+        """Основная модель и, для CNN, HOG-дублер той же попытки"""
+        variants = [(name, FACE_MODEL)]
+        if FACE_MODEL == 'cnn':
+            variants.append((hog_name, 'hog'))
+        return variants
 
-    # Retry on auto-contrast frame for low-contrast portraits.
-    if len(face_locations) == 0:
+    get_optimized = lambda: optimized_image
+
+    def fallback_attempts():
+        attempts = []
+        if FALLBACK_UPSAMPLE > NUMBER_OF_TIMES_TO_UPSAMPLE:
+            attempts.append(('fallback-upsample', FACE_MODEL, FALLBACK_UPSAMPLE, get_optimized, map_from_optimized))
+        if FACE_MODEL == 'cnn':
+            attempts.append(('fallback-hog', 'hog', FALLBACK_UPSAMPLE, get_optimized, map_from_optimized))
+
+        # Retry on auto-contrast frame for low-contrast portraits.
         contrasted = np.array(ImageOps.autocontrast(Image.fromarray(optimized_image), cutoff=1))
         if contrasted.shape == optimized_image.shape:
-            face_locations = detect_and_map(
-                contrasted,
-                FACE_MODEL,
-                FALLBACK_UPSAMPLE,
-                'fallback-autocontrast'
-            )
-            if len(face_locations) == 0 and FACE_MODEL == 'cnn':
-                face_locations = detect_and_map(
-                    contrasted,
-                    'hog',
-                    FALLBACK_UPSAMPLE,
-                    'fallback-autocontrast-hog'
-                )
+            for attempt_name, model_name in model_variants('fallback-autocontrast', 'fallback-autocontrast-hog'):
+                attempts.append((attempt_name, model_name, FALLBACK_UPSAMPLE, lambda: contrasted, map_from_optimized))
+        return attempts
 
-    if len(face_locations) == 0:
+    def upscaled_attempts():
+        attempts = []
         for scale in DETECTION_UPSCALE_FACTORS:
-            upscaled_image = upscale_image(optimized_image, scale)
+            get_upscaled = once(lambda scale=scale: upscale_image(optimized_image, scale))
+            map_upscaled = lambda locations, scale=scale: map_from_optimized(locations, scale=scale)
             for upsample_value in (0, 1):
-                face_locations = detect_and_map(
-                    upscaled_image,
-                    FACE_MODEL,
-                    upsample_value,
+                for attempt_name, model_name in model_variants(
                     f'fallback-upscaled-{scale}-u{upsample_value}',
-                    scale=scale
-                )
-                if len(face_locations) > 0:
-                    break
-
-                if FACE_MODEL == 'cnn':
-                    face_locations = detect_and_map(
-                        upscaled_image,
-                        'hog',
-                        upsample_value,
-                        f'fallback-upscaled-hog-{scale}-u{upsample_value}',
-                        scale=scale
-                    )
-                    if len(face_locations) > 0:
-                        break
-
-            if len(face_locations) > 0:
-                break
+                    f'fallback-upscaled-hog-{scale}-u{upsample_value}'
+                ):
+                    attempts.append((attempt_name, model_name, upsample_value, get_upscaled, map_upscaled))
+        return attempts
 
-    if len(face_locations) == 0:
+    def crop_attempts():
         crop_specs = [
             ('center', 0.08, 0.12, 0.92, 0.88),
             ('upper_center', 0.00, 0.12, 0.78, 0.88),
         ]
+        attempts = []
         for crop_name, top_ratio, left_ratio, bottom_ratio, right_ratio in crop_specs:
             top = int(optimized_height * top_ratio)
             left = int(optimized_width * left_ratio)
@@ -1464,170 +1889,323 @@ def detect_faces_optimized(image):
                 continue
 
             for scale in CROP_UPSCALE_FACTORS:
-                upscaled_crop = upscale_image(crop, scale)
+                get_crop = once(lambda crop=crop, scale=scale: upscale_image(crop, scale))
+                map_crop = lambda locations, scale=scale, top=top, left=left: map_from_optimized(
+                    locations, scale=scale, offset_top=top, offset_left=left
+                )
                 for upsample_value in (0, 1):
-                    face_locations = detect_and_map(
-                        upscaled_crop,
-                        FACE_MODEL,
-                        upsample_value,
+                    for attempt_name, model_name in model_variants(
                         f'fallback-crop-{crop_name}-{scale}-u{upsample_value}',
-                        scale=scale,
-                        offset_top=top,
-                        offset_left=left
-                    )
-                    if len(face_locations) > 0:
-                        break
-
-                    if FACE_MODEL == 'cnn':
-                        face_locations = detect_and_map(
-                            upscaled_crop,
-                            'hog',
-                            upsample_value,
-                            f'fallback-crop-{crop_name}-hog-{scale}-u{upsample_value}',
-                            scale=scale,
-                            offset_top=top,
-                            offset_left=left
-                        )
-                        if len(face_locations) > 0:
-                            break
-
-                if len(face_locations) > 0:
-                    break
-
-            if len(face_locations) > 0:
-                break
-
-    if len(face_locations) == 0:
-        rotation_attempts = [
-            (1, 'rot90ccw'),
-            (3, 'rot90cw'),
-            (2, 'rot180'),
-        ]
-        optimized_pixels = optimized_height * optimized_width
+                        f'fallback-crop-{crop_name}-hog-{scale}-u{upsample_value}'
+                    ):
+                        attempts.append((attempt_name, model_name, upsample_value, get_crop, map_crop))
+        return attempts
+
+    def rotation_attempts(source, map_scale, upsamples, name_prefix=''):
+        attempts = []
+        for rotation_k, rotation_name in ((1, 'rot90ccw'), (3, 'rot90cw'), (2, 'rot180')):
+            rotation_name = f'{name_prefix}{rotation_name}'
+            get_rotated = once(lambda rotation_k=rotation_k: rotate_image(source, rotation_k))
+            map_rotated = lambda locations, rotation_k=rotation_k: map_from_rotated(
+                locations, rotation_k, source.shape, map_scale
+            )
+            for upsample_value in upsamples:
+                for attempt_name, model_name in model_variants(
+                    f'fallback-{rotation_name}-u{upsample_value}',
+                    f'fallback-{rotation_name}-hog-u{upsample_value}'
+                ):
+                    attempts.append((attempt_name, model_name, upsample_value, get_rotated, map_rotated))
+        return attempts
+
+    def optimized_rotation_attempts():
         rotation_upsamples = [FALLBACK_UPSAMPLE]
-        if FALLBACK_UPSAMPLE < 3 and optimized_pixels <= EXTRA_UPSAMPLE_MAX_PIXELS:
+        if FALLBACK_UPSAMPLE < 3 and optimized_height * optimized_width <= EXTRA_UPSAMPLE_MAX_PIXELS:
             rotation_upsamples.append(FALLBACK_UPSAMPLE + 1)
+        return rotation_attempts(optimized_image, optimization_scale, rotation_upsamples)
+
+    def source_upsamples():
+        upsamples = [FALLBACK_UPSAMPLE]
+        if NUMBER_OF_TIMES_TO_UPSAMPLE not in upsamples:
+            upsamples.insert(0, NUMBER_OF_TIMES_TO_UPSAMPLE)
+        if FALLBACK_UPSAMPLE < 3 and source_height * source_width <= EXTRA_UPSAMPLE_MAX_PIXELS:
+            upsamples.append(FALLBACK_UPSAMPLE + 1)
+        return upsamples
+
+    def fullres_attempts():
+        # Полное разрешение имеет смысл только если кадр уменьшали в optimize_image_for_gpu
+        if optimization_scale >= 0.999:
+            return []
+        get_source = lambda: image
+        attempts = []
+        for upsample_value in source_upsamples():
+            for attempt_name, model_name in model_variants(
+                f'fallback-fullres-u{upsample_value}',
+                f'fallback-fullres-hog-u{upsample_value}'
+            ):
+                attempts.append((attempt_name, model_name, upsample_value, get_source, map_from_source))
+        return attempts
+
+    def fullres_rotation_attempts():
+        if optimization_scale >= 0.999:
+            return []
+        return rotation_attempts(image, 1.0, source_upsamples(), name_prefix='fullres-')
+
+    fallback_stages = {
+        'fallback': fallback_attempts,
+        'upscaled': upscaled_attempts,
+        'crops': crop_attempts,
+        'rotations': optimized_rotation_attempts,
+        'fullres': fullres_attempts,
+        'fullres-rotations': fullres_rotation_attempts,
+    }
 
-        for rotation_k, rotation_name in rotation_attempts:
-            for upsample_value in rotation_upsamples:
-                face_locations = detect_rotated_and_map(
-                    optimized_image,
-                    rotation_k=rotation_k,
-                    model_name=FACE_MODEL,
-                    upsample_value=upsample_value,
-                    attempt_name=f'fallback-{rotation_name}-u{upsample_value}',
-                    map_scale=optimization_scale
-                )
-                if len(face_locations) > 0:
-                    break
-
-                if FACE_MODEL == 'cnn':
-                    face_locations = detect_rotated_and_map(
-                        optimized_image,
-                        rotation_k=rotation_k,
-                        model_name='hog',
-                        upsample_value=upsample_value,
-                        attempt_name=f'fallback-{rotation_name}-hog-u{upsample_value}',
-                        map_scale=optimization_scale
-                    )
-                    if len(face_locations) > 0:
-                        break
-
-            if len(face_locations) > 0:
-                break
+    face_locations = []
+    if not skip_primary:
+        face_locations = run_stage('primary', [
+            ('primary', FACE_MODEL, NUMBER_OF_TIMES_TO_UPSAMPLE, get_optimized, map_from_optimized)
+        ], budgeted=False)
+
+    # Порядок этапов — как в каскаде, либо адаптивный по накопленной статистике
+    stage_order = face_cascade_stats.order_stages(list(fallback_stages))
+    for position, stage_name in enumerate(stage_order):
+        if len(face_locations) > 0:
+            break
+        if not budget_left() or report['budget_exhausted']:
+            report['budget_exhausted'] = True
+            report['skipped_stages'] = stage_order[position:]
+            break
+        face_locations = run_stage(stage_name, fallback_stages[stage_name]())
+
+    report['elapsed_ms'] = round((time.monotonic() - start_time) * 1000.0, 1)
+    if report['budget_exhausted']:
+        logger.info(
+            f"Бюджет детекции {budget_ms} мс исчерпан за {report['elapsed_ms']} мс, "
+            f"пропущены этапы: {', '.join(report.get('skipped_stages', [])) or '-'}"
+        )
+    face_cascade_stats.maybe_save()
+    return face_locations
 
-    if len(face_locations) == 0 and optimization_scale < 0.999:
-        source_pixels = source_height * source_width
-        source_upsamples = [FALLBACK_UPSAMPLE]
-        if NUMBER_OF_TIMES_TO_UPSAMPLE not in source_upsamples:
-            source_upsamples.insert(0, NUMBER_OF_TIMES_TO_UPSAMPLE)
-        if FALLBACK_UPSAMPLE < 3 and source_pixels <= EXTRA_UPSAMPLE_MAX_PIXELS:
-            source_upsamples.append(FALLBACK_UPSAMPLE + 1)
-
-        for upsample_value in source_upsamples:
-            face_locations = detect_on_source(
-                image,
-                FACE_MODEL,
-                upsample_value,
-                f'fallback-fullres-u{upsample_value}'
-            )
-            if len(face_locations) > 0:
-                break
+def map_locations_to_source(locations, source_shape, optimized_shape):
+    """Перевод координат лиц с уменьшенного изображения на исходное"""
+    source_height, source_width = source_shape[:2]
+    optimized_height, optimized_width = optimized_shape[:2]
+    scale = 1.0
+    if source_width > 0 and source_height > 0:
+        scale = max(1e-6, min(optimized_width / source_width, optimized_height / source_height))
 
-            if FACE_MODEL == 'cnn':
-                face_locations = detect_on_source(
-                    image,
-                    'hog',
-                    upsample_value,
-                    f'fallback-fullres-hog-u{upsample_value}'
-                )
-                if len(face_locations) > 0:
-                    break
+    mapped_locations = []
+    for top, right, bottom, left in locations:
+        top = max(0, min(source_height, int(round(top / scale))))
+        right = max(0, min(source_width, int(round(right / scale))))
+        bottom = max(0, min(source_height, int(round(bottom / scale))))
+        left = max(0, min(source_width, int(round(left / scale))))
+        if bottom > top and right > left:
+            mapped_locations.append((top, right, bottom, left))
+    return mapped_locations
 
-        if len(face_locations) == 0:
-            rotation_attempts = [
-                (1, 'fullres-rot90ccw'),
-                (3, 'fullres-rot90cw'),
-                (2, 'fullres-rot180'),
-            ]
-            for rotation_k, rotation_name in rotation_attempts:
-                for upsample_value in source_upsamples:
-                    face_locations = detect_rotated_and_map(
-                        image,
-                        rotation_k=rotation_k,
-                        model_name=FACE_MODEL,
-                        upsample_value=upsample_value,
-                        attempt_name=f'fallback-{rotation_name}-u{upsample_value}',
-                        map_scale=1.0
-                    )
-                    if len(face_locations) > 0:
-                        break
-
-                    if FACE_MODEL == 'cnn':
-                        face_locations = detect_rotated_and_map(
-                            image,
-                            rotation_k=rotation_k,
-                            model_name='hog',
-                            upsample_value=upsample_value,
-                            attempt_name=f'fallback-{rotation_name}-hog-u{upsample_value}',
-                            map_scale=1.0
-                        )
-                        if len(face_locations) > 0:
-                            break
-
-                if len(face_locations) > 0:
-                    break
-
-    if len(face_detection_cache) >= CACHE_MAX_SIZE:
-        oldest_key = next(iter(face_detection_cache))
-        del face_detection_cache[oldest_key]
-
-    face_detection_cache[img_hash] = face_locations
+
+def detect_faces_batch(images):
+    """
+    Обнаружение лиц на нескольких фото.
+
+    Для CNN первичный проход выполняется пакетно (face_recognition.batch_face_locations,
+    по BATCH_SIZE кадров на GPU) для фото одинакового размера после optimize_image_for_gpu.
+    Фото, на которых пакетный проход ничего не нашел, проходят обычный каскад
+    detect_faces_optimized без повтора первичного прохода.
+    """
+    face_locations = [None] * len(images)
+    primary_done = [False] * len(images)
+
+    if FACE_MODEL == 'cnn' and len(images) > 1:
+        groups = {}
+        for index, image in enumerate(images):
+            optimized_image = optimize_image_for_gpu(image)
+            groups.setdefault(optimized_image.shape, []).append((index, image, optimized_image))
+
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+            start_time = time.time()
+            batch_locations = face_worker_pool.batch_face_locations(
+                [optimized_image for _, _, optimized_image in group],
+                NUMBER_OF_TIMES_TO_UPSAMPLE,
+                BATCH_SIZE
+            )
+            logger.info(
+                f"Пакетное обнаружение лиц [primary]: {time.time() - start_time:.3f}s, "
+                f"кадров={len(group)}, размер={group[0][2].shape[1]}x{group[0][2].shape[0]}"
+            )
+            for (index, image, optimized_image), locations in zip(group, batch_locations):
+                primary_done[index] = True
+                if len(locations) > 0:
+                    face_locations[index] = map_locations_to_source(locations, image.shape, optimized_image.shape)
+
+    for index, image in enumerate(images):
+        if face_locations[index] is None:
+            face_locations[index] = detect_faces_optimized(image, skip_primary=primary_done[index])
     return face_locations
 
-def decode_base64_image(base64_string):
-    """Декодирование base64 изображения с оптимизацией для GPU"""
+
+def locate_and_encode_faces(
+    image_data,
+    num_jitters,
+    image=None,
+    max_faces=None,
+    budget_ms=None,
+    report=None,
+    image_digest=None,
+    encode=True
+):
+    """
+    Детекция и кодирование лиц загруженного файла через face_result_cache.
+
+    image_data — сжатый файл (ключ кэша — его дайджест; image_digest, если уже посчитан),
+    image — уже декодированный массив, если есть; иначе файл декодируется только при
+    промахе кэша.
+    max_faces — не кодировать, если лиц больше (для регистрации нужно ровно одно).
+    encode=False — только детекция (кодировки из кэша все равно возвращаются).
+    budget_ms и report передаются в detect_faces_optimized; результат, оборванный
+    бюджетом без найденных лиц, не кэшируется.
+    Одновременные вызовы с тем же файлом и параметрами выполняются один раз
+    (face_single_flight): остальные ждут и получают тот же результат, в report
+    у них coalesced=True.
+    Возвращает (image, face_locations, face_encodings): face_locations = None, если файл
+    не декодируется; face_encodings = None, если кодирование не понадобилось.
+    """
+    if report is None:
+        report = {}
+    if image_digest is None:
+        image_digest = content_digest(image_data)
+
+    def compute():
+        flight_report = {}
+        result = compute_faces_for_upload(
+            image_data, num_jitters, image, max_faces, budget_ms, flight_report, image_digest, encode
+        )
+        return result, flight_report
+
+    key = (image_digest, num_jitters, max_faces, budget_ms, encode)
+    (result, flight_report), shared = face_single_flight.do(key, compute)
+    report.update(flight_report)
+    if shared:
+        report['coalesced'] = True
+        logger.info("Результат детекции получен от одновременного запроса с тем же файлом")
+    return result
+
+
+def compute_faces_for_upload(image_data, num_jitters, image, max_faces, budget_ms, report, image_digest, encode):
+    """Тело locate_and_encode_faces (один раз на группу одинаковых одновременных вызовов)"""
+    face_locations, face_encodings = face_result_cache.lookup(image_digest, ENCODING_MODEL, num_jitters)
+    report['cached'] = face_locations is not None
+    if face_locations is not None and face_encodings is not None:
+        logger.info("Использован кэш для обнаружения и кодирования лиц")
+
+    if face_locations is None:
+        if image is None:
+            image = decode_image_bytes(image_data)
+        if image is None:
+            return None, None, None
+        face_locations = detect_faces_optimized(image, budget_ms=budget_ms, report=report)
+        if len(face_locations) > 0 or not report.get('budget_exhausted'):
+            face_result_cache.put_locations(image_digest, face_locations)
+
+    if (
+        encode
+        and face_encodings is None
+        and len(face_locations) > 0
+        and (max_faces is None or len(face_locations) <= max_faces)
+    ):
+        if image is None:
+            image = decode_image_bytes(image_data)
+        if image is None:
+            return None, None, None
+        face_encodings = face_worker_pool.face_encodings(image, face_locations, num_jitters, ENCODING_MODEL)
+        face_result_cache.put_encodings(image_digest, ENCODING_MODEL, num_jitters, face_encodings)
+
+    return image, face_locations, face_encodings
+
+
+def read_face_upload():
+    """
+    Параметры и сжатый файл фото из запроса к register_face/recognize_face.
+
+    Поддерживаются:
+    - multipart/form-data: файл в поле image, остальные параметры — поля формы;
+    - тело image/* или application/octet-stream: файл целиком, параметры в query string;
+    - application/json: base64 в поле image (старые клиенты).
+    Возвращает (params, image_data, image_present): image_data = None, если фото нет
+    или base64 не декодируется (тогда image_present = True).
+    """
+    content_type = (request.mimetype or '').lower()
+    if request.files or content_type == 'multipart/form-data':
+        upload = request.files.get('image')
+        if upload is None:
+            return request.form, None, False
+        return request.form, upload.read(), True
+
+    if content_type.startswith('image/') or content_type == 'application/octet-stream':
+        # Файл целиком в теле запроса, без base64 и JSON-разбора
+        image_data = request.get_data(cache=False)
+        return request.args, image_data or None, bool(image_data)
+
+    params = request.get_json(silent=True) or {}
+    if not isinstance(params, dict):
+        params = {}
+    image_base64 = params.get('image')
+    if not isinstance(image_base64, str) or not image_base64:
+        return params, None, False
+    return params, decode_base64_bytes(image_base64), True
+
+
+def decode_base64_bytes(base64_string):
+    """Сжатый файл (JPEG/PNG/...) из base64 строки, с префиксом data:image или без"""
     try:
         # Убираем префикс data:image если есть
         if ',' in base64_string:
             base64_string = base64_string.split(',')[1]
 
-        image_data = base64.b64decode(base64_string)
+        return base64.b64decode(base64_string)
+    except Exception as e:
+        logger.error(f"Ошибка декодирования изображения: {e}")
+        return None
+
+
+def decode_image_bytes(image_data):
+    """Декодирование сжатого изображения (JPEG/PNG/...) в RGB массив"""
+    try:
         image = Image.open(io.BytesIO(image_data))
+        original_width, original_height = image.size
+
+        # JPEG: декодер сразу масштабирует DCT-блоки (1/2, 1/4, 1/8), не опускаясь
+        # ниже DECODE_MAX_IMAGE_SIZE — полноразмерный кадр каскада не теряет деталей
+        if FACE_DECODE_DRAFT and image.format == 'JPEG':
+            ratio = DECODE_MAX_IMAGE_SIZE / max(original_width, original_height)
+            if ratio < 0.5:
+                image.draft('RGB', (
+                    int(math.ceil(original_width * ratio)),
+                    int(math.ceil(original_height * ratio))
+                ))
+
         image = ImageOps.exif_transpose(image)
 
         # Конвертируем в RGB если нужно
         if image.mode != 'RGB':
             image = image.convert('RGB')
 
-        # Оптимизация размера для GPU - уменьшаем большие изображения
+        # Оптимизация размера для GPU - уменьшаем большие изображения. При
+        # DECODE_MERGE_RATIO > 1 кадр, близкий к рабочему размеру, сразу приводится
+        # к MAX_IMAGE_SIZE: optimize_image_for_gpu его уже не трогает
         width, height = image.size
-        if max(width, height) > DECODE_MAX_IMAGE_SIZE:
-            ratio = DECODE_MAX_IMAGE_SIZE / max(width, height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            image = image.resize((new_width, new_height), Image.LANCZOS)
-            logger.info(f"Изображение уменьшено с {width}x{height} до {new_width}x{new_height}")
+        target_size = DECODE_MAX_IMAGE_SIZE
+        if max(width, height) <= MAX_IMAGE_SIZE * DECODE_MERGE_RATIO:
+            target_size = MAX_IMAGE_SIZE
+        if max(width, height) > target_size:
+            image = downscale_pil_image(image, target_size)
+        if max(image.size) < max(original_width, original_height):
+            logger.info(
+                f"Изображение уменьшено с {original_width}x{original_height} "
+                f"до {image.width}x{image.height}"
+            )
 
         return np.array(image)
     except Exception as e:
@@ -1658,6 +2236,14 @@ def health_check():
         'pdf_generation': True,
         'backup': True,
         'members_count': len(face_encodings_db),
+        'face_workers': face_worker_pool.stats(),
+        'face_cache': face_result_cache.stats(),
+        'face_inflight': face_single_flight.stats(),
+        'face_register_jobs': face_register_jobs.stats(),
+        'face_admission': face_admission.stats(),
+        'face_ann': face_encodings_db.ann_stats(),
+        'face_storage': {**face_encodings_db.storage_stats(), 'evaluation': face_precision_report},
+        'face_autotag': face_backup_autotagger.status(),
         'recent_events': events_list,
         'gpu': {
             'requested_cuda': USE_CUDA,
@@ -1835,8 +2421,201 @@ def delete_backup_archive():
 # FACE RECOGNITION - Роуты
 # ========================================
 
+def wants_async_registration(data):
+    """Асинхронная регистрация: поле/параметр async или заголовок Prefer: respond-async"""
+    raw_async = data.get('async') if hasattr(data, 'get') else None
+    if raw_async is not None and str(raw_async).strip().lower() in {'1', 'true', 'yes', 'on'}:
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '').lower()
+
+
+def save_face_chip(member_id, image, face_location):
+    """Сохранение лица эталона и его рамки; ошибка не мешает регистрации"""
+    if face_location is None:
+        return
+    try:
+        face_chip_store.save(member_id, image, face_location)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить лицо эталона {member_id}: {e}")
+
+
+def commit_face_registration(member_id, member_name, image, face_encoding, image_hash, face_location=None):
+    """
+    Запись зарегистрированного лица: проверка дубликатов, эталонное фото, лицо
+    эталона с рамкой (face_location), галерея.
+
+    Выполняется под блокировкой галереи, поэтому параллельные регистрации (из запросов
+    и фоновых задач) не пересекаются. При перерегистрации под новым member_id новое
+    лицо появляется в галерее до удаления старой записи — распознавание не видит
+    промежуточного состояния без этого человека. Возвращает тело ответа.
+    """
+    with face_gallery_store.lock:
+        duplicate = find_existing_face_duplicate(
+            member_id=member_id,
+            member_name=member_name,
+            image_hash=image_hash,
+            face_encoding=face_encoding
+        )
+        if duplicate is not None and str(duplicate['member_id']) == str(member_id):
+            # Тот же member_id — реальный дубликат, обновляем кодировку (и лицо, из которого она получена)
+            save_face_chip(member_id, image, face_location)
+            store_face_encoding(member_id, member_name, face_encoding, image_hash)
+            logger.info(
+                "Обновлена кодировка для %s (ID: %s)",
+                member_name, member_id
+            )
+            return {
+                'success': True,
+                'message': f"Кодировка обновлена для {member_name}",
+                'member_id': member_id,
+                'duplicate': True,
+                'duplicate_reason': duplicate['reason']
+            }
+
+        # Сохраняем эталонное фото и кодировку (запись в журнал галереи)
+        photo_path = os.path.join(REFERENCE_PHOTOS_DIR, f"{member_id}.jpg")
+        Image.fromarray(image).save(photo_path)
+        save_face_chip(member_id, image, face_location)
+        store_face_encoding(member_id, member_name, face_encoding, image_hash)
+
+        if duplicate is not None:
+            # Дубликат под ДРУГИМ member_id — лицо перерегистрировано под новым
+            old_id = duplicate['member_id']
+            logger.info(
+                "Перерегистрация лица: old_id=%s -> new_id=%s (reason=%s)",
+                old_id, member_id, duplicate['reason']
+            )
+            delete_face_encodings([old_id])
+            face_chip_store.delete([old_id])
+            old_photo = os.path.join(REFERENCE_PHOTOS_DIR, f"{old_id}.jpg")
+            if os.path.exists(old_photo):
+                try:
+                    os.remove(old_photo)
+                except OSError:
+                    pass
+
+    logger.info(f"Зарегистрировано лицо для {member_name} (ID: {member_id})")
+    return {
+        'success': True,
+        'message': f'Лицо {member_name} успешно зарегистрировано',
+        'member_id': member_id
+    }
+
+
+def run_face_registration_job(member_id, member_name, image_data, face_locations, image_digest):
+    """
+    Фоновая часть асинхронной регистрации: декодирование, кодирование с REGISTER_JITTERS
+    и запись. Декодирование детерминировано, рамки из запроса совпадают с кадром.
+    """
+    image = decode_image_bytes(image_data)
+    if image is None:
+        raise ValueError('Не удалось декодировать изображение')
+    face_encodings = face_worker_pool.face_encodings(image, face_locations, REGISTER_JITTERS, ENCODING_MODEL)
+    face_result_cache.put_encodings(image_digest, ENCODING_MODEL, REGISTER_JITTERS, face_encodings)
+    if not face_encodings:
+        raise ValueError('Не удалось получить кодировку лица')
+    return commit_face_registration(
+        member_id,
+        member_name,
+        image,
+        face_encodings[0],
+        upload_image_hash(image_digest),
+        face_location=face_locations[0]
+    )
+
+
+def encode_reference_photo(image_data):
+    """Кодировка эталонного фото с текущими настройками (для перекодирования галереи)"""
+    image = decode_image_bytes(image_data)
+    if image is None:
+        raise ValueError('Не удалось декодировать изображение')
+    face_locations = detect_faces_optimized(image)
+    if len(face_locations) != 1:
+        raise ValueError(f'Лиц на фото: {len(face_locations)}')
+    face_encodings = face_worker_pool.face_encodings(image, face_locations, REGISTER_JITTERS, ENCODING_MODEL)
+    if not face_encodings:
+        raise ValueError('Не удалось получить кодировку лица')
+    return face_encodings[0]
+
+
+def encode_face_chip(chip, face_location):
+    """Кодировка сохраненного лица эталона по его рамке — без детекции"""
+    face_encodings = face_worker_pool.face_encodings(chip, [face_location], REGISTER_JITTERS, ENCODING_MODEL)
+    if not face_encodings:
+        raise ValueError('Не удалось получить кодировку лица')
+    return face_encodings[0]
+
+
+# Фоновое перекодирование галереи (админ API или python face_reencode.py):
+# продолжается после остановки, если настройки кодирования не менялись.
+# Лица с сохраненным при регистрации фрагментом кодируются по нему, остальные — по фото.
+face_gallery_reencoder = GalleryReencoder(
+    face_gallery_store,
+    face_encodings_db,
+    REFERENCE_PHOTOS_DIR,
+    FACE_REENCODE_DIR,
+    encode_reference_photo,
+    settings_fingerprint(FACE_CACHE_SETTINGS),
+    workers=FACE_REENCODE_WORKERS,
+    chips=face_chip_store,
+    encode_chip=encode_face_chip,
+    logger=logger,
+)
+
+
+def detect_and_encode_asset(image_data):
+    """
+    Лица фото из бэкапа: (рамки, кодировки); без бюджета — фон может не спешить.
+
+    Идет мимо face_result_cache и face_single_flight: проход по тысячам фото вытеснил бы
+    из кэша результаты загрузок, а его собственные записи больше никто не запросит.
+    """
+    image = decode_image_bytes(image_data)
+    if image is None:
+        raise ValueError('Не удалось декодировать изображение')
+    face_locations = detect_faces_optimized(image)
+    if not face_locations:
+        return [], []
+    face_encodings = face_worker_pool.face_encodings(image, face_locations, NUM_JITTERS, ENCODING_MODEL)
+    return face_locations, face_encodings or []
+
+
+def face_requests_in_progress():
+    stats = face_admission.stats()
+    return stats['active'] > 0 or stats['waiting'] > 0
+
+
+# Подсказки отметок по фото из бэкапов: сопоставление только с лицами устройства
+# владельца дерева; обработанные фото (по sha256) повторно не распознаются.
+face_backup_autotagger = BackupAutoTagger(
+    BASE_DIR / 'familyone.db',
+    BASE_DIR,
+    face_encodings_db,
+    detect_and_encode_asset,
+    settings_fingerprint(FACE_CACHE_SETTINGS),
+    threshold=DEFAULT_MATCH_THRESHOLD,
+    margin=MATCH_MARGIN,
+    workers=FACE_AUTOTAG_WORKERS,
+    busy=face_requests_in_progress,
+    logger=logger,
+)
+
+
+def run_face_autotag_schedule(interval_sec):
+    """Периодический запуск автоотметок (поток-демон)"""
+    while True:
+        time.sleep(interval_sec)
+        if face_backup_autotagger.running:
+            continue
+        try:
+            face_backup_autotagger.start()
+        except Exception as exc:
+            logger.warning("Автоотметки по бэкапам не запущены: %s", exc)
+
+
 @app.route('/api/register_face', methods=['POST'])
 @app.route('/register_face', methods=['POST'])
+@face_admission.guard(face_overloaded_response)
 def register_face():
     """
     Регистрация эталонного фото члена семьи
@@ -1844,38 +2623,61 @@ def register_face():
     Параметры:
     - member_id: ID члена семьи
     - member_name: Имя члена семьи
-    - image: base64 изображение
+    - image: base64 изображение (JSON) или файл (multipart/form-data);
+      либо файл телом запроса image/* с параметрами в query string
+    - budget_ms: бюджет времени на fallback-детекцию (опционально, или заголовок X-Face-Budget-Ms)
+    - async: 1 — ответ 202 с job_id сразу после детекции, кодирование в фоне
+      (или заголовок Prefer: respond-async); статус — GET /api/register_face/jobs/<job_id>
     """
     if not FACE_RECOGNITION_AVAILABLE:
         return face_recognition_unavailable_response()
 
     try:
-        data = request.get_json(silent=True) or {}
+        data, image_data, image_present = read_face_upload()
         member_id = str(data.get('member_id', '')).strip()
         member_name = str(data.get('member_name', '')).strip()
-        image_base64 = data.get('image')
 
-        if not all([member_id, member_name, image_base64]):
+        if not all([member_id, member_name, image_present]):
             return make_response_json({
                 'success': False,
                 'error': 'Отсутствуют обязательные параметры'
             }, 400)
 
+        try:
+            budget_ms = resolve_detection_budget_ms(data)
+        except (TypeError, ValueError):
+            return invalid_budget_response()
+
         # Декодируем изображение
-        image = decode_base64_image(image_base64)
+        image = decode_image_bytes(image_data) if image_data is not None else None
         if image is None:
             return make_response_json({
                 'success': False,
                 'error': 'Не удалось декодировать изображение'
             }, 400)
 
-        # Находим лица на изображении (используем оптимизированную функцию)
-        face_locations = detect_faces_optimized(image)
+        # Находим лица и получаем кодировку (повторная загрузка того же файла берется из кэша).
+        # При регистрации эталона используем повышенное число jitters и модель 'large'
+        # (68-точечная) — точность лучше, а стоит это только один раз на человека.
+        # Дайджест сжатого файла считается один раз: ключ кэша и image_hash эталона
+        image_digest = content_digest(image_data)
+        detection_report = {}
+        image, face_locations, face_encodings = locate_and_encode_faces(
+            image_data,
+            REGISTER_JITTERS,
+            image=image,
+            max_faces=1,
+            budget_ms=budget_ms,
+            report=detection_report,
+            image_digest=image_digest,
+            encode=not wants_async_registration(data)
+        )
 
         if len(face_locations) == 0:
             return make_response_json({
                 'success': False,
-                'error': 'На фото не обнаружено лиц'
+                'error': 'На фото не обнаружено лиц',
+                'detection': detection_report
             }, 400)
 
         if len(face_locations) > 1:
@@ -1884,88 +2686,56 @@ def register_face():
                 'error': 'На фото обнаружено несколько лиц. Используйте фото с одним человеком'
             }, 400)
 
-        # Получаем кодировку лица. При регистрации эталона используем
-        # повышенное число jitters и модель 'large' (68-точечная) — точность
-        # лучше, а стоит это только один раз на человека.
-        face_encodings = face_recognition.face_encodings(
-            image,
-            face_locations,
-            num_jitters=REGISTER_JITTERS,
-            model=ENCODING_MODEL
-        )
+        if face_encodings is None:
+            # Асинхронный режим: кодирование и запись в галерею — в фоновой задаче
+            try:
+                job = face_register_jobs.submit(
+                    run_face_registration_job,
+                    member_id,
+                    member_name,
+                    image_data,
+                    face_locations,
+                    image_digest,
+                    meta={'member_id': member_id, 'member_name': member_name}
+                )
+            except FaceJobQueueFull:
+                return make_response_json({
+                    'success': False,
+                    'error': 'Очередь регистрации заполнена, попробуйте позже'
+                }, 503)
+            status_url = f"/api/register_face/jobs/{job['job_id']}"
+            logger.info(f"Регистрация {member_name} (ID: {member_id}) поставлена в очередь: {job['job_id']}")
+            response = make_response_json({
+                'success': True,
+                'status': job['status'],
+                'job_id': job['job_id'],
+                'status_url': status_url,
+                'member_id': member_id,
+                'detection': detection_report
+            }, 202)
+            response.headers['Location'] = status_url
+            return response
 
-        if len(face_encodings) == 0:
+        if not face_encodings:
             return make_response_json({
                 'success': False,
                 'error': 'Не удалось получить кодировку лица'
             }, 400)
 
-        image_hash = get_face_image_sha256(image)
-        duplicate = find_existing_face_duplicate(
-            member_id=member_id,
-            member_name=member_name,
-            image_hash=image_hash,
-            face_encoding=face_encodings[0]
+        payload = commit_face_registration(
+            member_id,
+            member_name,
+            image,
+            face_encodings[0],
+            upload_image_hash(image_digest),
+            face_location=face_locations[0]
         )
-        if duplicate is not None:
-            old_id = duplicate['member_id']
-            # Если дубликат найден под ДРУГИМ member_id — перерегистрируем под новым
-            if str(old_id) != str(member_id):
-                logger.info(
-                    "Перерегистрация лица: old_id=%s -> new_id=%s (reason=%s)",
-                    old_id, member_id, duplicate['reason']
-                )
-                # Удаляем старую запись
-                face_encodings_db.pop(old_id, None)
-                old_photo = os.path.join(REFERENCE_PHOTOS_DIR, f"{old_id}.jpg")
-                if os.path.exists(old_photo):
-                    try:
-                        os.remove(old_photo)
-                    except OSError:
-                        pass
-                # Продолжаем регистрацию под новым member_id (не return)
-            else:
-                # Тот же member_id — реальный дубликат, обновляем кодировку
-                face_encodings_db[member_id] = {
-                    'name': member_name,
-                    'encoding': face_encodings[0],
-                    'image_hash': image_hash
-                }
-                save_encodings()
-                logger.info(
-                    "Обновлена кодировка для %s (ID: %s)",
-                    member_name, member_id
-                )
-                return make_response_json({
-                    'success': True,
-                    'message': f"Кодировка обновлена для {member_name}",
-                    'member_id': member_id,
-                    'duplicate': True,
-                    'duplicate_reason': duplicate['reason']
-                })
-
-        # Сохраняем кодировку
-        face_encodings_db[member_id] = {
-            'name': member_name,
-            'encoding': face_encodings[0],
-            'image_hash': image_hash
-        }
-
-        # Сохраняем эталонное фото
-        photo_path = os.path.join(REFERENCE_PHOTOS_DIR, f"{member_id}.jpg")
-        Image.fromarray(image).save(photo_path)
-
-        # Сохраняем в файл
-        save_encodings()
-
-        logger.info(f"Зарегистрировано лицо для {member_name} (ID: {member_id})")
-
-        return make_response_json({
-            'success': True,
-            'message': f'Лицо {member_name} успешно зарегистрировано',
-            'member_id': member_id
-        })
+        payload['detection'] = detection_report
+        return make_response_json(payload)
 
+    except FaceWorkerTimeout as e:
+        logger.error(f"Таймаут регистрации лица: {e}")
+        return face_worker_timeout_response()
     except Exception as e:
         logger.error(f"Ошибка регистрации лица: {e}")
         return make_response_json({
@@ -1974,28 +2744,46 @@ def register_face():
         }, 500)
 
 
+@app.route('/api/register_face/jobs/<job_id>', methods=['GET'])
+@app.route('/register_face/jobs/<job_id>', methods=['GET'])
+def register_face_job_status(job_id):
+    """
+    Статус асинхронной регистрации: queued, running, done (result — ответ регистрации)
+    или failed (error). Завершенные задачи хранятся FACE_REGISTER_JOB_KEEP_SEC секунд.
+    """
+    job = face_register_jobs.get(job_id)
+    if job is None:
+        return make_response_json({
+            'success': False,
+            'error': 'Задача регистрации не найдена'
+        }, 404)
+    return make_response_json({'success': True, **job})
+
+
 @app.route('/api/recognize_face', methods=['POST'])
 @app.route('/recognize_face', methods=['POST'])
+@face_admission.guard(face_overloaded_response)
 def recognize_face():
     """
     Распознавание лица на фото
 
     Параметры:
-    - image: base64 изображение
+    - image: base64 изображение (JSON) или файл (multipart/form-data);
+      либо файл телом запроса image/* с параметрами в query string
     - threshold: порог совпадения (по умолчанию 0.6)
     - device_id: ID устройства для ограничения распознавания только своими членами (опционально)
+    - budget_ms: бюджет времени на fallback-детекцию (опционально, или заголовок X-Face-Budget-Ms)
     """
     if not FACE_RECOGNITION_AVAILABLE:
         return face_recognition_unavailable_response()
 
     try:
-        data = request.json or {}
-        image_base64 = data.get('image')
+        data, image_data, image_present = read_face_upload()
         threshold = data.get('threshold', 0.6)
         raw_device_id = data.get('device_id')
         device_id = normalize_device_id(raw_device_id)
 
-        if not image_base64:
+        if not image_present:
             return make_response_json({
                 'success': False,
                 'error': 'Отсутствует изображение'
@@ -2013,39 +2801,43 @@ def recognize_face():
                 'error': 'Нет зарегистрированных лиц'
             }, 400)
 
-        # Декодируем изображение
-        image = decode_base64_image(image_base64)
-        if image is None:
+        try:
+            budget_ms = resolve_detection_budget_ms(data)
+        except (TypeError, ValueError):
+            return invalid_budget_response()
+
+        # Находим лица и получаем кодировки всех лиц на фото. Для распознавания используем
+        # ту же модель (large), что и для регистрации, иначе дескрипторы будут несопоставимы.
+        # Повторное распознавание того же файла берется из кэша без декодирования.
+        face_locations, face_encodings = None, None
+        detection_report = {}
+        if image_data is not None:
+            _, face_locations, face_encodings = locate_and_encode_faces(
+                image_data,
+                NUM_JITTERS,
+                budget_ms=budget_ms,
+                report=detection_report
+            )
+        if face_locations is None:
             return make_response_json({
                 'success': False,
                 'error': 'Не удалось декодировать изображение'
             }, 400)
 
-        # Находим лица на изображении (используем оптимизированную функцию)
-        face_locations = detect_faces_optimized(image)
-
         if len(face_locations) == 0:
             return make_response_json({
                 'success': False,
-                'error': 'На фото не обнаружено лиц'
+                'error': 'На фото не обнаружено лиц',
+                'detection': detection_report
             }, 400)
 
-        # Получаем кодировки всех лиц на фото. Для распознавания используем
-        # ту же модель (large), что и для регистрации, иначе дескрипторы
-        # будут несопоставимы.
-        face_encodings = face_recognition.face_encodings(
-            image,
-            face_locations,
-            num_jitters=NUM_JITTERS,
-            model=ENCODING_MODEL
-        )
-
-        # Результаты распознавания
-        results = []
+        # Получаем известные кодировки (с учетом scope по устройству, если передан device_id).
+        # Снимок галереи фиксируется один раз: номера строк поиска относятся к нему,
+        # параллельные регистрации и удаления его не меняют.
+        gallery = face_encodings_db.snapshot()
+        scope_rows, known_count = get_gallery_scope_rows(gallery, device_id)
 
-        # Получаем известные кодировки (с учетом scope по устройству, если передан device_id)
-        known_faces = get_known_faces_for_device_scope(device_id)
-        if len(known_faces) == 0:
+        if known_count == 0:
             return make_response_json({
                 'success': False,
                 'error': 'Нет зарегистрированных лиц для текущего пользователя'
@@ -2055,63 +2847,26 @@ def recognize_face():
             logger.info(
                 "Распознавание с ограничением device_id=%s: %s лиц из %s",
                 device_id,
-                len(known_faces),
-                len(face_encodings_db)
+                known_count,
+                len(gallery)
             )
 
-        known_encodings = [info['encoding'] for _, info in known_faces]
-        known_ids = [str(member_id) for member_id, _ in known_faces]
-        known_names = [info['name'] for _, info in known_faces]
-
         # Используем порог клиента, но не больше жёсткого серверного порога
         effective_threshold = min(float(threshold), DEFAULT_MATCH_THRESHOLD)
 
-        # Проверяем каждое лицо на фото
-        for face_encoding, face_location in zip(face_encodings, face_locations):
-            face_distances = face_recognition.face_distance(known_encodings, face_encoding)
-            if len(face_distances) == 0:
-                continue
-
-            sorted_idx = np.argsort(face_distances)
-            best_idx = int(sorted_idx[0])
-            best_distance = float(face_distances[best_idx])
-
-            # Второй кандидат для проверки отрыва.
-            second_distance = float(face_distances[int(sorted_idx[1])]) if len(sorted_idx) > 1 else 1.0
+        # Все лица на фото сравниваются со всей галереей (или с кластерами IVF) одним
+        # матричным умножением, для каждого лица берутся два ближайших кандидата.
+        search_result = search_face_gallery(gallery, face_encodings, scope_rows)
 
-            # Основной критерий: дистанция ниже порога.
-            if best_distance > effective_threshold:
-                continue
-
-            # Margin-check: если второй кандидат почти так же близок — результат
-            # ненадёжен, пропускаем чтобы не вводить пользователя в заблуждение.
-            margin = second_distance - best_distance
-            ambiguous = margin < MATCH_MARGIN
-
-            member_id = known_ids[best_idx]
-            member_name = known_names[best_idx]
-            confidence = 1 - best_distance
-
-            results.append({
-                'member_id': member_id,
-                'member_name': member_name,
-                'confidence': float(confidence),
-                'distance': best_distance,
-                'margin': float(margin),
-                'ambiguous': bool(ambiguous),
-                'location': {
-                    'top': face_location[0],
-                    'right': face_location[1],
-                    'bottom': face_location[2],
-                    'left': face_location[3]
-                }
-            })
+        # Проверяем каждое лицо на фото
+        results = resolve_face_matches(gallery, search_result, face_locations[:len(face_encodings)], effective_threshold)
 
         if len(results) == 0:
             return make_response_json({
                 'success': False,
                 'error': 'Лица не распознаны. Возможно, этих людей нет в базе',
-                'faces_found': len(face_locations)
+                'faces_found': len(face_locations),
+                'detection': detection_report
             })
 
         logger.info(f"Распознано {len(results)} лиц")
@@ -2120,9 +2875,13 @@ def recognize_face():
             'success': True,
             'faces_count': len(face_locations),
             'recognized_count': len(results),
-            'results': results
+            'results': results,
+            'detection': detection_report
         })
 
+    except FaceWorkerTimeout as e:
+        logger.error(f"Таймаут распознавания: {e}")
+        return face_worker_timeout_response()
     except Exception as e:
         logger.error(f"Ошибка распознавания: {e}")
         return make_response_json({
@@ -2131,6 +2890,189 @@ def recognize_face():
         }, 500)
 
 
+@app.route('/api/recognize_faces_batch', methods=['POST'])
+@app.route('/recognize_faces_batch', methods=['POST'])
+@face_admission.guard(face_overloaded_response)
+def recognize_faces_batch():
+    """
+    Пакетное распознавание лиц на нескольких фото за один запрос
+
+    Параметры (application/json):
+    - images: список base64 изображений или объектов {"id": ..., "image": base64}
+    - threshold, device_id: как в /api/recognize_face
+
+    Параметры (multipart/form-data):
+    - images: файлы изображений (id = имя файла)
+    - threshold, device_id: поля формы
+    """
+    if not FACE_RECOGNITION_AVAILABLE:
+        return face_recognition_unavailable_response()
+
+    try:
+        items = []
+        if request.files:
+            params = request.form
+            uploads = request.files.getlist('images') or request.files.getlist('image')
+            for index, upload in enumerate(uploads):
+                items.append({'id': upload.filename or str(index), 'bytes': upload.read()})
+        else:
+            params = request.get_json(silent=True) or {}
+            raw_images = params.get('images')
+            if not isinstance(raw_images, list):
+                raw_images = []
+            for index, raw_item in enumerate(raw_images):
+                if isinstance(raw_item, dict):
+                    items.append({'id': str(raw_item.get('id', index)), 'base64': raw_item.get('image')})
+                else:
+                    items.append({'id': str(index), 'base64': raw_item})
+
+        threshold = params.get('threshold', 0.6)
+        raw_device_id = params.get('device_id')
+        device_id = normalize_device_id(raw_device_id)
+
+        if len(items) == 0:
+            return make_response_json({
+                'success': False,
+                'error': 'Отсутствуют изображения'
+            }, 400)
+
+        if len(items) > FACE_BATCH_MAX_IMAGES:
+            return make_response_json({
+                'success': False,
+                'error': f'Слишком много изображений в запросе (максимум {FACE_BATCH_MAX_IMAGES})'
+            }, 413)
+
+        if raw_device_id is not None and not device_id:
+            return make_response_json({
+                'success': False,
+                'error': 'Некорректный device_id'
+            }, 400)
+
+        gallery = face_encodings_db.snapshot()
+        scope_rows, known_count = get_gallery_scope_rows(gallery, device_id)
+        if known_count == 0:
+            return make_response_json({
+                'success': False,
+                'error': 'Нет зарегистрированных лиц для текущего пользователя'
+            }, 400)
+
+        def item_bytes(item):
+            if 'bytes' in item:
+                return item['bytes']
+            if not isinstance(item.get('base64'), str) or not item['base64']:
+                return None
+            return decode_base64_bytes(item['base64'])
+
+        start_time = time.time()
+        payloads = [item_bytes(item) for item in items]
+        digests = [content_digest(payload) if payload is not None else None for payload in payloads]
+
+        # Уже виденные файлы берутся из кэша без декодирования, детекции и кодирования
+        face_locations_by_item = {}
+        encodings_by_item = {}
+        for index, image_digest in enumerate(digests):
+            if image_digest is None:
+                continue
+            cached_locations, cached_encodings = face_result_cache.lookup(image_digest, ENCODING_MODEL, NUM_JITTERS)
+            if cached_locations is not None:
+                face_locations_by_item[index] = cached_locations
+            if cached_encodings is not None:
+                encodings_by_item[index] = cached_encodings
+
+        def decode_item(index):
+            if payloads[index] is None:
+                return None
+            cached_locations = face_locations_by_item.get(index)
+            if cached_locations is not None and (len(cached_locations) == 0 or index in encodings_by_item):
+                return None
+            return decode_image_bytes(payloads[index])
+
+        # Декодирование параллельно: Pillow отпускает GIL при разборе JPEG/PNG
+        with ThreadPoolExecutor(max_workers=min(FACE_BATCH_DECODE_WORKERS, len(items))) as executor:
+            images = list(executor.map(decode_item, range(len(items))))
+        decode_time = time.time() - start_time
+
+        detect_indexes = [
+            index for index, image in enumerate(images)
+            if image is not None and index not in face_locations_by_item
+        ]
+        batch_locations = detect_faces_batch([images[index] for index in detect_indexes])
+        for index, face_locations in zip(detect_indexes, batch_locations):
+            face_locations_by_item[index] = face_locations
+            face_result_cache.put_locations(digests[index], face_locations)
+
+        for index, face_locations in face_locations_by_item.items():
+            if len(face_locations) == 0 or index in encodings_by_item or images[index] is None:
+                continue
+            encodings_by_item[index] = face_worker_pool.face_encodings(
+                images[index],
+                face_locations,
+                NUM_JITTERS,
+                ENCODING_MODEL
+            )
+            face_result_cache.put_encodings(digests[index], ENCODING_MODEL, NUM_JITTERS, encodings_by_item[index])
+
+        # Все лица со всех фото сравниваются с галереей одним матричным умножением
+        offsets = {}
+        all_encodings = []
+        for index, face_encodings in encodings_by_item.items():
+            offsets[index] = len(all_encodings)
+            all_encodings.extend(face_encodings)
+        search_result = search_face_gallery(
+            gallery,
+            np.asarray(all_encodings, dtype=np.float32).reshape(-1, 128),
+            scope_rows
+        )
+
+        effective_threshold = min(float(threshold), DEFAULT_MATCH_THRESHOLD)
+        response_items = []
+        recognized_images = 0
+        for index, item in enumerate(items):
+            entry = {'index': index, 'id': item['id']}
+            if index not in face_locations_by_item:
+                entry.update({'success': False, 'error': 'Не удалось декодировать изображение'})
+            elif index not in encodings_by_item:
+                entry.update({'success': False, 'error': 'На фото не обнаружено лиц', 'faces_count': 0})
+            else:
+                face_encodings = encodings_by_item[index]
+                face_locations = face_locations_by_item[index][:len(face_encodings)]
+                results = resolve_face_matches(
+                    gallery, search_result, face_locations, effective_threshold, offset=offsets[index]
+                )
+                entry.update({
+                    'success': len(results) > 0,
+                    'faces_count': len(face_locations_by_item[index]),
+                    'recognized_count': len(results),
+                    'results': results
+                })
+                if results:
+                    recognized_images += 1
+            response_items.append(entry)
+
+        logger.info(
+            f"Пакетное распознавание: фото={len(items)}, распознано на {recognized_images}, "
+            f"лиц={len(all_encodings)}, декодирование={decode_time:.3f}s, "
+            f"всего={time.time() - start_time:.3f}s"
+        )
+
+        return make_response_json({
+            'success': True,
+            'images_count': len(items),
+            'recognized_images': recognized_images,
+            'items': response_items
+        })
+
+    except FaceWorkerTimeout as e:
+        logger.error(f"Таймаут пакетного распознавания: {e}")
+        return face_worker_timeout_response()
+    except Exception as e:
+        logger.error(f"Ошибка пакетного распознавания: {e}")
+        return make_response_json({
+            'success': False,
+            'error': str(e)
+        }, 500)
+
+
 @app.route('/api/delete_face/<member_id>', methods=['DELETE'])
 @app.route('/delete_face/<member_id>', methods=['DELETE'])
 def delete_face(member_id):
@@ -2142,17 +3084,15 @@ def delete_face(member_id):
                 'error': 'Член семьи не найден'
             }, 404)
 
-        # Удаляем из базы
-        del face_encodings_db[str(member_id)]
+        # Удаляем из базы (запись в журнал галереи)
+        delete_face_encodings([str(member_id)])
+        face_chip_store.delete([str(member_id)])
 
         # Удаляем файл фото
         photo_path = os.path.join(REFERENCE_PHOTOS_DIR, f"{member_id}.jpg")
         if os.path.exists(photo_path):
             os.remove(photo_path)
 
-        # Сохраняем изменения
-        save_encodings()
-
         logger.info(f"Удалено лицо для ID: {member_id}")
 
         return make_response_json({
@@ -2176,9 +3116,9 @@ def list_faces():
         faces = [
             {
                 'member_id': member_id,
-                'member_name': info['name']
+                'member_name': member_name
             }
-            for member_id, info in face_encodings_db.items()
+            for member_id, member_name in face_encodings_db.members()
         ]
 
         return make_response_json({
@@ -2199,7 +3139,6 @@ def list_faces():
 @app.route('/clear_all', methods=['DELETE'])
 def clear_all():
     """Очистка базы распознавания лиц (глобально или по device_id)"""
-    global face_encodings_db
     try:
         raw_device_id = request.args.get('device_id')
         if raw_device_id is None and request.is_json:
@@ -2216,18 +3155,17 @@ def clear_all():
         if not device_id:
             count = len(face_encodings_db)
 
-            # Очищаем базу в памяти
-            face_encodings_db = {}
-
-            # Удаляем файл кодировок
+            # Очищаем базу в памяти и удаляем снимок с журналом
+            face_gallery_store.reset(face_encodings_db)
             if os.path.exists(ENCODINGS_FILE):
                 os.remove(ENCODINGS_FILE)
 
-            # Удаляем все эталонные фото
+            # Удаляем все эталонные фото и лица
             for filename in os.listdir(REFERENCE_PHOTOS_DIR):
                 filepath = os.path.join(REFERENCE_PHOTOS_DIR, filename)
                 if os.path.isfile(filepath):
                     os.remove(filepath)
+            face_chip_store.clear()
 
             logger.info(f"База очищена глобально. Удалено {count} лиц")
 
@@ -2237,18 +3175,15 @@ def clear_all():
                 'deleted_count': count
             })
 
-        known_faces = get_known_faces_for_device_scope(device_id)
-        member_ids_to_remove = [str(member_id) for member_id, _ in known_faces]
+        member_ids_to_remove = [str(member_id) for member_id in get_known_faces_for_device_scope(device_id)]
 
+        delete_face_encodings(member_ids_to_remove)
+        face_chip_store.delete(member_ids_to_remove)
         for member_id in member_ids_to_remove:
-            if member_id in face_encodings_db:
-                del face_encodings_db[member_id]
             photo_path = os.path.join(REFERENCE_PHOTOS_DIR, f"{member_id}.jpg")
             if os.path.exists(photo_path):
                 os.remove(photo_path)
 
-        save_encodings()
-
         deleted_count = len(member_ids_to_remove)
         logger.info(
             "База очищена по device_id=%s. Удалено %s лиц",
@@ -3497,7 +4432,11 @@ def format_social_roles(member):
 # MAIN
 # ========================================
 
-if __name__ == '__main__':
+def main() -> None:
+    """Запуск сервера; вызывается из run_server.py"""
+    # Процессы face_workers (spawn) запускаются до потоков сервера
+    face_worker_pool.start()
+
     # Загружаем сохраненные кодировки при запуске
     load_encodings()
 
@@ -3506,6 +4445,17 @@ if __name__ == '__main__':
     logger.info(f"Combined Server запущен на {API_HOST}:{API_PORT}")
     logger.info("Face Recognition + PDF Generation")
     logger.info(f"Загружено {len(face_encodings_db)} лиц")
+    logger.info(
+        f"Face workers: processes={FACE_WORKER_PROCESSES}, timeout={FACE_WORKER_TIMEOUT_SEC}s"
+    )
+    logger.info(
+        f"Face ANN: enabled={FACE_ANN_ENABLED}, nlist={FACE_ANN_NLIST or 'auto'}, "
+        f"nprobe={FACE_ANN_NPROBE}, min_faces={FACE_ANN_MIN_FACES}"
+    )
+    logger.info(
+        f"Face cascade: adaptive={FACE_CASCADE_ADAPTIVE}, min_samples={FACE_CASCADE_MIN_SAMPLES}, "
+        f"min_hit_rate={FACE_CASCADE_MIN_HIT_RATE}, stats={FACE_CASCADE_STATS_FILE}"
+    )
     logger.info(
         f"CUDA: {'включен' if CUDA_ENABLED else 'выключен'} "
         f"(requested={USE_CUDA}, dlib_cuda={DLIB_USE_CUDA}, devices={CUDA_DEVICE_COUNT})"
@@ -3519,14 +4469,27 @@ if __name__ == '__main__':
     )
     logger.info("=" * 50)
 
+    if FACE_RECOGNITION_AVAILABLE and FACE_AUTOTAG_INTERVAL_MIN > 0:
+        threading.Thread(
+            target=run_face_autotag_schedule,
+            args=(FACE_AUTOTAG_INTERVAL_MIN * 60,),
+            name='face-autotag-schedule',
+            daemon=True,
+        ).start()
+        logger.info(f"Face autotag: каждые {FACE_AUTOTAG_INTERVAL_MIN} мин, workers={FACE_AUTOTAG_WORKERS}")
+
     # Используем waitress для production (решает проблему с ngrok)
     # Flask dev-server может блокировать ответы через ngrok
     try:
         from waitress import serve
         logger.info("Запуск через Waitress (production mode)")
-        serve(app, host=API_HOST, port=API_PORT, threads=8)
+        serve(app, host=API_HOST, port=API_PORT, threads=API_THREADS)
     except ImportError:
         logger.warning("Waitress не установлен, используем Flask dev-server")
         logger.warning("Для лучшей работы с ngrok: pip install waitress")
         app.run(host=API_HOST, port=API_PORT, debug=False)
+    finally:
+        face_register_jobs.shutdown()
+        face_worker_pool.shutdown()
+        face_cascade_stats.save()
 
@@ -0,0 +1,125 @@
+"""Tests for ``AdmissionLimiter``, the concurrency gate of the face endpoints."""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_admission import AdmissionLimiter, AdmissionRejected  # noqa: E402
+
+
+def _hold_slot(limiter: AdmissionLimiter, release: threading.Event) -> threading.Thread:
+    entered = threading.Event()
+
+    def hold() -> None:
+        with limiter.slot():
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    assert entered.wait(5)
+    return thread
+
+
+def test_rejects_when_queue_is_full() -> None:
+    limiter = AdmissionLimiter(1, max_queue=0)
+    release = threading.Event()
+    holder = _hold_slot(limiter, release)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        limiter.acquire()
+    assert rejected.value.reason == 'queue_full'
+    assert rejected.value.retry_after >= 1
+
+    release.set()
+    holder.join(5)
+    with limiter.slot() as waited:
+        assert waited == 0.0
+    stats = limiter.stats()
+    assert stats['rejected_queue_full'] == 1
+    assert stats['admitted'] == 2 and stats['active'] == 0
+
+
+def test_waiter_gets_the_released_slot() -> None:
+    limiter = AdmissionLimiter(1, max_queue=1, max_wait_sec=5)
+    release = threading.Event()
+    holder = _hold_slot(limiter, release)
+
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(limiter.acquire()))
+    waiter.start()
+    while limiter.stats()['waiting'] == 0:
+        time.sleep(0.005)
+    with pytest.raises(AdmissionRejected):
+        limiter.acquire()  # one waiter already fills the queue
+
+    release.set()
+    holder.join(5)
+    waiter.join(5)
+    assert admitted and admitted[0] > 0
+    stats = limiter.stats()
+    assert stats['active'] == 1 and stats['waiting'] == 0
+    assert stats['queued'] == 1 and stats['peak_waiting'] == 1
+    limiter.release()
+    assert limiter.stats()['active'] == 0
+
+
+def test_waiter_times_out() -> None:
+    limiter = AdmissionLimiter(1, max_queue=4, max_wait_sec=0.05)
+    release = threading.Event()
+    holder = _hold_slot(limiter, release)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        limiter.acquire()
+    assert rejected.value.reason == 'timeout'
+    assert limiter.stats()['waiting'] == 0
+
+    release.set()
+    holder.join(5)
+    assert limiter.stats()['rejected_timeout'] == 1
+
+
+def test_guard_returns_refusal_and_never_exceeds_limit() -> None:
+    limiter = AdmissionLimiter(2, max_queue=0)
+    running = []
+    peak = []
+    gate = threading.Barrier(2)
+
+    @limiter.guard(lambda rejected: ('busy', rejected.retry_after))
+    def view() -> str:
+        running.append(1)
+        peak.append(len(running))
+        time.sleep(0.05)
+        running.pop()
+        return 'ok'
+
+    results = []
+
+    def call() -> None:
+        try:
+            gate.wait(1)
+        except threading.BrokenBarrierError:
+            pass
+        results.append(view())
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while limiter.stats()['active'] < 2:
+        time.sleep(0.002)
+    refused = view()
+    for thread in threads:
+        thread.join(5)
+
+    assert refused[0] == 'busy' and refused[1] >= 1
+    assert results == ['ok', 'ok'] and max(peak) <= 2
+    assert limiter.stats()['hold_avg_ms'] > 0
@@ -0,0 +1,134 @@
+"""Tests for the IVF approximate index behind ``FaceGallery.search(approximate=True)``."""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_ann import IVFIndex, kmeans  # noqa: E402
+from face_gallery import FaceGallery, FaceGalleryStore  # noqa: E402
+
+
+def _clustered_encodings(identities: int, per_identity: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0.0, 0.056, size=(identities, 128))
+    samples = centers[:, None, :] + rng.normal(0.0, 0.02, size=(identities, per_identity, 128))
+    return samples.reshape(-1, 128).astype(np.float32)
+
+
+def _trained_gallery(encodings: np.ndarray, **index_options) -> FaceGallery:
+    index = IVFIndex(min_train_size=1, **index_options)
+    gallery = FaceGallery(initial_capacity=4, ann=index)
+    for row, encoding in enumerate(encodings):
+        gallery.upsert(f'm{row}', f'Name {row}', encoding)
+    gallery.install_index(index.fit(gallery.export()[0]))
+    return gallery
+
+
+def _cell_sets(gallery: FaceGallery) -> list[set[int]]:
+    return [set(cell.tolist()) for cell in gallery.snapshot().ann_state.cells]
+
+
+def test_kmeans_separates_well_spread_clusters() -> None:
+    data = np.concatenate([
+        np.full((20, 128), -1.0, dtype=np.float32),
+        np.full((20, 128), 1.0, dtype=np.float32),
+    ])
+    centroids = kmeans(data, 2, seed=3)
+    assert sorted(np.round(centroids[:, 0]).tolist()) == [-1.0, 1.0]
+
+
+def test_full_probe_search_equals_exact_search() -> None:
+    encodings = _clustered_encodings(60, 4)
+    gallery = _trained_gallery(encodings, nlist=16)
+    queries = _clustered_encodings(60, 1, seed=1)[:10]
+
+    exact = gallery.search(queries, k=2)
+    approximate = gallery.search(queries, k=2, approximate=True, nprobe=16)
+    np.testing.assert_array_equal(approximate.rows, exact.rows)
+    np.testing.assert_allclose(approximate.distances, exact.distances)
+
+
+def test_shortlist_distances_are_exact() -> None:
+    encodings = _clustered_encodings(60, 4)
+    gallery = _trained_gallery(encodings, nlist=16, nprobe=2)
+    queries = encodings[:5] + 0.001
+
+    result = gallery.search(queries, k=2, approximate=True)
+    matrix = gallery.export()[0]
+    for face, rows in enumerate(result.rows):
+        expected = np.linalg.norm(matrix[rows] - queries[face], axis=1)
+        np.testing.assert_allclose(result.distances[face], expected, rtol=1e-4, atol=1e-5)
+    # A query next to a stored face finds that face in its own cell.
+    assert result.rows[:, 0].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_incremental_updates_match_a_fresh_assignment() -> None:
+    encodings = _clustered_encodings(40, 3)
+    gallery = _trained_gallery(encodings[:60], nlist=8)
+    for row in range(60, len(encodings)):
+        gallery.upsert(f'm{row}', f'Name {row}', encodings[row])
+    for row in range(0, 60, 7):
+        gallery.remove(f'm{row}')
+    gallery.upsert('m1', 'Name 1', encodings[-1])
+
+    centroids = gallery.snapshot().ann_state.centroids
+    incremental = _cell_sets(gallery)
+    gallery.install_index(centroids)
+    assert _cell_sets(gallery) == incremental
+    assert sum(len(cell) for cell in incremental) == len(gallery)
+
+
+def test_untrained_index_falls_back_to_exact_search() -> None:
+    gallery = FaceGallery(ann=IVFIndex(min_train_size=10_000))
+    encodings = _clustered_encodings(10, 2)
+    for row, encoding in enumerate(encodings):
+        gallery.upsert(f'm{row}', '', encoding)
+
+    exact = gallery.search(encodings[:3], k=2)
+    approximate = gallery.search(encodings[:3], k=2, approximate=True, nprobe=1)
+    np.testing.assert_array_equal(approximate.rows, exact.rows)
+    assert gallery.ann_stats()['trained'] is False
+
+
+def test_store_trains_index_after_load_and_on_growth(tmp_path: Path) -> None:
+    encodings = _clustered_encodings(30, 4)
+    store = FaceGalleryStore(tmp_path, fsync_journal=False)
+    writer = FaceGallery()
+    for row, encoding in enumerate(encodings[:50]):
+        writer.upsert(f'm{row}', '', encoding)
+    store.save(writer)
+
+    gallery = FaceGallery(ann=IVFIndex(min_train_size=40, retrain_growth=2.0, nlist=4))
+    store.load_into(gallery)
+    store.wait_for_index(5)
+    assert gallery.ann_stats()['trained_size'] == 50
+
+    for row in range(50, len(encodings)):
+        store.put(gallery, f'm{row}', '', encodings[row])
+    store.wait_for_index(5)
+    stats = gallery.ann_stats()
+    assert stats['trained_size'] >= 100
+    assert stats['rows'] == len(gallery) == len(encodings)
+
+
+def test_pinned_snapshot_keeps_its_inverted_lists() -> None:
+    encodings = _clustered_encodings(20, 3)
+    gallery = _trained_gallery(encodings, nlist=4)
+    pinned = gallery.snapshot()
+    before = [cell.copy() for cell in pinned.ann_state.cells]
+
+    gallery.remove('m0')
+    gallery.upsert('m1', 'Name 1', encodings[-1])
+    gallery.upsert('new', '', encodings[5])
+
+    for cell, expected in zip(pinned.ann_state.cells, before):
+        np.testing.assert_array_equal(cell, expected)
+    full = pinned.search(encodings[:4], k=1, approximate=True, nprobe=4)
+    assert full.rows[:, 0].tolist() == [0, 1, 2, 3]
@@ -0,0 +1,338 @@
+"""Tests for the backup photo auto-tagging (``face_autotag.BackupAutoTagger``)."""
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import sqlite3
+import sys
+import threading
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_autotag import BackupAutoTagger  # noqa: E402
+from face_gallery import FaceGallery  # noqa: E402
+from sql_repository import db_connect, run_migrations  # noqa: E402
+
+
+_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, display_name VARCHAR(255) NOT NULL);
+CREATE TABLE family_trees (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE TABLE user_settings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL UNIQUE REFERENCES users(id) ON DELETE CASCADE,
+    device_id INTEGER
+);
+CREATE TABLE backup_snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tree_id INTEGER NOT NULL REFERENCES family_trees(id) ON DELETE CASCADE,
+    storage_path TEXT NOT NULL
+);
+CREATE TABLE persons (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tree_id INTEGER NOT NULL REFERENCES family_trees(id) ON DELETE CASCADE,
+    first_name VARCHAR(255) NOT NULL,
+    last_name VARCHAR(255) NOT NULL,
+    patronymic VARCHAR(255),
+    gender VARCHAR(32) NOT NULL,
+    birth_date VARCHAR(32) NOT NULL,
+    death_date VARCHAR(32),
+    maiden_name VARCHAR(255),
+    family_role VARCHAR(64) NOT NULL,
+    social_roles TEXT,
+    notes TEXT,
+    photo_uri TEXT,
+    wedding_date VARCHAR(32),
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE TABLE photos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tree_id INTEGER NOT NULL REFERENCES family_trees(id) ON DELETE CASCADE,
+    owner_person_id INTEGER REFERENCES persons(id) ON DELETE SET NULL,
+    uploaded_by_user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    storage_path TEXT NOT NULL,
+    sha256 VARCHAR(128),
+    image_hash VARCHAR(128),
+    description TEXT,
+    taken_at DATETIME,
+    date_added_ms INTEGER NOT NULL,
+    is_profile_photo BOOLEAN NOT NULL,
+    source VARCHAR(32) NOT NULL,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE TABLE photo_person_tags (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    photo_id INTEGER NOT NULL REFERENCES photos(id) ON DELETE CASCADE,
+    person_id INTEGER NOT NULL REFERENCES persons(id) ON DELETE CASCADE,
+    tagged_by_user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    source VARCHAR(32) NOT NULL,
+    confidence REAL,
+    bbox_json TEXT,
+    created_at DATETIME NOT NULL,
+    UNIQUE (photo_id, person_id)
+);
+CREATE TABLE face_encodings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    person_id INTEGER NOT NULL REFERENCES persons(id) ON DELETE CASCADE,
+    photo_id INTEGER REFERENCES photos(id) ON DELETE SET NULL,
+    external_member_id VARCHAR(128),
+    model_version VARCHAR(64) NOT NULL,
+    encoding_payload BLOB,
+    reference_photo_path TEXT,
+    is_active BOOLEAN NOT NULL,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+"""
+
+_DEVICE = 7
+_IVAN = f'fo1_{_DEVICE}_a83a3bbbb5821514'
+_ANNA = str(_DEVICE * 1_000_000 + 2)
+_MEMBERS = [
+    {'backupMemberKey': 'member_1', 'firstName': 'Иван', 'lastName': 'Петров', 'patronymic': 'Сергеевич',
+     'gender': 'MALE', 'birthDate': '1950-01-02', 'role': 'GRANDFATHER'},
+    {'backupMemberKey': 'member_2', 'firstName': 'Анна', 'lastName': 'Петрова', 'patronymic': None,
+     'gender': 'FEMALE', 'birthDate': '1952-03-04', 'role': 'GRANDMOTHER'},
+]
+
+
+def _face(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).normal(0.0, 0.09, 128).astype(np.float32)
+
+
+def _device_key(member_id: str) -> str:
+    """Device partition as in telegram_service: ``fo1_<device>_<hash>`` or legacy numeric ids."""
+    parts = member_id.split('_')
+    if len(parts) == 3 and parts[0] == 'fo1':
+        return parts[1]
+    return str(int(member_id) // 1_000_000) if member_id.isdigit() else ''
+
+
+def _setup(
+    tmp_path: Path,
+    photos: int = 4,
+    mapped: tuple[str, ...] = (_IVAN, _ANNA),
+) -> tuple[Path, FaceGallery, dict[bytes, list[int]]]:
+    """DB with one owned tree, its stored backup and the owner's gallery partition.
+
+    Photo ``i`` shows member 1 when ``i`` is even, member 2 when ``i % 3 == 0``
+    and nobody else, so both the gallery match and "no face" paths are used.
+    The gallery ids in ``mapped`` are linked to persons of the tree.
+    """
+    db_path = tmp_path / 'familyone.db'
+    connection = db_connect(db_path)
+    connection.executescript(_SCHEMA)
+    connection.execute("INSERT INTO users (display_name) VALUES ('alice')")
+    connection.execute('INSERT INTO family_trees (owner_user_id) VALUES (1)')
+    connection.execute('INSERT INTO user_settings (user_id, device_id) VALUES (1, ?)', (_DEVICE,))
+    connection.execute("INSERT INTO backup_snapshots (tree_id, storage_path) VALUES (1, 'backups/1/latest.zip')")
+    for member_id, record in ((_IVAN, _MEMBERS[0]), (_ANNA, _MEMBERS[1])):
+        if member_id not in mapped:
+            continue
+        cursor = connection.execute(
+            """
+            INSERT INTO persons (tree_id, first_name, last_name, gender, birth_date, family_role, created_at, updated_at)
+            VALUES (1, ?, ?, ?, ?, ?, '2026-01-01', '2026-01-01')
+            """,
+            (record['firstName'], record['lastName'], record['gender'], record['birthDate'], record['role']),
+        )
+        connection.execute(
+            """
+            INSERT INTO face_encodings (person_id, external_member_id, model_version, is_active, created_at, updated_at)
+            VALUES (?, ?, 'face-recognition', 1, '2026-01-01', '2026-01-01')
+            """,
+            (cursor.lastrowid, member_id),
+        )
+    connection.commit()
+    connection.close()
+    run_migrations(db_path)
+
+    faces_by_photo: dict[bytes, list[int]] = {}
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('members.json', json.dumps(_MEMBERS))
+        photo_records = []
+        for index in range(photos):
+            data = f'photo-{index}'.encode()
+            digest = hashlib.sha256(data).hexdigest()
+            faces_by_photo[data] = [seed for seed, shown in ((1, index % 2 == 0), (2, index % 3 == 0)) if shown]
+            archive.writestr(f'assets/{digest}.jpg', data)
+            photo_records.append({'backupMemberKey': 'member_1', 'photoAssetId': digest, 'dateAdded': 1000 + index})
+        archive.writestr('member_photos.json', json.dumps(photo_records))
+    archive_path = tmp_path / 'backups' / '1' / 'latest.zip'
+    archive_path.parent.mkdir(parents=True)
+    archive_path.write_bytes(buffer.getvalue())
+
+    gallery = FaceGallery(partition_key=_device_key)
+    gallery.upsert(_IVAN, 'Иван', _face(1))
+    gallery.upsert(_ANNA, 'Анна', _face(2))
+    gallery.upsert('fo1_8_0000000000000001', 'Чужой', _face(1) + 0.001)
+    return db_path, gallery, faces_by_photo
+
+
+def _detector(faces_by_photo: dict[bytes, list[int]], calls: list[bytes] | None = None):
+    def detect_encode(data: bytes):
+        if calls is not None:
+            calls.append(data)
+        seeds = faces_by_photo[data]
+        locations = [(10, 60 + 50 * index, 60, 10 + 50 * index) for index in range(len(seeds))]
+        return locations, [_face(seed) for seed in seeds]
+    return detect_encode
+
+
+def _tagger(db_path: Path, gallery: FaceGallery, detect_encode, **kwargs) -> BackupAutoTagger:
+    kwargs.setdefault('workers', 2)
+    return BackupAutoTagger(db_path, db_path.parent, gallery, detect_encode, 'v1', threshold=0.5, margin=0.05, **kwargs)
+
+
+def _tags(db_path: Path) -> list[tuple[str, str, str]]:
+    connection = sqlite3.connect(str(db_path))
+    try:
+        return connection.execute(
+            """
+            SELECT ph.sha256, p.first_name, t.source
+            FROM photo_person_tags t
+            JOIN photos ph ON ph.id = t.photo_id
+            JOIN persons p ON p.id = t.person_id
+            ORDER BY ph.sha256, p.first_name
+            """
+        ).fetchall()
+    finally:
+        connection.close()
+
+
+def test_run_tags_owner_members_and_skips_scanned_assets(tmp_path: Path) -> None:
+    db_path, gallery, faces_by_photo = _setup(tmp_path, photos=4)
+    calls: list[bytes] = []
+    result = _tagger(db_path, gallery, _detector(faces_by_photo, calls)).run()
+
+    assert result['status'] == 'completed'
+    assert result['scanned'] == 4 and result['faces'] == 4 and result['tags'] == 4
+    expected = sorted(
+        (hashlib.sha256(data).hexdigest(), name, 'face_auto')
+        for data, seeds in faces_by_photo.items()
+        for name in (('Иван',) if 1 in seeds else ()) + (('Анна',) if 2 in seeds else ())
+    )
+    assert _tags(db_path) == expected
+
+    connection = sqlite3.connect(str(db_path))
+    try:
+        # Tags point at the mapped persons; the foreign-device member with the
+        # same face was never considered.
+        persons = connection.execute('SELECT COUNT(*) FROM persons').fetchone()[0]
+        photo = connection.execute(
+            'SELECT storage_path, date_added_ms, source FROM photos WHERE sha256 = ?',
+            (hashlib.sha256(b'photo-0').hexdigest(),),
+        ).fetchone()
+    finally:
+        connection.close()
+    assert persons == 2 and result['unmapped'] == 0
+    assert photo[0].startswith('backups/1/latest.zip!/assets/') and photo[1] == 1000 and photo[2] == 'backup'
+
+    calls.clear()
+    again = _tagger(db_path, gallery, _detector(faces_by_photo, calls)).run()
+    assert calls == []
+    assert again['already_scanned'] == 4 and again['scanned'] == 0
+    assert _tags(db_path) == expected
+
+
+def test_rematch_tags_members_registered_after_the_scan(tmp_path: Path) -> None:
+    db_path, gallery, faces_by_photo = _setup(tmp_path, photos=4)
+    gallery.remove(_ANNA)
+    _tagger(db_path, gallery, _detector(faces_by_photo)).run()
+    assert {name for _, name, _ in _tags(db_path)} == {'Иван'}
+
+    gallery.upsert(_ANNA, 'Анна', _face(2))
+    calls: list[bytes] = []
+    result = _tagger(db_path, gallery, _detector(faces_by_photo, calls)).run(rematch=True)
+    assert calls == []
+    assert result['rematched'] == 3
+    assert {name for _, name, _ in _tags(db_path)} == {'Иван', 'Анна'}
+
+
+def test_unmapped_members_are_counted_not_created(tmp_path: Path) -> None:
+    db_path, gallery, faces_by_photo = _setup(tmp_path, photos=4, mapped=(_IVAN,))
+    result = _tagger(db_path, gallery, _detector(faces_by_photo)).run()
+
+    assert result['faces'] == 4 and result['tags'] == 2 and result['unmapped'] == 2
+    assert {name for _, name, _ in _tags(db_path)} == {'Иван'}
+    connection = sqlite3.connect(str(db_path))
+    try:
+        assert connection.execute('SELECT COUNT(*) FROM persons').fetchone()[0] == 1
+        assert connection.execute('SELECT COUNT(*) FROM face_encodings').fetchone()[0] == 1
+    finally:
+        connection.close()
+
+
+def test_cancelled_run_resumes_with_remaining_assets(tmp_path: Path) -> None:
+    db_path, gallery, faces_by_photo = _setup(tmp_path, photos=8)
+    started = threading.Event()
+    gate = threading.Event()
+    first_calls: list[bytes] = []
+    detect = _detector(faces_by_photo, first_calls)
+
+    def slow_detect(data: bytes):
+        started.set()
+        gate.wait(5)
+        return detect(data)
+
+    tagger = _tagger(db_path, gallery, slow_detect, workers=1)
+    tagger.start()
+    assert started.wait(5)
+    assert tagger.cancel()
+    gate.set()
+    first = tagger.wait(5)
+    assert first['status'] == 'cancelled'
+    assert first['scanned'] == 1  # the photo in flight is finished and committed
+
+    second_calls: list[bytes] = []
+    second = _tagger(db_path, gallery, _detector(faces_by_photo, second_calls)).run()
+    assert second['status'] == 'completed'
+    assert second['already_scanned'] == first['scanned']
+    assert sorted(first_calls + second_calls) == sorted(faces_by_photo)
+
+
+def test_waits_while_interactive_requests_are_busy(tmp_path: Path) -> None:
+    db_path, gallery, faces_by_photo = _setup(tmp_path, photos=2)
+    busy = threading.Event()
+    busy.set()
+    calls: list[bytes] = []
+    tagger = _tagger(db_path, gallery, _detector(faces_by_photo, calls), busy=busy.is_set, busy_poll_sec=0.01)
+    tagger.start()
+    threading.Event().wait(0.1)
+    assert calls == [] and tagger.running
+    busy.clear()
+    result = tagger.wait(5)
+    assert result['status'] == 'completed' and result['scanned'] == 2
+    assert result['waited_busy_sec'] >= 0.1
+
+
+def test_failed_assets_are_retried_by_the_next_run(tmp_path: Path) -> None:
+    db_path, gallery, faces_by_photo = _setup(tmp_path, photos=3)
+    detect = _detector(faces_by_photo)
+    flaky = b'photo-1'
+
+    def timing_out(data: bytes):
+        if data == flaky:
+            raise TimeoutError('Face processing timed out')
+        return detect(data)
+
+    first = _tagger(db_path, gallery, timing_out).run()
+    assert (first['scanned'], first['failed']) == (2, 1)
+
+    calls: list[bytes] = []
+    second = _tagger(db_path, gallery, _detector(faces_by_photo, calls)).run()
+    assert calls == [flaky]
+    assert (second['already_scanned'], second['scanned'], second['failed']) == (2, 1, 0)
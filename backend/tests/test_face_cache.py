@@ -0,0 +1,205 @@
+"""Tests for the byte-budgeted ``FaceResultCache`` and in-flight ``SingleFlight``."""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_cache import (  # noqa: E402
+    FaceDiskCache,
+    FaceResultCache,
+    SingleFlight,
+    content_digest,
+    settings_fingerprint,
+)
+
+_LOCATIONS = [(10, 60, 60, 10), (5, 30, 30, 5)]
+
+
+def _encodings(count: int, value: float = 0.1) -> list[np.ndarray]:
+    return [np.full(128, value + index) for index in range(count)]
+
+
+def test_digest_is_stable_and_content_based() -> None:
+    assert content_digest(b'jpeg-bytes') == content_digest(b'jpeg-bytes')
+    assert content_digest(b'jpeg-bytes') != content_digest(b'jpeg-bytez')
+    assert len(content_digest(b'')) == 32
+
+
+def test_locations_and_encodings_per_model_and_jitters() -> None:
+    cache = FaceResultCache(1024 * 1024)
+    digest = content_digest(b'photo')
+    assert cache.lookup(digest, 'large', 1) == (None, None)
+
+    cache.put_locations(digest, _LOCATIONS)
+    assert cache.lookup(digest, 'large', 1) == (_LOCATIONS, None)
+
+    cache.put_encodings(digest, 'large', 1, _encodings(2))
+    locations, encodings = cache.lookup(digest, 'large', 1)
+    assert locations == _LOCATIONS
+    np.testing.assert_allclose(encodings[1], _encodings(2)[1])
+    assert cache.lookup(digest, 'large', 10)[1] is None
+    assert cache.lookup(digest, 'small', 1)[1] is None
+
+
+def test_encodings_need_matching_locations() -> None:
+    cache = FaceResultCache(1024 * 1024)
+    digest = content_digest(b'photo')
+    cache.put_encodings(digest, 'large', 1, _encodings(1))
+    assert cache.lookup(digest, 'large', 1) == (None, None)
+
+    cache.put_locations(digest, _LOCATIONS)
+    cache.put_encodings(digest, 'large', 1, _encodings(1))
+    assert cache.lookup(digest, 'large', 1)[1] is None
+
+    cache.put_encodings(digest, 'large', 1, _encodings(2))
+    cache.put_locations(digest, _LOCATIONS[:1])
+    assert cache.lookup(digest, 'large', 1) == (_LOCATIONS[:1], None)
+
+
+def test_evicts_least_recently_used_by_bytes() -> None:
+    cache = FaceResultCache(4000)
+    digests = [content_digest(bytes([index])) for index in range(3)]
+    for digest in digests[:2]:
+        cache.put_locations(digest, _LOCATIONS[:1])
+        cache.put_encodings(digest, 'large', 1, _encodings(1))
+    assert len(cache) == 2
+
+    cache.lookup(digests[0], 'large', 1)  # digests[1] becomes the LRU entry
+    cache.put_locations(digests[2], _LOCATIONS[:1])
+    cache.put_encodings(digests[2], 'large', 1, _encodings(1))
+
+    assert cache.lookup(digests[1], 'large', 1) == (None, None)
+    assert cache.lookup(digests[0], 'large', 1)[1] is not None
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] <= 4000
+
+
+def test_entries_expire_after_ttl() -> None:
+    cache = FaceResultCache(1024 * 1024, ttl_sec=0.05)
+    digest = content_digest(b'photo')
+    cache.put_locations(digest, [])
+    assert cache.lookup(digest, 'large', 1) == ([], None)
+    time.sleep(0.1)
+    assert cache.lookup(digest, 'large', 1) == (None, None)
+    assert cache.stats()['bytes'] == 0
+
+
+def test_zero_budget_disables_cache() -> None:
+    cache = FaceResultCache(0)
+    digest = content_digest(b'photo')
+    cache.put_locations(digest, _LOCATIONS)
+    assert cache.lookup(digest, 'large', 1) == (None, None)
+    assert len(cache) == 0
+
+
+def _disk(tmp_path: Path, max_bytes: int = 1024 * 1024, settings: dict | None = None) -> FaceDiskCache:
+    fingerprint = settings_fingerprint(settings or {'face_model': 'hog', 'num_jitters': 1})
+    return FaceDiskCache(tmp_path / 'face_cache.db', max_bytes, fingerprint)
+
+
+def test_disk_cache_survives_restart(tmp_path: Path) -> None:
+    digest = content_digest(b'photo')
+    cache = FaceResultCache(1024 * 1024, backing=_disk(tmp_path))
+    cache.put_locations(digest, _LOCATIONS)
+    cache.put_encodings(digest, 'large', 1, _encodings(2))
+
+    restarted = FaceResultCache(1024 * 1024, backing=_disk(tmp_path))
+    locations, encodings = restarted.lookup(digest, 'large', 1)
+    assert locations == _LOCATIONS
+    np.testing.assert_allclose(encodings[0], _encodings(2)[0])
+    assert restarted.stats()['disk']['hits'] == 1
+    # Promoted into memory: the next lookup does not touch the disk.
+    restarted.lookup(digest, 'large', 1)
+    assert restarted.stats()['disk']['hits'] == 1
+
+
+def test_disk_cache_is_cleared_when_settings_change(tmp_path: Path) -> None:
+    digest = content_digest(b'photo')
+    _disk(tmp_path).put_locations(digest, _LOCATIONS)
+    assert _disk(tmp_path).lookup(digest, 'large', 1)[0] == _LOCATIONS
+
+    changed = _disk(tmp_path, settings={'face_model': 'cnn', 'num_jitters': 1})
+    assert changed.lookup(digest, 'large', 1) == (None, None)
+    assert _disk(tmp_path).lookup(digest, 'large', 1) == (None, None)
+
+
+def test_disk_cache_evicts_least_recently_read(tmp_path: Path) -> None:
+    disk = _disk(tmp_path, max_bytes=3 * 1600)
+    digests = [content_digest(bytes([index])) for index in range(4)]
+    for digest in digests[:3]:
+        disk.put_locations(digest, _LOCATIONS[:1])
+        disk.put_encodings(digest, 'large', 1, np.asarray(_encodings(1)))
+        time.sleep(0.01)
+    disk.lookup(digests[0], 'large', 1)
+
+    disk.put_locations(digests[3], _LOCATIONS[:1])
+    disk.put_encodings(digests[3], 'large', 1, np.asarray(_encodings(1)))
+
+    assert disk.lookup(digests[1], 'large', 1) == (None, None)
+    assert disk.lookup(digests[0], 'large', 1)[1] is not None
+    assert disk.stats()['bytes'] <= 3 * 1600
+
+
+def _run_concurrently(flight: SingleFlight, key: str, fn, callers: int) -> list:
+    outcomes = [None] * callers
+    threads = []
+
+    def call(index: int) -> None:
+        try:
+            outcomes[index] = flight.do(key, fn)
+        except Exception as exc:
+            outcomes[index] = exc
+
+    for index in range(callers):
+        thread = threading.Thread(target=call, args=(index,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_single_flight_runs_concurrent_identical_calls_once() -> None:
+    flight = SingleFlight()
+    started = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {'faces': 1}
+
+    outcomes = _run_concurrently(flight, 'digest', slow, 5)
+    assert len(calls) == 1
+    assert all(result == {'faces': 1} for result, _ in outcomes)
+    assert sorted(shared for _, shared in outcomes) == [False, True, True, True, True]
+    assert flight.stats() == {'in_flight': 0, 'executed': 1, 'coalesced': 4}
+
+    # Finished calls are not remembered.
+    assert flight.do('digest', lambda: 'again') == ('again', False)
+
+
+def test_single_flight_shares_the_error_and_keeps_keys_apart() -> None:
+    flight = SingleFlight()
+
+    def failing():
+        time.sleep(0.1)
+        raise ValueError('decode failed')
+
+    outcomes = _run_concurrently(flight, 'bad', failing, 3)
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    with pytest.raises(KeyError):
+        flight.do('other', lambda: {}['missing'])
+    assert flight.do('other', lambda: 7) == (7, False)
@@ -0,0 +1,77 @@
+"""Tests for ``CascadeStats``: recording, adaptive ordering and persistence."""
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_cascade import CascadeStats  # noqa: E402
+
+_STAGES = ['fallback', 'upscaled', 'crops', 'rotations']
+
+
+def test_static_mode_keeps_cascade_order() -> None:
+    stats = CascadeStats()
+    for _ in range(10):
+        stats.record_stage('rotations', True, 0.01)
+        stats.record_stage('fallback', False, 0.5)
+    assert stats.order_stages(_STAGES) == _STAGES
+    assert stats.order_attempts(['a', 'b', 'c']) == [0, 1, 2]
+
+
+def test_adaptive_mode_prefers_cheap_successful_stages() -> None:
+    stats = CascadeStats(adaptive=True)
+    for _ in range(20):
+        stats.record_stage('fallback', False, 0.05)
+        stats.record_stage('upscaled', False, 0.8)
+        stats.record_stage('rotations', True, 0.1)
+    order = stats.order_stages(_STAGES)
+    assert order[0] == 'rotations'
+    # Never-run stages keep a prior and are not starved behind proven failures.
+    assert order.index('crops') < order.index('upscaled')
+
+    stats.record_attempt('rotations', 'rot90cw', False, 0.1)
+    stats.record_attempt('rotations', 'rot90ccw', True, 0.1)
+    assert stats.order_attempts(['rot90cw', 'rot90ccw']) == [1, 0]
+
+
+def test_adaptive_mode_skips_stages_below_hit_rate() -> None:
+    stats = CascadeStats(adaptive=True, min_samples=5, min_hit_rate=0.1)
+    for index in range(5):
+        stats.record_stage('crops', False, 0.2)
+        stats.record_stage('rotations', index == 0, 0.1)
+    assert 'crops' not in stats.order_stages(_STAGES)
+    assert 'rotations' in stats.order_stages(_STAGES)
+    # Not enough samples yet: kept.
+    assert 'upscaled' in stats.order_stages(_STAGES)
+
+
+def test_stats_survive_restart(tmp_path: Path) -> None:
+    path = tmp_path / 'stats.json'
+    stats = CascadeStats(str(path))
+    stats.record_stage('rotations', True, 0.25)
+    stats.record_attempt('rotations', 'fallback-rot90ccw-u1', True, 0.2)
+    stats.save()
+
+    restored = CascadeStats(str(path), adaptive=True)
+    assert restored.load()
+    snapshot = restored.snapshot()
+    assert snapshot['stages']['rotations']['runs'] == 1
+    assert snapshot['stages']['rotations']['hit_rate'] == 1.0
+    assert snapshot['attempts']['fallback-rot90ccw-u1']['stage'] == 'rotations'
+
+    restored.reset()
+    assert json.loads(path.read_text(encoding='utf-8'))['stages'] == {}
+
+
+def test_corrupt_stats_file_is_ignored(tmp_path: Path) -> None:
+    path = tmp_path / 'stats.json'
+    path.write_text('{"version": 1, "stages": {"x": {}}}', encoding='utf-8')
+    stats = CascadeStats(str(path))
+    assert not stats.load()
+    assert stats.snapshot()['stages'] == {}
@@ -0,0 +1,78 @@
+"""Tests for the registration face chips (``face_chips.FaceChipStore``)."""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_chips import FaceChipStore, crop_face_chip  # noqa: E402
+
+
+def _marked_image() -> np.ndarray:
+    image = np.zeros((200, 300, 3), dtype=np.uint8)
+    image[60:120, 100:160] = 255  # the "face"
+    return image
+
+
+def test_chip_is_centred_and_box_maps_into_it() -> None:
+    chip, (top, right, bottom, left) = crop_face_chip(_marked_image(), (60, 160, 120, 100), size=120, margin=0.5)
+    assert chip.shape == (120, 120, 3)
+    # The 60 px box inside a 120 px crop, kept at scale 1.
+    assert (top, right, bottom, left) == (30, 90, 90, 30)
+    assert chip[35:85, 35:85].min() > 200
+    assert chip[:25].max() < 50 and chip[:, :25].max() < 50
+
+
+def test_chip_near_the_border_is_padded() -> None:
+    chip, (top, right, bottom, left) = crop_face_chip(_marked_image(), (0, 60, 60, 0), size=60, margin=0.5)
+    assert chip.shape == (60, 60, 3)
+    assert (top, left) == (15, 15) and (bottom, right) == (45, 45)
+    assert chip[:10, :10].max() == 0
+
+
+def test_small_crop_is_not_upsampled() -> None:
+    chip, location = crop_face_chip(_marked_image(), (60, 160, 120, 100), size=320, margin=0.5)
+    assert chip.shape == (120, 120, 3) and location == (30, 90, 90, 30)
+
+
+def test_store_round_trip_and_delete(tmp_path: Path) -> None:
+    store = FaceChipStore(tmp_path)
+    meta = store.save('m1', _marked_image(), (60, 160, 120, 100))
+    assert meta['box'] == [60, 160, 120, 100] and meta['image_size'] == [200, 300]
+
+    chip, location = store.load('m1')
+    assert chip.shape == (120, 120, 3) and location == tuple(meta['chip_box'])
+    np.testing.assert_array_equal(chip, crop_face_chip(_marked_image(), (60, 160, 120, 100))[0])  # lossless
+    assert store.load('missing') is None
+
+    store.meta_path('m1').unlink()
+    assert store.load('m1') is None  # a chip without its box is not used
+
+    store.save('m2', _marked_image(), (60, 160, 120, 100))
+    assert store.delete(['m1', 'm2', 'm3']) == 2
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_large_face_keeps_encoder_resolution(tmp_path: Path) -> None:
+    store = FaceChipStore(tmp_path, size=96)  # raised to fit a 150 px face
+    assert store.size >= 300
+    image = np.zeros((1200, 1200, 3), dtype=np.uint8)
+    meta = store.save('m1', image, (300, 900, 900, 300))
+    top, right, bottom, left = meta['chip_box']
+    assert meta['chip_size'] == store.size and bottom - top >= 150 and right - left >= 150
+
+
+def test_legacy_jpeg_chips_are_ignored_and_replaced(tmp_path: Path) -> None:
+    store = FaceChipStore(tmp_path)
+    (tmp_path / 'm1.jpg').write_bytes(b'old chip')
+    (tmp_path / 'm1.json').write_text('{"version": 1, "chip_box": [0, 10, 10, 0]}', encoding='utf-8')
+    assert not store.has('m1') and store.load('m1') is None
+
+    store.save('m1', _marked_image(), (60, 160, 120, 100))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['m1.json', 'm1.png']
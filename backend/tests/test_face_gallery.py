@@ -0,0 +1,209 @@
+"""Tests for the contiguous ``FaceGallery`` index.
+
+Search results are checked against the brute-force Euclidean distance that
+``face_recognition.face_distance`` computes (``np.linalg.norm`` over rows).
+"""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_gallery import FaceGallery  # noqa: E402
+
+
+def _random_encodings(count: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(0.0, 0.09, size=(count, 128))
+    return encodings
+
+
+def _filled_gallery(count: int, seed: int = 0) -> tuple[FaceGallery, np.ndarray]:
+    gallery = FaceGallery(initial_capacity=4)
+    encodings = _random_encodings(count, seed)
+    for index, encoding in enumerate(encodings):
+        gallery.upsert(f'm{index}', f'Name {index}', encoding, f'hash{index}')
+    return gallery, encodings
+
+
+def test_search_matches_brute_force_top2() -> None:
+    gallery, encodings = _filled_gallery(300)
+    queries = _random_encodings(7, seed=1)
+
+    result = gallery.search(queries, k=2)
+
+    for face_index, query in enumerate(queries):
+        expected = np.linalg.norm(encodings - query, axis=1)
+        expected_order = np.argsort(expected)[:2]
+        found_ids = [gallery.member_at(int(row))[0] for row in result.rows[face_index]]
+        assert found_ids == [f'm{int(idx)}' for idx in expected_order]
+        np.testing.assert_allclose(result.distances[face_index], expected[expected_order], atol=1e-4)
+
+
+def test_capacity_grows_and_entries_survive() -> None:
+    gallery, encodings = _filled_gallery(50)
+    assert len(gallery) == 50
+    np.testing.assert_allclose(gallery['m37']['encoding'], encodings[37], atol=1e-6)
+    assert gallery['m37']['name'] == 'Name 37'
+    assert gallery['m37']['image_hash'] == 'hash37'
+
+
+def test_remove_keeps_rows_consistent() -> None:
+    gallery, encodings = _filled_gallery(10)
+    del gallery['m2']
+    assert gallery.remove('m0')
+    assert not gallery.remove('missing')
+    assert 'm2' not in gallery
+    assert len(gallery) == 8
+
+    for member_id in gallery:
+        index = int(member_id[1:])
+        np.testing.assert_allclose(gallery[member_id]['encoding'], encodings[index], atol=1e-6)
+
+    result = gallery.search(encodings[9], k=1)
+    assert gallery.member_at(int(result.rows[0, 0]))[0] == 'm9'
+
+
+def test_upsert_replaces_existing_member() -> None:
+    gallery, encodings = _filled_gallery(3)
+    gallery['m1'] = {'name': 'Renamed', 'encoding': encodings[0], 'image_hash': 'x'}
+    assert len(gallery) == 3
+    assert gallery['m1']['name'] == 'Renamed'
+    np.testing.assert_allclose(gallery['m1']['encoding'], encodings[0], atol=1e-6)
+
+
+def test_search_pads_small_gallery_and_restricts_rows() -> None:
+    gallery, encodings = _filled_gallery(5)
+
+    single = gallery.search(encodings[3], k=2, rows=gallery.rows_for(['m3']))
+    assert gallery.member_at(int(single.rows[0, 0]))[0] == 'm3'
+    assert single.rows[0, 1] == -1
+    assert np.isinf(single.distances[0, 1])
+
+    empty = FaceGallery().search(encodings[:2], k=2)
+    assert (empty.rows == -1).all()
+
+
+def test_upsert_rejects_wrong_dimension() -> None:
+    with pytest.raises(ValueError):
+        FaceGallery().upsert('m0', 'Name', np.zeros(64))
+
+
+def _device_of(member_id: str) -> str:
+    return member_id.split('_', 1)[0] if '_' in member_id else ''
+
+
+def test_partitions_follow_mutations() -> None:
+    gallery = FaceGallery(initial_capacity=2, partition_key=_device_of)
+    encodings = _random_encodings(6)
+    for index, member_id in enumerate(['7_a', '7_b', '8_a', 'legacy', '8_b', '7_c']):
+        gallery.upsert(member_id, member_id, encodings[index])
+
+    assert gallery.partition_members('7') == ['7_a', '7_b', '7_c']
+    assert gallery.partition_sizes() == {'7': 3, '8': 2}
+
+    gallery.remove('7_a')
+    gallery.remove('8_a')
+    gallery.remove('8_b')
+    assert gallery.partition_members('7') == ['7_b', '7_c']
+    assert gallery.partition_members('8') == []
+    assert '8' not in gallery.partition_sizes()
+
+    rows = gallery.partition_rows('7')
+    assert sorted(gallery.member_at(int(row))[0] for row in rows) == ['7_b', '7_c']
+
+    result = gallery.search(encodings[5], k=2, rows=rows)
+    assert gallery.member_at(int(result.rows[0, 0]))[0] == '7_c'
+
+    gallery.clear()
+    assert gallery.partition_sizes() == {}
+    assert len(gallery.partition_rows('7')) == 0
+
+
+def test_map_image_hashes_rewrites_only_changed() -> None:
+    gallery, _ = _filled_gallery(3)
+    gallery.upsert('m1', 'Name 1', gallery['m1']['encoding'], '')
+
+    changed = gallery.map_image_hashes(lambda value: f'px:{value}' if value else value)
+
+    assert changed == 2
+    assert gallery['m0']['image_hash'] == 'px:hash0'
+    assert gallery['m1']['image_hash'] == ''
+    assert gallery.export()[3] == ['px:hash0', '', 'px:hash2']
+
+
+def test_hash_and_name_indexes_follow_mutations() -> None:
+    gallery = FaceGallery(initial_capacity=2, name_key=lambda name: ' '.join(name.lower().split()))
+    encodings = _random_encodings(4)
+    gallery.upsert('a', 'Anna  Ivanova', encodings[0], 'h1')
+    gallery.upsert('b', 'anna ivanova', encodings[1], 'h2')
+    gallery.upsert('c', 'Boris', encodings[2], 'h1')
+
+    assert gallery.members_with_hash('h1') == ['a', 'c']
+    assert gallery.members_named('ANNA IVANOVA') == ['a', 'b']
+
+    gallery.upsert('a', 'Boris', encodings[3], 'h3')
+    gallery.remove('c')
+    assert gallery.members_with_hash('h1') == []
+    assert gallery.members_with_hash('h3') == ['a']
+    assert gallery.members_named('anna ivanova') == ['b']
+    assert gallery.members_named('boris') == ['a']
+
+    gallery.map_image_hashes(lambda image_hash: f'x:{image_hash}')
+    assert gallery.members_with_hash('x:h2') == ['b']
+    assert gallery.members_with_hash('h2') == []
+    assert gallery.members_named('') == []
+
+
+def test_pinned_snapshot_is_unchanged_by_later_writes() -> None:
+    gallery, encodings = _filled_gallery(5)
+    pinned = gallery.snapshot()
+    matrix_before = pinned.export()[0].copy()
+
+    gallery.upsert('m1', 'Renamed', encodings[4] + 1.0, 'new')
+    gallery.remove('m0')
+    gallery.upsert('m9', 'Late', encodings[2])
+
+    assert len(pinned) == 5 and list(pinned) == [f'm{index}' for index in range(5)]
+    np.testing.assert_array_equal(pinned.export()[0], matrix_before)
+    assert pinned.member_at(1) == ('m1', 'Name 1')
+    assert pinned.members_with_hash('new') == []
+    assert pinned.search(encodings[0], k=1).rows[0, 0] == 0
+
+    current = gallery.snapshot()
+    assert len(current) == 5 and 'm0' not in current
+    assert current['m1']['name'] == 'Renamed'
+
+
+def test_appends_share_the_matrix_buffer_until_a_row_changes() -> None:
+    gallery, encodings = _filled_gallery(3)
+    before = gallery.snapshot()
+    gallery.upsert('m3', '', encodings[0])
+    after_append = gallery.snapshot()
+    assert np.shares_memory(before.export()[0], after_append.export()[0])
+
+    gallery.upsert('m0', '', encodings[1])
+    assert not np.shares_memory(after_append.export()[0], gallery.snapshot().export()[0])
+    np.testing.assert_array_equal(after_append['m0']['encoding'], encodings[0].astype(np.float32))
+
+
+def test_batch_publishes_once_and_discards_on_error() -> None:
+    gallery, encodings = _filled_gallery(2)
+    with gallery.batch():
+        gallery.upsert('m2', '', encodings[0])
+        gallery.remove('m0')
+        assert len(gallery) == 2 and 'm0' in gallery  # readers still see the old state
+    assert sorted(gallery) == ['m1', 'm2']
+
+    with pytest.raises(RuntimeError):
+        with gallery.batch():
+            gallery.clear()
+            raise RuntimeError('abort')
+    assert sorted(gallery) == ['m1', 'm2']
@@ -0,0 +1,182 @@
+"""Tests for the binary ``FaceGalleryStore`` snapshot format and journal."""
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_gallery import FaceGallery, FaceGalleryStore  # noqa: E402
+
+
+def _device_of(member_id: str) -> str:
+    return member_id.split('_', 1)[0] if '_' in member_id else ''
+
+
+def _gallery(count: int, seed: int = 0) -> FaceGallery:
+    gallery = FaceGallery(partition_key=_device_of)
+    rng = np.random.default_rng(seed)
+    for index in range(count):
+        gallery.upsert(f'{index % 3}_{index}', f'Имя {index}', rng.normal(0, 0.09, 128), f'h{index}')
+    return gallery
+
+
+def test_round_trip_is_memory_mapped(tmp_path: Path) -> None:
+    source = _gallery(40)
+    store = FaceGalleryStore(tmp_path)
+    store.save(source)
+
+    loaded = FaceGallery(partition_key=_device_of)
+    meta = store.load_into(loaded)
+
+    assert meta['count'] == 40
+    # Adopted without copying: the matrix is still the read-only file mapping.
+    assert not loaded.export()[0].flags.writeable
+    assert loaded.members() == source.members()
+    assert loaded.partition_sizes() == source.partition_sizes()
+    np.testing.assert_array_equal(loaded.export()[0], source.export()[0])
+    assert loaded['1_7']['image_hash'] == 'h7'
+
+
+def test_loaded_gallery_becomes_writable_on_mutation(tmp_path: Path) -> None:
+    store = FaceGalleryStore(tmp_path)
+    store.save(_gallery(5))
+    loaded = FaceGallery(partition_key=_device_of)
+    store.load_into(loaded)
+
+    loaded.remove('0_0')
+    loaded.upsert('9_new', 'New', np.ones(128))
+    assert len(loaded) == 5
+    assert loaded.export()[0].flags.writeable
+
+    store.save(loaded)
+    reloaded = FaceGallery()
+    store.load_into(reloaded)
+    assert sorted(reloaded) == sorted(loaded)
+
+
+def test_save_keeps_single_generation_and_commits_meta_last(tmp_path: Path) -> None:
+    store = FaceGalleryStore(tmp_path)
+    store.save(_gallery(3))
+    store.save(_gallery(4))
+
+    meta = json.loads((tmp_path / 'gallery.json').read_text(encoding='utf-8'))
+    assert meta['generation'] == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['encodings-2.npy', 'gallery.json']
+
+
+def test_interrupted_save_leaves_previous_generation(tmp_path: Path) -> None:
+    store = FaceGalleryStore(tmp_path)
+    store.save(_gallery(3))
+    # Simulate a crash after the next matrix was written but before the commit.
+    np.save(tmp_path / 'encodings-2.npy', np.zeros((9, 128), dtype=np.float32))
+    (tmp_path / 'gallery.json.tmp').write_text('{"truncated', encoding='utf-8')
+
+    loaded = FaceGallery()
+    store.load_into(loaded)
+    assert len(loaded) == 3
+
+
+def test_clear_and_empty_gallery(tmp_path: Path) -> None:
+    store = FaceGalleryStore(tmp_path)
+    store.save(FaceGallery())
+    loaded = _gallery(2)
+    store.load_into(loaded)
+    assert len(loaded) == 0
+
+    store.reset(loaded)
+    assert not store.exists()
+    assert len(loaded) == 0
+
+
+def test_rejects_inconsistent_metadata(tmp_path: Path) -> None:
+    store = FaceGalleryStore(tmp_path)
+    store.save(_gallery(3))
+    meta = json.loads((tmp_path / 'gallery.json').read_text(encoding='utf-8'))
+    meta['ids'] = meta['ids'][:2]
+    (tmp_path / 'gallery.json').write_text(json.dumps(meta), encoding='utf-8')
+
+    with pytest.raises(ValueError):
+        store.load_into(FaceGallery())
+
+
+def test_mutations_append_to_journal_and_replay(tmp_path: Path) -> None:
+    store = FaceGalleryStore(tmp_path, compact_threshold_bytes=0)
+    gallery = FaceGallery(partition_key=_device_of)
+    store.save(_gallery(4))
+    store.load_into(gallery)
+    snapshot_bytes = (tmp_path / 'encodings-1.npy').stat().st_size
+
+    store.put(gallery, '5_new', 'Новый', np.full(128, 0.5), 'hnew')
+    store.put(gallery, '0_0', 'Renamed', np.full(128, 0.25), 'h0')
+    assert store.delete(gallery, ['1_1', 'missing']) == ['1_1']
+
+    lines = (tmp_path / 'journal.log').read_text(encoding='utf-8').splitlines()
+    assert [json.loads(line)['op'] for line in lines] == ['put', 'put', 'del']
+    # The snapshot is untouched by journaled mutations.
+    assert (tmp_path / 'encodings-1.npy').stat().st_size == snapshot_bytes
+
+    reloaded = FaceGallery(partition_key=_device_of)
+    meta = store.load_into(reloaded)
+    assert meta['replayed'] == 3
+    assert sorted(reloaded) == sorted(gallery)
+    assert reloaded['0_0']['name'] == 'Renamed'
+    np.testing.assert_allclose(reloaded['5_new']['encoding'], np.full(128, 0.5))
+    assert reloaded.partition_sizes() == gallery.partition_sizes()
+
+
+def test_torn_journal_tail_is_ignored(tmp_path: Path) -> None:
+    store = FaceGalleryStore(tmp_path, compact_threshold_bytes=0)
+    gallery = FaceGallery()
+    store.put(gallery, 'a', 'A', np.ones(128))
+    store.put(gallery, 'b', 'B', np.ones(128))
+    with open(tmp_path / 'journal.log', 'ab') as journal_file:
+        journal_file.write(b'{"op":"put","id":"c","enc":"AAA')
+
+    reloaded = FaceGallery()
+    store.load_into(reloaded)
+    assert sorted(reloaded) == ['a', 'b']
+
+
+def test_save_folds_journal(tmp_path: Path) -> None:
+    store = FaceGalleryStore(tmp_path, compact_threshold_bytes=0)
+    gallery = FaceGallery()
+    for index in range(5):
+        store.put(gallery, f'm{index}', f'M{index}', np.full(128, index, dtype=np.float32))
+    store.delete(gallery, ['m2'])
+
+    meta = store.save(gallery)
+    assert meta['journal_seq'] == 6
+    assert not (tmp_path / 'journal.log').exists()
+
+    store.put(gallery, 'm9', 'M9', np.ones(128))
+    reloaded = FaceGallery()
+    meta = store.load_into(reloaded)
+    assert meta['replayed'] == 1
+    assert sorted(reloaded) == ['m0', 'm1', 'm3', 'm4', 'm9']
+
+
+def test_background_compaction_after_threshold(tmp_path: Path) -> None:
+    store = FaceGalleryStore(tmp_path, compact_threshold_bytes=4096, fsync_journal=False)
+    gallery = FaceGallery()
+    for index in range(12):
+        store.put(gallery, f'm{index}', f'M{index}', np.full(128, index, dtype=np.float32))
+    store.wait_for_compaction(timeout=10)
+
+    meta = json.loads((tmp_path / 'gallery.json').read_text(encoding='utf-8'))
+    assert meta['journal_seq'] > 0
+    folded = [json.loads(line)['seq'] for line in (tmp_path / 'journal.log').read_text().splitlines()] \
+        if (tmp_path / 'journal.log').exists() else []
+    assert all(seq > meta['journal_seq'] for seq in folded)
+
+    reloaded = FaceGallery()
+    store.load_into(reloaded)
+    assert sorted(reloaded) == sorted(gallery)
+    np.testing.assert_allclose(reloaded['m11']['encoding'], np.full(128, 11))
@@ -0,0 +1,88 @@
+"""Tests for the bounded background queue behind async face registration."""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_admission import AdmissionLimiter  # noqa: E402
+from face_jobs import FaceJobQueue, FaceJobQueueFull  # noqa: E402
+
+
+def test_job_result_and_metadata_are_reported() -> None:
+    queue = FaceJobQueue(1)
+    job = queue.submit(lambda a, b: {'sum': a + b}, 2, 3, meta={'member_id': 'm1'})
+    assert job['status'] == 'queued'
+    assert job['member_id'] == 'm1'
+
+    finished = queue.wait(job['job_id'], timeout=5)
+    assert finished['status'] == 'done'
+    assert finished['result'] == {'sum': 5}
+    assert finished['error'] is None
+    assert finished['finished_at'] >= finished['started_at'] >= finished['created_at']
+    assert queue.stats()['completed'] == 1
+    queue.shutdown()
+
+
+def test_failed_job_keeps_the_error() -> None:
+    queue = FaceJobQueue(1)
+
+    def fail():
+        raise ValueError('no encoding')
+
+    job = queue.wait(queue.submit(fail)['job_id'], timeout=5)
+    assert job['status'] == 'failed'
+    assert job['error'] == 'no encoding'
+    assert queue.stats()['failed'] == 1
+    assert queue.get('unknown') is None
+    queue.shutdown()
+
+
+def test_queue_is_bounded_by_pending_jobs() -> None:
+    release = threading.Event()
+    queue = FaceJobQueue(1, max_pending=2)
+    first = queue.submit(release.wait, 5)
+    queue.submit(release.wait, 5)
+    with pytest.raises(FaceJobQueueFull):
+        queue.submit(release.wait, 5)
+
+    release.set()
+    queue.wait(first['job_id'], timeout=5)
+    assert queue.stats()['pending'] <= 1
+    queue.submit(lambda: {})
+    queue.shutdown()
+
+
+def test_finished_jobs_are_pruned() -> None:
+    queue = FaceJobQueue(1, max_kept=2)
+    job_ids = [queue.submit(lambda: {})['job_id'] for _ in range(4)]
+    queue.wait(job_ids[-1], timeout=5)
+    queue.submit(lambda: {})
+    assert queue.get(job_ids[0]) is None
+    assert queue.stats()['kept'] <= 3
+    queue.shutdown()
+
+
+def test_jobs_wait_for_an_admission_slot() -> None:
+    admission = AdmissionLimiter(1, max_queue=0, max_wait_sec=0.1, max_retry_after_sec=1)
+    queue = FaceJobQueue(2, admission=admission)
+    admission.acquire()  # a synchronous request holds the only slot
+    held = admission.stats()['active']
+
+    job = queue.submit(lambda: {'active': admission.stats()['active']})
+    time.sleep(0.3)
+    assert queue.get(job['job_id'])['status'] == 'queued'
+
+    admission.release()
+    finished = queue.wait(job['job_id'], timeout=5)
+    assert finished['status'] == 'done' and finished['result'] == {'active': held}
+    assert admission.stats()['active'] == 0
+    queue.shutdown()
@@ -0,0 +1,95 @@
+"""Tests for reduced-precision gallery storage (``face_quant`` and ``FaceGallery(precision=...)``)."""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_gallery import FaceGallery, FaceGalleryStore  # noqa: E402
+from face_quant import EncodingCodec, evaluate_precision  # noqa: E402
+
+
+def _identities(count: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """dlib-like encodings: identity centres and one fresh sample of each."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0.0, 0.056, size=(count, 128)).astype(np.float32)
+    probes = centers + rng.normal(0.0, 0.015, size=centers.shape).astype(np.float32)
+    return centers, probes
+
+
+@pytest.mark.parametrize('precision, tolerance', [('float16', 2e-4), ('int8', 2e-3)])
+def test_codec_round_trip_is_close_and_stable(precision: str, tolerance: float) -> None:
+    codec = EncodingCodec(precision)
+    vectors, _ = _identities(64)
+    stored, scales = codec.encode(vectors)
+    decoded = codec.decode(stored, scales)
+
+    assert stored.dtype == np.dtype(precision)
+    assert np.abs(decoded - vectors).max() < tolerance
+    # Stored values survive a decode / encode cycle (float32 snapshots of a compact gallery).
+    again, again_scales = codec.encode(decoded)
+    np.testing.assert_array_equal(codec.decode(again, again_scales), decoded)
+
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+def test_compact_gallery_search_agrees_with_float32(precision: str) -> None:
+    centers, probes = _identities(500)
+    exact = FaceGallery(initial_capacity=4)
+    compact = FaceGallery(initial_capacity=4, precision=precision)
+    for row, encoding in enumerate(centers):
+        exact.upsert(f'm{row}', '', encoding)
+        compact.upsert(f'm{row}', '', encoding)
+    compact.remove('m3')
+    exact.remove('m3')
+
+    expected = exact.search(probes, k=2)
+    found = compact.search(probes, k=2)
+    # Second neighbours may swap when they are within the rounding error of each other.
+    np.testing.assert_array_equal(found.rows[:, 0], expected.rows[:, 0])
+    np.testing.assert_allclose(found.distances, expected.distances, atol=5e-3)
+
+    subset = compact.rows_for(['m10', 'm11', 'm12'])
+    scoped = compact.search(probes[10:13], k=1, rows=subset)
+    assert [compact.member_at(int(row))[0] for row in scoped.rows[:, 0]] == ['m10', 'm11', 'm12']
+
+    stats = compact.storage_stats()
+    assert stats['precision'] == precision
+    assert stats['bytes_per_face'] * 2 <= exact.storage_stats()['bytes_per_face'] + 4
+
+
+def test_store_round_trip_and_set_precision(tmp_path: Path) -> None:
+    centers, probes = _identities(40)
+    store = FaceGalleryStore(tmp_path / 'gallery', fsync_journal=False)
+    gallery = FaceGallery(precision='int8')
+    for row, encoding in enumerate(centers):
+        store.put(gallery, f'm{row}', f'Name {row}', encoding, f'h{row}')
+    store.save(gallery)
+
+    assert store.read_matrix().dtype == np.float32
+    loaded = FaceGallery(precision='int8')
+    store.load_into(loaded)
+    np.testing.assert_array_equal(loaded.export()[0], gallery.export()[0])
+
+    loaded.set_precision('float32')
+    assert loaded.precision == 'float32' and len(loaded) == 40
+    assert loaded['m5']['name'] == 'Name 5'
+    np.testing.assert_array_equal(loaded.search(probes, k=1).rows, gallery.search(probes, k=1).rows)
+
+
+def test_evaluate_precision_reports_error_and_disagreement() -> None:
+    centers, _ = _identities(2000)
+    half = evaluate_precision(centers, 'float16', query_count=200, threshold=0.5, margin=0.05)
+    quarter = evaluate_precision(centers, 'int8', query_count=200, threshold=0.5, margin=0.05)
+
+    assert half['compression'] == 2.0 and quarter['compression'] > 3.8
+    assert half['distance_error_max'] < quarter['distance_error_max'] < 5e-3
+    assert quarter['top1_disagreement'] <= 0.01
+    assert quarter['decision_disagreement'] <= 0.01
+    assert evaluate_precision(centers, 'float32', query_count=50)['distance_error_max'] == 0.0
@@ -0,0 +1,162 @@
+"""Tests for the resumable gallery re-encode (``face_reencode.GalleryReencoder``)."""
+from __future__ import annotations
+
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+from face_gallery import FaceGallery, FaceGalleryStore  # noqa: E402
+from face_reencode import GalleryReencoder  # noqa: E402
+
+
+def _photo_encoding(data: bytes) -> np.ndarray:
+    """Deterministic "new model" encoding of a fake photo."""
+    seed = int.from_bytes(data[:4], 'little')
+    return np.random.default_rng(seed).normal(0.0, 0.09, 128).astype(np.float32)
+
+
+def _setup(tmp_path: Path, members: int = 6, with_photo: int | None = None):
+    store = FaceGalleryStore(tmp_path / 'gallery', fsync_journal=False)
+    gallery = FaceGallery()
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    rng = np.random.default_rng(12345)
+    for index in range(members):
+        member_id = f'm{index}'
+        store.put(gallery, member_id, f'Name {index}', rng.normal(0.0, 0.09, 128), f'h{index}')
+        if with_photo is None or index < with_photo:
+            (photos / f'{member_id}.jpg').write_bytes(index.to_bytes(4, 'little') + b'jpeg')
+    return store, gallery, photos
+
+
+def _reencoder(store, gallery, photos, tmp_path, encode=_photo_encoding, fingerprint='v2', workers=2):
+    return GalleryReencoder(store, gallery, photos, tmp_path / 'staging', encode, fingerprint, workers=workers)
+
+
+def test_reencode_swaps_every_member_with_a_photo(tmp_path: Path) -> None:
+    store, gallery, photos = _setup(tmp_path, members=6, with_photo=4)
+    old = {member_id: gallery[member_id]['encoding'] for member_id in gallery}
+
+    result = _reencoder(store, gallery, photos, tmp_path).run()
+
+    assert result['status'] == 'completed'
+    assert (result['swapped'], result['stale'], result['missing_photo']) == (4, 2, 2)
+    for index in range(4):
+        expected = _photo_encoding(index.to_bytes(4, 'little'))
+        np.testing.assert_array_equal(gallery[f'm{index}']['encoding'], expected)
+        assert gallery[f'm{index}']['image_hash'] == f'h{index}'
+    np.testing.assert_array_equal(gallery['m5']['encoding'], old['m5'])
+    assert not (tmp_path / 'staging').exists()
+
+    # The swap is persisted as a snapshot.
+    reloaded = FaceGallery()
+    FaceGalleryStore(tmp_path / 'gallery').load_into(reloaded)
+    np.testing.assert_array_equal(reloaded['m0']['encoding'], gallery['m0']['encoding'])
+
+
+def test_interrupted_run_resumes_without_reencoding_staged_photos(tmp_path: Path) -> None:
+    store, gallery, photos = _setup(tmp_path, members=8)
+    calls: list[bytes] = []
+    reencoder = None
+
+    def cancelling_encode(data: bytes) -> np.ndarray:
+        calls.append(data)
+        if len(calls) == 3:
+            reencoder.cancel()
+        return _photo_encoding(data)
+
+    reencoder = _reencoder(store, gallery, photos, tmp_path, encode=cancelling_encode, workers=1)
+    reencoder._thread = threading.current_thread()  # cancel() only acts on a running job
+    first = reencoder.run()
+    assert first['status'] == 'cancelled'
+    assert first['done'] == 3
+    before = gallery['m0']['encoding']
+
+    calls.clear()
+    second = _reencoder(store, gallery, photos, tmp_path, encode=cancelling_encode).run()
+    assert second['resumed'] is True
+    assert second['status'] == 'completed'
+    assert len(calls) == second['processed'] == 5
+    assert second['swapped'] == 8
+    assert not np.array_equal(gallery['m0']['encoding'], before)
+
+
+def test_changed_fingerprint_starts_over(tmp_path: Path) -> None:
+    store, gallery, photos = _setup(tmp_path, members=3)
+    reencoder = _reencoder(store, gallery, photos, tmp_path, fingerprint='v2')
+    reencoder._cancel.set()
+    assert reencoder.run()['status'] == 'cancelled'
+
+    result = _reencoder(store, gallery, photos, tmp_path, fingerprint='v3').run()
+    assert result['resumed'] is False
+    assert result['processed'] == 3
+
+
+def test_members_changed_during_the_run_keep_their_live_state(tmp_path: Path) -> None:
+    store, gallery, photos = _setup(tmp_path, members=4)
+    fresh_encoding = np.full(128, 0.01, dtype=np.float32)
+
+    def encode_while_clients_register(data: bytes) -> np.ndarray:
+        if data.startswith((0).to_bytes(4, 'little')):
+            store.put(gallery, 'm1', 'Name 1', fresh_encoding, 'h1-new')
+            store.delete(gallery, ['m2'])
+            store.put(gallery, 'late', 'Late', fresh_encoding)
+        return _photo_encoding(data)
+
+    result = _reencoder(store, gallery, photos, tmp_path, encode=encode_while_clients_register, workers=1).run()
+
+    assert result['swapped'] == 2
+    np.testing.assert_array_equal(gallery['m1']['encoding'], fresh_encoding)
+    assert 'm2' not in gallery
+    np.testing.assert_array_equal(gallery['late']['encoding'], fresh_encoding)
+    np.testing.assert_array_equal(gallery['m3']['encoding'], _photo_encoding((3).to_bytes(4, 'little')))
+
+
+def test_failed_photos_are_reported_and_keep_the_old_encoding(tmp_path: Path) -> None:
+    store, gallery, photos = _setup(tmp_path, members=3)
+    old = gallery['m1']['encoding']
+
+    def encode(data: bytes) -> np.ndarray:
+        if data.startswith((1).to_bytes(4, 'little')):
+            raise ValueError('Лиц на фото: 0')
+        return _photo_encoding(data)
+
+    result = _reencoder(store, gallery, photos, tmp_path, encode=encode).run()
+    assert result['failed'] == 1
+    assert result['errors'] == {'m1': 'Лиц на фото: 0'}
+    assert (result['swapped'], result['stale']) == (2, 1)
+    np.testing.assert_array_equal(gallery['m1']['encoding'], old)
+
+
+def test_members_with_a_chip_are_encoded_from_it(tmp_path: Path) -> None:
+    from face_chips import FaceChipStore
+
+    store, gallery, photos = _setup(tmp_path, members=4, with_photo=2)
+    chips = FaceChipStore(tmp_path / 'chips')
+    image = np.full((120, 100, 3), 90, dtype=np.uint8)
+    chips.save('m1', image, (30, 70, 80, 20))
+    chips.save('m3', image, (30, 70, 80, 20))
+    chip_calls: list[tuple] = []
+
+    def encode_chip(chip: np.ndarray, location: tuple) -> np.ndarray:
+        chip_calls.append(location)
+        assert chip.shape == (100, 100, 3)  # a small face is kept at its own resolution
+        return np.full(128, 0.5, dtype=np.float32)
+
+    reencoder = GalleryReencoder(
+        store, gallery, photos, tmp_path / 'staging', _photo_encoding, 'v2',
+        chips=chips, encode_chip=encode_chip,
+    )
+    result = reencoder.run()
+
+    assert (result['swapped'], result['from_chip'], result['missing_photo']) == (3, 2, 1)
+    assert len(chip_calls) == 2
+    np.testing.assert_array_equal(gallery['m3']['encoding'], np.full(128, 0.5, dtype=np.float32))
+    np.testing.assert_array_equal(gallery['m0']['encoding'], _photo_encoding((0).to_bytes(4, 'little')))
@@ -0,0 +1,294 @@
+"""Tests for ``FaceWorkerPool`` with a stub ``face_recognition`` module.
+
+The stub is installed in ``sys.modules`` before the pool starts; worker
+processes inherit it through fork (the tests are skipped where fork is
+unavailable). The spawn test finds the stub as a file on ``sys.path``.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import types
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Allow running from repo root without installation.
+_BACKEND = Path(__file__).resolve().parents[1]
+if str(_BACKEND) not in sys.path:
+    sys.path.insert(0, str(_BACKEND))
+
+import face_workers  # noqa: E402
+from face_workers import FaceWorkerPool, FaceWorkerTimeout  # noqa: E402
+
+
+def _stub_face_recognition() -> types.ModuleType:
+    module = types.ModuleType('face_recognition')
+
+    def face_locations(image, model='hog', number_of_times_to_upsample=1):
+        height, width = image.shape[:2]
+        return [] if image.max() == 0 else [(0, width, height, 0)]
+
+    def face_encodings(image, locations, num_jitters=1, model='large'):
+        return [np.full(128, float(num_jitters)) for _ in locations]
+
+    def batch_face_locations(images, number_of_times_to_upsample=1, batch_size=128):
+        return [face_locations(image) for image in images]
+
+    module.face_locations = face_locations
+    module.face_encodings = face_encodings
+    module.batch_face_locations = batch_face_locations
+    return module
+
+
+@pytest.fixture(autouse=True)
+def _stub(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'face_recognition', _stub_face_recognition())
+    monkeypatch.setattr(face_workers, '_face_recognition', None)
+
+
+_needs_fork = pytest.mark.skipif(
+    'fork' not in multiprocessing.get_all_start_methods()
+    or multiprocessing.get_start_method(allow_none=True) not in (None, 'fork'),
+    reason='stub module reaches workers only through fork',
+)
+
+
+def _image(value: int = 255) -> np.ndarray:
+    return np.full((20, 30, 3), value, dtype=np.uint8)
+
+
+def test_inline_pool_runs_jobs_in_calling_thread() -> None:
+    pool = FaceWorkerPool(0)
+    assert pool.face_locations(_image(), 'hog', 1) == [(0, 30, 20, 0)]
+    assert pool.face_locations(_image(0), 'hog', 1) == []
+    encodings = pool.face_encodings(_image(), [(0, 30, 20, 0)], 3, 'large')
+    assert len(encodings) == 1 and encodings[0][0] == 3.0
+    assert not pool.started
+
+
+def test_inline_pool_propagates_errors() -> None:
+    pool = FaceWorkerPool(0)
+    with pytest.raises(ZeroDivisionError):
+        pool.run(divmod, 1, 0)
+
+
+@_needs_fork
+def test_process_pool_runs_jobs_and_batches() -> None:
+    pool = FaceWorkerPool(2, timeout=30, start_method='fork')
+    try:
+        assert pool.face_locations(_image(), 'hog', 0) == [(0, 30, 20, 0)]
+        assert pool.batch_face_locations([_image(), _image(0)], 1, 128) == [[(0, 30, 20, 0)], []]
+        assert pool.face_encodings(_image(), [(0, 30, 20, 0)], 2, 'large')[0][0] == 2.0
+        assert pool.started
+    finally:
+        pool.shutdown()
+    assert not pool.started
+
+
+@_needs_fork
+def test_process_pool_times_out() -> None:
+    pool = FaceWorkerPool(1, timeout=0.2, start_method='fork')
+    try:
+        pool.run(time.sleep, 0)  # start and warm up the worker
+        with pytest.raises(FaceWorkerTimeout):
+            pool.run(time.sleep, 2)
+    finally:
+        pool.shutdown()
+
+
+def _sleep_then(delay: float, value: int) -> int:
+    time.sleep(delay)
+    return value
+
+
+def test_inline_run_first_stops_at_first_hit() -> None:
+    pool = FaceWorkerPool(0)
+    started = []
+
+    def jobs():
+        for index, value in enumerate([0, 0, 7, 9]):
+            started.append(index)
+            yield _sleep_then, (0, value)
+
+    assert pool.run_first(jobs(), lambda index, value: value) == (2, 7)
+    assert started == [0, 1, 2]
+    assert pool.run_first(iter([(_sleep_then, (0, 0))]), lambda index, value: value) == (None, None)
+
+
+@_needs_fork
+def test_process_run_first_prefers_cascade_order() -> None:
+    pool = FaceWorkerPool(3, timeout=30, start_method='fork')
+    try:
+        # The later hit finishes first; the earlier one still wins.
+        jobs = [(_sleep_then, (0.5, 0)), (_sleep_then, (0.3, 5)), (_sleep_then, (0.0, 8))]
+        assert pool.run_first(jobs, lambda index, value: value) == (1, 5)
+
+        jobs = [(_sleep_then, (0.0, 0)), (_sleep_then, (0.0, 0))]
+        assert pool.run_first(jobs, lambda index, value: value) == (None, None)
+    finally:
+        pool.shutdown()
+
+
+@_needs_fork
+def test_process_run_first_cancels_queued_siblings() -> None:
+    pool = FaceWorkerPool(1, timeout=30, start_method='fork')
+    try:
+        pool.run(time.sleep, 0)
+        jobs = [(_sleep_then, (0.0, 1))] + [(_sleep_then, (1.0, 2))] * 6
+        start = time.monotonic()
+        assert pool.run_first(jobs, lambda index, value: value) == (0, 1)
+        assert time.monotonic() - start < 1.0
+    finally:
+        pool.shutdown()
+
+
+@_needs_fork
+def test_process_run_first_timeout_keeps_partial_result() -> None:
+    pool = FaceWorkerPool(2, timeout=30, start_method='fork')
+    try:
+        pool.run(time.sleep, 0)
+        jobs = [(_sleep_then, (1.0, 3)), (_sleep_then, (0.0, 4))]
+        assert pool.run_first(jobs, lambda index, value: value, timeout=0.3) == (1, 4)
+
+        with pytest.raises(FaceWorkerTimeout):
+            pool.run_first([(_sleep_then, (1.0, 3))], lambda index, value: value, timeout=0.2)
+    finally:
+        pool.shutdown()
+
+
+_STUB_SOURCE = '''
+def face_locations(image, model='hog', number_of_times_to_upsample=1):
+    return [(0, image.shape[1], image.shape[0], 0)]
+
+
+def face_encodings(image, locations, num_jitters=1, model='large'):
+    import numpy
+    return [numpy.full(128, float(num_jitters)) for _ in locations]
+'''
+
+
+def _loaded_modules(names: tuple[str, ...]) -> list[str]:
+    return [name for name in names if name in sys.modules]
+
+
+def test_spawn_pool_starts_without_server_modules(tmp_path: Path, monkeypatch) -> None:
+    (tmp_path / 'face_recognition.py').write_text(_STUB_SOURCE, encoding='utf-8')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    pool = FaceWorkerPool(1, timeout=60)
+    try:
+        assert pool.start_method == 'spawn'
+        pool.start()
+        assert pool.started
+        assert pool.face_encodings(_image(), [(0, 30, 20, 0)], 2, 'large')[0][0] == 2.0
+        # A fresh interpreter: the server was not imported into the worker.
+        assert pool.run(_loaded_modules, ('telegram_service', 'flask')) == []
+    finally:
+        pool.shutdown()
+
+
+_SIDE_EFFECT_SERVER = '''
+import os
+
+from face_workers import FaceWorkerPool
+
+with open(os.environ['IMPORT_LOG'], 'a', encoding='utf-8') as log:
+    log.write(f'{os.getpid()}\\n')
+
+
+def main():
+    pool = FaceWorkerPool(1, timeout=60)
+    try:
+        pool.start()
+        print(pool.run(os.getpid))
+    finally:
+        pool.shutdown()
+'''
+
+
+def test_spawn_workers_skip_the_server_module_side_effects(tmp_path: Path) -> None:
+    (tmp_path / 'face_recognition.py').write_text(_STUB_SOURCE, encoding='utf-8')
+    (tmp_path / 'side_effect_server.py').write_text(_SIDE_EFFECT_SERVER, encoding='utf-8')
+    launcher = (_BACKEND / 'run_server.py').read_text(encoding='utf-8')
+    assert "SERVER_MODULE = 'telegram_service'" in launcher
+    (tmp_path / 'run_server.py').write_text(
+        launcher.replace("SERVER_MODULE = 'telegram_service'", "SERVER_MODULE = 'side_effect_server'"),
+        encoding='utf-8',
+    )
+    import_log = tmp_path / 'imports.log'
+    env = dict(
+        os.environ,
+        IMPORT_LOG=str(import_log),
+        PYTHONPATH=os.pathsep.join([str(tmp_path), str(_BACKEND)]),
+    )
+
+    result = subprocess.run(
+        [sys.executable, str(tmp_path / 'run_server.py')],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+    assert result.returncode == 0, result.stderr
+    worker_pid = result.stdout.split()[-1]
+    # The module ran once, in the launcher process, and never in the worker.
+    imported_in = import_log.read_text(encoding='utf-8').split()
+    assert len(imported_in) == 1
+    assert imported_in[0] != worker_pid
+
+
+@_needs_fork
+def test_process_run_first_keeps_jobs_in_flight_bounded() -> None:
+    pool = FaceWorkerPool(2, timeout=30, start_method='fork')
+    taken: list[int] = []
+    in_flight_at_results: list[int] = []
+
+    def jobs():
+        for index in range(6):
+            taken.append(index)
+            yield _sleep_then, (0.1, 1 if index == 3 else 0)
+
+    def accept(index, value):
+        in_flight_at_results.append(len(taken) - len(in_flight_at_results))
+        return value
+
+    try:
+        pool.run(time.sleep, 0)
+        assert pool.run_first(jobs(), accept) == (3, 1)
+        # Never more than two jobs outstanding; at most the one slot freed
+        # before the winner finished was refilled.
+        assert max(in_flight_at_results) == 2
+        assert taken[:4] == [0, 1, 2, 3] and len(taken) <= 5
+    finally:
+        pool.shutdown()
+
+
+@_needs_fork
+def test_process_run_first_stops_taking_jobs_when_the_budget_runs_out() -> None:
+    pool = FaceWorkerPool(2, timeout=30, start_method='fork')
+    taken: list[int] = []
+
+    def jobs(deadline: float):
+        # As detect_faces_optimized's stages do: check the budget before each attempt.
+        for index in range(10):
+            if time.monotonic() >= deadline:
+                return
+            taken.append(index)
+            yield _sleep_then, (0.2, 0)
+
+    try:
+        pool.run(time.sleep, 0)
+        started = time.monotonic()
+        assert pool.run_first(jobs(started + 0.3), lambda index, value: value) == (None, None)
+        elapsed = time.monotonic() - started
+        # Two waves of two attempts fit in the 0.3 s budget; the other six were never submitted.
+        assert taken == [0, 1, 2, 3]
+        assert elapsed < 0.8
+    finally:
+        pool.shutdown()
@@ -314,7 +314,7 @@ User=familyone
 Group=familyone
 WorkingDirectory=${APP_DIR}/backend
 Environment=PYTHONUNBUFFERED=1
-ExecStart=${APP_DIR}/backend/.venv/bin/python ${APP_DIR}/backend/telegram_service.py
+ExecStart=${APP_DIR}/backend/.venv/bin/python ${APP_DIR}/backend/run_server.py
 Restart=always
 RestartSec=3
 
@@ -503,7 +503,7 @@ $caddyErr = Join-Path $runtimeDir 'caddy.err.log'
 $cloudOut = Join-Path $runtimeDir 'cloudflared.out.log'
 $cloudErr = Join-Path $runtimeDir 'cloudflared.err.log'
 
-$apiProcess = Start-ManagedProcess -Name 'API' -FilePath $venvPython -Arguments @('telegram_service.py') -WorkingDirectory (Join-Path $repoRoot 'backend') -StdOut $apiOut -StdErr $apiErr
+$apiProcess = Start-ManagedProcess -Name 'API' -FilePath $venvPython -Arguments @('run_server.py') -WorkingDirectory (Join-Path $repoRoot 'backend') -StdOut $apiOut -StdErr $apiErr
 $caddyProcess = Start-ManagedProcess -Name 'Caddy' -FilePath 'caddy' -Arguments @('run', '--config', (Join-Path $repoRoot 'infra\Caddyfile'), '--adapter', 'caddyfile') -WorkingDirectory $repoRoot -StdOut $caddyOut -StdErr $caddyErr
 $cloudflaredProcess = Start-ManagedProcess -Name 'Cloudflared' -FilePath 'cloudflared' -Arguments @('tunnel', '--protocol', 'http2', '--config', $cloudflaredConfig, 'run') -WorkingDirectory $repoRoot -StdOut $cloudOut -StdErr $cloudErr
 
@@ -87,6 +87,11 @@ function New-TarArchive {
         '--exclude=backend/__pycache__',
         '--exclude=backend/backup_storage',
         '--exclude=backend/reference_photos',
+        '--exclude=backend/reference_chips',
+        '--exclude=backend/face_gallery',
+        '--exclude=backend/face_gallery_reencode',
+        '--exclude=backend/face_cascade_stats.json',
+        '--exclude=backend/face_cache.db*',
         '--exclude=backend/uploaded_photos',
         '--exclude=backend/temp_pdf',
         '--exclude=familyone-vps-*.tar',
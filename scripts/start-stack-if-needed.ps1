@@ -67,7 +67,7 @@ function Start-RuntimeProcesses {
 
     # Kill stale processes
     Get-CimInstance Win32_Process -Filter "Name = 'python.exe'" -ErrorAction SilentlyContinue |
-        Where-Object { $_.CommandLine -like "*telegram_service*" -or $_.CommandLine -like "*backend*" } |
+        Where-Object { $_.CommandLine -like "*telegram_service*" -or $_.CommandLine -like "*run_server*" -or $_.CommandLine -like "*backend*" } |
         ForEach-Object { Stop-Process -Id $_.ProcessId -Force -ErrorAction SilentlyContinue }
     Get-Process -Name 'caddy' -ErrorAction SilentlyContinue | Stop-Process -Force -ErrorAction SilentlyContinue
     Start-Sleep -Seconds 2
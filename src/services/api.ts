@@ -840,9 +840,12 @@ export function adminFaces(deviceId?: string | number): Promise<AdminFacesRespon
 
 export function adminDeleteFace(
   faceId: number,
-  deviceId?: string | number
+  deviceId?: string | number,
+  memberId?: string | null
 ): Promise<{ success: boolean; error?: string }> {
-  return request(`/v2/admin/faces/${faceId}`, 'DELETE', {
+  // The list position can point at another face after a delete; the member id cannot.
+  const query = memberId ? `?member_id=${encodeURIComponent(memberId)}` : ''
+  return request(`/v2/admin/faces/${faceId}${query}`, 'DELETE', {
     headers: buildDeviceHeaders('', deviceId)
   })
 }
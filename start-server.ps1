@@ -611,7 +611,8 @@ if (Test-Path $pidsFile) {
 # РЈР±РёРІР°РµРј РІСЃРµ РѕСЃС‚Р°РІС€РёРµСЃСЏ Python-РїСЂРѕС†РµСЃСЃС‹ (С‡С‚РѕР±С‹ РЅРµ Р±С‹Р»Рѕ Р·РѕРјР±Рё СЃРѕ СЃС‚Р°СЂС‹Рј РєРѕРґРѕРј)
 Stop-MatchingProcesses -ProcessName 'python' -FriendlyName 'Python' -DelaySeconds 2 -MatchTerms @(
     $backendDir,
-    'telegram_service.py'
+    'telegram_service.py',
+    'run_server.py'
 )
 
 # Stop orphaned project Caddy processes that can keep admin port 2019 busy.